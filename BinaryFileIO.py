@@ -6,7 +6,20 @@
 # 05/21/2021
 # ----------------------------------------------------------------------
 
+import mmap
+import os
 import struct
+import zlib
+from typing import Tuple
+
+# number of bytes BinaryFileWriter gathers before writing them to the file
+BUFFER_SIZE = 1 << 20
+
+# little endian formats of the values MappedFileReader unpacks in place
+UBYTE = struct.Struct('<B')
+USHORT = struct.Struct('<H')
+UINT = struct.Struct('<I')
+ULONG = struct.Struct('<Q')
 
 # ----------------------------------------------------------------------
 
@@ -14,12 +27,20 @@ class BinaryFileWriter:
 
     # ------------------------------------------------------------------
 
-    def __init__(self, filename: str):
+    def __init__(self, filename):
         """
         open file for writing in binary format
-        :param filename: path of file to create/open
+        :param filename: path of file to create/open, or a binary file object to write to
         """
-        self.outfile = open(filename, "wb")
+        # file objects are written to but left open by close
+        self.ownsFile = isinstance(filename, (str, bytes, os.PathLike))
+        self.outfile = open(filename, "wb") if self.ownsFile else filename
+        # completed bytes waiting to be written to the file in one large write
+        self.buffer = bytearray()
+        self.bytesWritten = 0
+        # CRC-32 of the bytes written to the file so far
+        self.crc = 0
+        # accumulator of bits not yet moved to the buffer, the oldest bit is the leftmost
         self.bitValue = 0
         self.numberOfBits = 0
 
@@ -35,8 +56,8 @@ class BinaryFileWriter:
         assert 0 <= value < 256
 
         self.__flushBits()
-        s = struct.pack('<B', value)
-        self.outfile.write(s)
+        self.buffer += struct.pack('<B', value)
+        self.__checkBuffer()
 
     # ------------------------------------------------------------------
 
@@ -50,8 +71,8 @@ class BinaryFileWriter:
         assert 0 <= value < 65536
 
         self.__flushBits()
-        s = struct.pack('<H', value)
-        self.outfile.write(s)
+        self.buffer += struct.pack('<H', value)
+        self.__checkBuffer()
 
     # ------------------------------------------------------------------
 
@@ -66,8 +87,35 @@ class BinaryFileWriter:
         assert 0 <= value < 2 ** 32
 
         self.__flushBits()
-        s = struct.pack('<I', value)
-        self.outfile.write(s)
+        self.buffer += struct.pack('<I', value)
+        self.__checkBuffer()
+
+    # ------------------------------------------------------------------
+
+    def writeULong(self, value: int):
+        """
+        write value (0 to 2**64 - 1) to file as 64 bits
+        :param value: integer value 0 to 2**64 - 1 to write
+        :return: None
+        """
+
+        assert 0 <= value < 2 ** 64
+
+        self.__flushBits()
+        self.buffer += struct.pack('<Q', value)
+        self.__checkBuffer()
+
+    # ------------------------------------------------------------------
+
+    def writeBytes(self, data):
+        """
+        write a sequence of bytes to file
+        :param data: bytes-like object to write
+        :return: None
+        """
+        self.__flushBits()
+        self.buffer += data
+        self.__checkBuffer()
 
     # ------------------------------------------------------------------
 
@@ -79,13 +127,72 @@ class BinaryFileWriter:
         :return: None
         """
         assert bit == 0 or bit == 1
-        self.bitValue = (self.bitValue << 1) + bit
-        self.numberOfBits += 1
-        if self.numberOfBits == 8 or flushByte:
+        self.writeBits(bit, 1)
+        if flushByte:
             self.__flushBits()
 
     # ------------------------------------------------------------------
 
+    def writeBits(self, code: int, length: int):
+        """
+        write the rightmost length bits of code to file, leftmost bit first
+        :param code: integer 0 to 2**length - 1 holding the bits to write
+        :param length: number of bits to write
+        :return: None
+        """
+        self.bitValue = (self.bitValue << length) | code
+        self.numberOfBits += length
+        if self.numberOfBits >= 64:
+            self.__moveWords()
+
+    # ------------------------------------------------------------------
+
+    def bitPosition(self) -> int:
+        """
+        number of bits written so far, including bits not yet written to the file
+        :return: position of the next bit to be written, counted from the start of the file
+        """
+        return (self.bytesWritten + len(self.buffer)) * 8 + self.numberOfBits
+
+    # ------------------------------------------------------------------
+
+    def checksum(self) -> int:
+        """
+        CRC-32 of every byte written so far; a partly written byte is finished with zero bits first,
+        as writing any whole value would
+        :return: the checksum
+        """
+        self.__flushBits()
+        return zlib.crc32(self.buffer, self.crc)
+
+    # ------------------------------------------------------------------
+
+    def takeBits(self) -> Tuple[int, int]:
+        """
+        take the bits not yet moved to the buffer so they can be packed together with the bits that follow
+        :return: (value of the pending bits, number of pending bits), fewer than 64 bits
+        """
+        bits, numberOfBits = self.bitValue, self.numberOfBits
+        self.bitValue = 0
+        self.numberOfBits = 0
+        return bits, numberOfBits
+
+    # ------------------------------------------------------------------
+
+    def __moveWords(self):
+        """
+        helper method to move complete 64 bit words from the accumulator to the buffer
+        :return: None
+        """
+        while self.numberOfBits >= 64:
+            self.numberOfBits -= 64
+            word = (self.bitValue >> self.numberOfBits) & 0xFFFFFFFFFFFFFFFF
+            self.buffer += word.to_bytes(8, "big")
+        self.bitValue &= (1 << self.numberOfBits) - 1
+        self.__checkBuffer()
+
+    # ------------------------------------------------------------------
+
     def __flushBits(self):
         """
         helper method to finish writing bits to file
@@ -94,12 +201,23 @@ class BinaryFileWriter:
         # if some data to write
         if self.numberOfBits != 0:
             # shift bits to left so data is in leftmost bits and rightmost bits that are not part of data are zero
-            self.bitValue = self.bitValue << (8 - self.numberOfBits)
-            # reset for next bits to be written and prevents infinite recursion
-            self.numberOfBits = 0
-            # write data
-            self.writeUByte(self.bitValue)
+            padding = -self.numberOfBits % 8
+            self.buffer += (self.bitValue << padding).to_bytes((self.numberOfBits + padding) // 8, "big")
             self.bitValue = 0
+            self.numberOfBits = 0
+
+    # ------------------------------------------------------------------
+
+    def __checkBuffer(self):
+        """
+        helper method to write the buffer to file once it is large
+        :return: None
+        """
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.crc = zlib.crc32(self.buffer, self.crc)
+            self.outfile.write(self.buffer)
+            self.bytesWritten += len(self.buffer)
+            self.buffer = bytearray()
 
     # ------------------------------------------------------------------
 
@@ -109,7 +227,14 @@ class BinaryFileWriter:
         :return: None
         """
         self.__flushBits()
-        self.outfile.close()
+        self.crc = zlib.crc32(self.buffer, self.crc)
+        self.outfile.write(self.buffer)
+        self.bytesWritten += len(self.buffer)
+        self.buffer = bytearray()
+        if self.ownsFile:
+            self.outfile.close()
+        else:
+            self.outfile.flush()
 
     # ------------------------------------------------------------------
 
@@ -117,12 +242,14 @@ class BinaryFileWriter:
 
 class BinaryFileReader:
 
-    def __init__(self, filename: str):
+    def __init__(self, filename):
         """
         open a file for reading as binary data
-        :param filename: path to file to open
+        :param filename: path to file to open, or a binary file object to read from
         """
-        self.infile = open(filename, "rb")
+        # file objects are read from but left open by close
+        self.ownsFile = isinstance(filename, (str, bytes, os.PathLike))
+        self.infile = open(filename, "rb") if self.ownsFile else filename
         self.bitValue = 0
         self.numberOfBits = 0
 
@@ -170,6 +297,20 @@ class BinaryFileReader:
 
     # ------------------------------------------------------------------
 
+    def readULong(self) -> int:
+        """
+        read 64 bits from file
+        :return: value of the 64 bits read from 0 to 2**64 - 1
+        """
+        self._resetBits()
+        s = self.infile.read(8)
+        if len(s) != 8:
+            raise ValueError("ReadBitFile.readULong error")
+        v = struct.unpack('<Q', s)[0]
+        return v
+
+    # ------------------------------------------------------------------
+
     def readBit(self) -> int:
         """
         read a single bit from file
@@ -190,6 +331,42 @@ class BinaryFileReader:
 
     # ------------------------------------------------------------------
 
+    def readBytes(self, size: int) -> bytes:
+        """
+        read up to size bytes from file
+        :param size: number of bytes to read
+        :return: the bytes read, fewer than size only at the end of the file
+        """
+        self._resetBits()
+        return self.infile.read(size)
+
+    # ------------------------------------------------------------------
+
+    def takeBits(self) -> Tuple[int, int]:
+        """
+        take the bits of the current byte that have not been read yet so decoding can continue elsewhere
+        :return: (value of the unread bits, number of unread bits)
+        """
+        if self.numberOfBits == 0:
+            bits = 0
+        else:
+            bits = (self.bitValue & 255) >> (8 - self.numberOfBits)
+        numberOfBits = self.numberOfBits
+        self._resetBits()
+        return bits, numberOfBits
+
+    # ------------------------------------------------------------------
+
+    def readRemaining(self) -> Tuple[int, int, bytes]:
+        """
+        read everything left in the file in a single call
+        :return: (value of the unread bits of the current byte, number of those bits, remaining bytes)
+        """
+        bits, numberOfBits = self.takeBits()
+        return bits, numberOfBits, self.infile.read()
+
+    # ------------------------------------------------------------------
+
     def _resetBits(self):
         """
         helper method to start reading bits again
@@ -205,6 +382,197 @@ class BinaryFileReader:
         close the file
         :return: None
         """
+        if self.ownsFile:
+            self.infile.close()
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
+
+class MappedFileReader:
+    """
+    Reads a file through a read-only memory map instead of file calls. Values are unpacked in place with
+    struct.unpack_from, bits are read at a bit offset into the map, and readBytes/readRemaining return
+    memoryview slices of the map, so the data of the file is never copied as a whole.
+    Views handed out by readBytes and readRemaining should be dropped before calling close.
+    """
+
+    # ------------------------------------------------------------------
+
+    def __init__(self, filename):
+        """
+        map a file for reading as binary data
+        :param filename: path to file to open
+        """
+        self.infile = open(filename, "rb")
+        self.size = os.fstat(self.infile.fileno()).st_size
+        # an empty file cannot be mapped
+        self.map = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.view = memoryview(self.map if self.map is not None else b"")
+        # offset of the next bit to read, counted from the start of the file
+        self.bitOffset = 0
+
+    # ------------------------------------------------------------------
+
+    def readUByte(self) -> int:
+        """
+        read 8 bits from file
+        :return: value of the 8 bits read from 0 to 255
+        """
+        return self.__unpack(UBYTE)
+
+    # ------------------------------------------------------------------
+
+    def readUShort(self) -> int:
+        """
+        read 16 bits from file
+        :return: value of the 16 bits read from 0 to 65535
+        """
+        return self.__unpack(USHORT)
+
+    # ------------------------------------------------------------------
+
+    def readUInt(self) -> int:
+        """
+        read 32 bits from file
+        :return: value of the 32 bits read from 0 to 2**32 - 1
+        """
+        return self.__unpack(UINT)
+
+    # ------------------------------------------------------------------
+
+    def readULong(self) -> int:
+        """
+        read 64 bits from file
+        :return: value of the 64 bits read from 0 to 2**64 - 1
+        """
+        return self.__unpack(ULONG)
+
+    # ------------------------------------------------------------------
+
+    def readBit(self) -> int:
+        """
+        read a single bit from file
+        :return: 0 or 1 that was read
+        """
+        offset = self.bitOffset
+        if offset >= self.size * 8:
+            raise ValueError("MappedFileReader.readBit error")
+        self.bitOffset = offset + 1
+        return (self.view[offset >> 3] >> (7 - (offset & 7))) & 1
+
+    # ------------------------------------------------------------------
+
+    def peekBits(self, length: int) -> int:
+        """
+        look at the next bits without reading them; bits past the end of the file are 0
+        :param length: number of bits, 0 to 64
+        :return: value of the bits, the first bit leftmost
+        """
+        assert 0 <= length <= 64
+
+        # the bits lie in a window of at most 9 bytes starting at the byte holding the next bit
+        start = self.bitOffset >> 3
+        skip = self.bitOffset & 7
+        windowSize = (skip + length + 7) >> 3
+        window = self.view[start:start + windowSize]
+        value = int.from_bytes(window, "big") << 8 * (windowSize - len(window))
+        return (value >> (8 * windowSize - skip - length)) & ((1 << length) - 1)
+
+    # ------------------------------------------------------------------
+
+    def readBits(self, length: int) -> int:
+        """
+        read several bits from file
+        :param length: number of bits, 0 to 64
+        :return: value of the bits, the first bit leftmost
+        """
+        if self.bitOffset + length > self.size * 8:
+            raise ValueError("MappedFileReader.readBits error")
+        value = self.peekBits(length)
+        self.bitOffset += length
+        return value
+
+    # ------------------------------------------------------------------
+
+    def readBytes(self, size: int) -> memoryview:
+        """
+        read up to size bytes from file without copying them
+        :param size: number of bytes to read
+        :return: view of the bytes read, fewer than size only at the end of the file
+        """
+        start = self.tell()
+        data = self.view[start:start + size]
+        self.bitOffset = (start + len(data)) * 8
+        return data
+
+    # ------------------------------------------------------------------
+
+    def takeBits(self) -> Tuple[int, int]:
+        """
+        take the bits of the current byte that have not been read yet so decoding can continue elsewhere
+        :return: (value of the unread bits, number of unread bits)
+        """
+        numberOfBits = -self.bitOffset % 8
+        return self.readBits(numberOfBits), numberOfBits
+
+    # ------------------------------------------------------------------
+
+    def readRemaining(self) -> Tuple[int, int, memoryview]:
+        """
+        read everything left in the file without copying it
+        :return: (value of the unread bits of the current byte, number of those bits, view of the remaining bytes)
+        """
+        bits, numberOfBits = self.takeBits()
+        return bits, numberOfBits, self.readBytes(self.size)
+
+    # ------------------------------------------------------------------
+
+    def seek(self, offset: int) -> None:
+        """
+        continue reading at a byte of the file
+        :param offset: position of the byte, counted from the start of the file
+        :return: None
+        """
+        self.bitOffset = offset * 8
+
+    # ------------------------------------------------------------------
+
+    def tell(self) -> int:
+        """
+        position of the next byte to read; the unread bits of a partly read byte are skipped
+        :return: position counted from the start of the file
+        """
+        return (self.bitOffset + 7) >> 3
+
+    # ------------------------------------------------------------------
+
+    def __unpack(self, fmt: struct.Struct) -> int:
+        """
+        helper method to unpack a value in place at the next whole byte
+        :param fmt: format of the value
+        :return: the value
+        """
+        start = self.tell()
+        if start + fmt.size > self.size:
+            raise ValueError("MappedFileReader.read error")
+        self.bitOffset = (start + fmt.size) * 8
+        return fmt.unpack_from(self.view, start)[0]
+
+    # ------------------------------------------------------------------
+
+    def close(self):
+        """
+        unmap and close the file
+        :return: None
+        """
+        self.view.release()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # views from readBytes are still in use; the map is closed once they are freed
+                pass
         self.infile.close()
 
     # ------------------------------------------------------------------
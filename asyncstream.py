@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# asyncstream.py
+#
+# asyncio streaming compression and decompression. AsyncEncoder turns chunks of data into a block
+# container .hc stream and AsyncDecoder turns such a stream back into data, both producing output as
+# soon as a block is complete. Compressing and decoding a block runs on an executor, so the event loop
+# is only ever busy with copying chunks and writing headers.
+# ----------------------------------------------------------------------
+
+import asyncio
+import io
+from concurrent.futures import Executor
+from typing import AsyncIterator, Optional, Tuple
+
+from BinaryFileIO import BinaryFileWriter, BinaryFileReader
+from canonical import FORMAT_MARKER, VERSION_BLOCKS, FLAG_CHECKSUMS, FLAG_STREAMS, HEADER_SIZE, readLengths
+from compress import BlockIndex, blockFlags, compressBlock, writeBlockHeader
+from decompress import CHECKSUMS_SIZE, checkBlockLength, decompressBlock
+
+# number of bytes in each block of a stream; smaller than the block size of compress.py so that each block
+# is handed back quickly and an executor call stays short
+STREAM_BLOCK_SIZE = 1 << 16
+
+# number of bytes read from a StreamReader at a time
+READ_SIZE = 1 << 16
+
+# ----------------------------------------------------------------------
+
+async def _chunks(source) -> AsyncIterator[bytes]:
+    """
+    read the chunks of a source
+    :param source: asyncio StreamReader, read until end of stream, or async iterable of bytes-like chunks
+    :return: async iterator over the chunks
+    """
+    if isinstance(source, asyncio.StreamReader):
+        chunk = await source.read(READ_SIZE)
+        while chunk:
+            yield chunk
+            chunk = await source.read(READ_SIZE)
+    else:
+        async for chunk in source:
+            yield chunk
+
+# ----------------------------------------------------------------------
+
+class AsyncEncoder:
+    """
+    Compresses a stream of chunks into a block container, as written by compress.py --jobs,
+    that decompress.py and AsyncDecoder can read.
+    """
+
+    def __init__(self, blockSize: int = STREAM_BLOCK_SIZE, executor: Optional[Executor] = None,
+                 checkpointInterval: int = 0, backend: str = "auto", maxCodeLength: Optional[int] = None,
+                 streams: int = 1):
+        """
+        :param blockSize: number of bytes in each block
+        :param executor: executor to compress blocks on; None for the event loop's default thread pool.
+                         A ProcessPoolExecutor also runs the blocks of concurrent streams in parallel; it should
+                         use the forkserver or spawn start method, since forked workers inherit open sockets
+        :param checkpointInterval: number of bytes between checkpoints of a seekable stream, 0 for none
+        :param backend: backend to count frequencies and encode with
+        :param maxCodeLength: longest code allowed, None for no limit
+        :param streams: number of interleaved streams to split every block into; cannot be combined with checkpoints
+        """
+        if streams > 1 and checkpointInterval > 0:
+            raise ValueError("AsyncEncoder error: blocks split into streams cannot have checkpoints")
+        self.blockSize = blockSize
+        self.executor = executor
+        self.checkpointInterval = checkpointInterval
+        self.backend = backend
+        self.maxCodeLength = maxCodeLength
+        self.streams = streams
+        self.flags = blockFlags(checkpointInterval, streams)
+
+        self.buffer = bytearray()
+        self.started = False
+        self.finished = False
+        self.index = BlockIndex()
+
+    # ------------------------------------------------------------------
+
+    async def compress(self, data) -> bytes:
+        """
+        add data to the stream
+        :param data: bytes-like object following the data added before
+        :return: compressed bytes of the blocks completed by data, possibly none
+        """
+        if self.finished:
+            raise ValueError("AsyncEncoder error: stream is already flushed")
+        self.buffer += data
+
+        out = [self._header()]
+        while len(self.buffer) >= self.blockSize:
+            block = bytes(self.buffer[:self.blockSize])
+            del self.buffer[:self.blockSize]
+            out.append(await self._compressBlock(block))
+
+        return b"".join(out)
+
+    # ------------------------------------------------------------------
+
+    async def flush(self) -> bytes:
+        """
+        end the stream
+        :return: compressed bytes of the last block, the block index and the trailer
+        """
+        if self.finished:
+            return b""
+
+        out = [self._header()]
+        if self.buffer:
+            out.append(await self._compressBlock(bytes(self.buffer)))
+            self.buffer = bytearray()
+
+        end = io.BytesIO()
+        bitWriter = BinaryFileWriter(end)
+        self.index.write(bitWriter, self.flags)
+        bitWriter.close()
+        out.append(end.getvalue())
+
+        self.finished = True
+        return b"".join(out)
+
+    # ------------------------------------------------------------------
+
+    async def encode(self, source) -> AsyncIterator[bytes]:
+        """
+        compress everything from a source
+        :param source: asyncio StreamReader or async iterable of bytes-like chunks
+        :return: async iterator over the compressed chunks, one for each block, ending with the index
+        """
+        async for chunk in _chunks(source):
+            compressed = await self.compress(chunk)
+            if compressed:
+                yield compressed
+        yield await self.flush()
+
+    # ------------------------------------------------------------------
+
+    def _header(self) -> bytes:
+        """
+        get the header, once at the start of the stream
+        :return: the header the first time it is called, no bytes after that
+        """
+        if self.started:
+            return b""
+        self.started = True
+
+        header = io.BytesIO()
+        bitWriter = BinaryFileWriter(header)
+        writeBlockHeader(bitWriter, self.flags, self.blockSize)
+        bitWriter.close()
+        return header.getvalue()
+
+    # ------------------------------------------------------------------
+
+    async def _compressBlock(self, data: bytes) -> bytes:
+        """
+        compress one block on the executor and add it to the block index
+        :param data: the bytes of the block
+        :return: the compressed block
+        """
+        loop = asyncio.get_running_loop()
+        rawLength, block, checkpoints = await loop.run_in_executor(
+            self.executor, compressBlock, data, self.checkpointInterval, self.backend, self.maxCodeLength,
+            self.streams)
+
+        self.index.addData(data)
+        self.index.addBlock(rawLength, block, checkpoints)
+        return block
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
+
+class AsyncDecoder:
+    """
+    Decompresses a block container stream as its chunks arrive. Each block is decoded once all of it
+    has arrived; the block index after the last block is not needed and is skipped.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None):
+        """
+        :param executor: executor to decode blocks on; None for the event loop's default thread pool
+        """
+        self.executor = executor
+        self.buffer = bytearray()
+        self.started = False
+        self.finished = False
+        self.flags = 0
+        # block size from the header, which no block is larger than
+        self.blockSize = 0
+        # number of blocks decoded, to name a corrupt block
+        self.blocks = 0
+        # (amount of bytes, code lengths, payload length) of a block whose payload has not all arrived
+        self.block: Optional[Tuple[int, dict, int]] = None
+
+    # ------------------------------------------------------------------
+
+    async def decompress(self, data) -> bytes:
+        """
+        add compressed bytes
+        :param data: bytes-like object following the compressed bytes added before
+        :return: decompressed bytes of the blocks completed by data, possibly none
+        """
+        if self.finished:
+            # the block index and trailer follow the last block
+            return b""
+        self.buffer += data
+
+        out = []
+        if not self.started:
+            if len(self.buffer) < HEADER_SIZE:
+                return b""
+            self._readHeader()
+
+        while not self.finished:
+            if self.block is None:
+                self.block = self._readBlockHeader()
+                if self.block is None:
+                    break
+                try:
+                    checkBlockLength(self.block[0], self.block[2], self.blockSize)
+                except ValueError as error:
+                    raise ValueError("Block %d: %s" % (self.blocks, error))
+            rawLength, lengths, payloadLength = self.block
+            blockLength = payloadLength + (CHECKSUMS_SIZE if self.flags & FLAG_CHECKSUMS else 0)
+            if len(self.buffer) < blockLength:
+                break
+
+            # The checksum of the block's data follows the payload
+            payload = bytes(self.buffer[:payloadLength])
+            checksum = None
+            if self.flags & FLAG_CHECKSUMS:
+                checksum = int.from_bytes(self.buffer[payloadLength:payloadLength + 4], "little")
+            del self.buffer[:blockLength]
+            self.block = None
+            loop = asyncio.get_running_loop()
+            try:
+                out.append(await loop.run_in_executor(self.executor, decompressBlock, rawLength, lengths, payload,
+                                                      checksum, bool(self.flags & FLAG_STREAMS)))
+            except ValueError as error:
+                raise ValueError("Block %d: %s" % (self.blocks, error))
+            self.blocks += 1
+
+        return b"".join(out)
+
+    # ------------------------------------------------------------------
+
+    async def flush(self) -> bytes:
+        """
+        end the stream, checking that it was complete
+        :return: no bytes, every block is returned by decompress once it has arrived
+        """
+        if not self.finished:
+            raise ValueError("Compressed stream is truncated")
+        return b""
+
+    # ------------------------------------------------------------------
+
+    async def decode(self, source) -> AsyncIterator[bytes]:
+        """
+        decompress everything from a source
+        :param source: asyncio StreamReader or async iterable of bytes-like chunks of compressed data
+        :return: async iterator over the decompressed chunks, one for each block
+        """
+        async for chunk in _chunks(source):
+            data = await self.decompress(chunk)
+            if data:
+                yield data
+        await self.flush()
+
+    # ------------------------------------------------------------------
+
+    def _readHeader(self) -> None:
+        """
+        check and drop the header at the start of the stream, keeping its flags and block size
+        :return: None
+        """
+        reader = BinaryFileReader(io.BytesIO(self.buffer[:HEADER_SIZE]))
+        if reader.readUInt() != FORMAT_MARKER or reader.readUByte() != VERSION_BLOCKS:
+            raise ValueError("AsyncDecoder error: stream is not a block container")
+        self.flags = reader.readUByte()
+        self.blockSize = reader.readUInt()
+        del self.buffer[:HEADER_SIZE]
+        self.started = True
+
+    # ------------------------------------------------------------------
+
+    def _readBlockHeader(self) -> Optional[Tuple[int, dict, int]]:
+        """
+        read the amount of bytes, code lengths and payload length at the start of a block
+        :return: (amount of bytes, code lengths, payload length), or None if they have not all arrived
+                 or the stream has ended
+        """
+        stream = io.BytesIO(self.buffer)
+        reader = BinaryFileReader(stream)
+        try:
+            rawLength = reader.readUInt()
+            if rawLength == 0:
+                # a block of 0 bytes ends the blocks
+                self.finished = True
+                self.buffer = bytearray()
+                return None
+            lengths = readLengths(reader)
+            payloadLength = reader.readUInt()
+        except ValueError:
+            # running out of bytes means the rest of the block header is still to come
+            if stream.tell() >= len(self.buffer):
+                return None
+            raise
+
+        del self.buffer[:stream.tell()]
+        return rawLength, lengths, payloadLength
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
@@ -0,0 +1,1263 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# benchmark.py
+#
+# Timing harness for the Huffman compressor and decompressor.
+# usage: python benchmark.py decode --sizes 1M,10M,100M,1G
+#        python benchmark.py memory --sizes 16M,64M,256M,1G
+#        python benchmark.py parallel --size 64M --jobs 1,2,4,8
+#        python benchmark.py seek --size 64M --reads 1000
+#        python benchmark.py backends --sizes 10M,100M,1G
+#        python benchmark.py tables --files 10000
+#        python benchmark.py batch --files 1000 --jobs 1,4
+#        python benchmark.py limits --limits 8,10,12,15
+#        python benchmark.py context --size 4M
+#        python benchmark.py sampled --size 4M --samples 4K,64K
+#        python benchmark.py tokens --size 2M --alphabets 300,512,1024
+#        python benchmark.py streams --size 16M --streams 1,2,4,8 --jobs 1,4
+#        python benchmark.py echo --streams 1,8,32 --size 256K
+#        python benchmark.py suite --quick --json results.json --compare baseline.json
+#        python benchmark.py optimality
+# ----------------------------------------------------------------------
+
+import asyncio
+import heapq
+import json
+import math
+import multiprocessing
+import os
+import platform
+import filecmp
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import compress
+import stats
+from asyncstream import AsyncEncoder, AsyncDecoder
+import decompress
+import vectorized
+from BinaryFileIO import BinaryFileReader, MappedFileReader
+from canonical import ALPHABET_SIZE
+from tokens import Tokenizer
+
+# ----------------------------------------------------------------------
+
+MB = 1 << 20
+
+# directory of compress.py and decompress.py, which are run as scripts by some benchmarks
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# vocabulary for generated text, most frequent words first
+WORDS = ["the", "of", "and", "to", "in", "a", "is", "that", "for", "it", "as", "was", "with", "be", "by",
+         "on", "not", "he", "this", "are", "or", "his", "from", "at", "which", "but", "have", "an", "had",
+         "they", "you", "were", "their", "one", "all", "we", "can", "her", "has", "there", "been", "if",
+         "more", "when", "will", "would", "who", "so", "no", "Huffman", "compression", "tree", "code",
+         "frequency", "symbol", "bit", "byte", "file", "table", "value"]
+
+# ----------------------------------------------------------------------
+
+def parseSize(text: str) -> int:
+
+    # Sizes are a number with an optional K, M or G suffix
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def formatSize(size: int) -> str:
+
+    for suffix, unit in (("G", 1 << 30), ("M", 1 << 20), ("K", 1 << 10)):
+        if size >= unit and size % unit == 0:
+            return str(size // unit) + suffix
+    return str(size)
+
+def generateText(filename: str, size: int, seed: int = 0) -> None:
+
+    # Writing Zipf distributed words from WORDS, one piece at a time so the text is never held in memory
+    rand = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    outfile = open(filename, "w", newline="")
+    written = 0
+    while written < size:
+        words = rand.choices(WORDS, weights, k=10000)
+        # Splitting the piece into lines of ten words
+        lines = [" ".join(words[i:i + 10]) for i in range(0, len(words), 10)]
+        piece = "\n".join(lines) + "\n"
+        piece = piece[:size - written]
+        outfile.write(piece)
+        written += len(piece)
+    outfile.close()
+
+def compressFile(sourceFile: str, compressedFile: str) -> None:
+
+    # Same steps as compress.main
+    data = compress.readData(sourceFile)
+    priorityQueue = compress.createPriorityQueue(compress.readFrequencies(data))
+    key = compress.createKey(compress.createTree(priorityQueue))
+    compress.compress(data, key, compressedFile)
+
+# ----------------------------------------------------------------------
+
+def _readDataPerBit(binaryReader: BinaryFileReader, keyDict: Dict[str, str], totalBytes: int) -> str:
+
+    # Original decoding loop, looking up the code in keyDict after every bit
+    data = ""
+    while len(data) < totalBytes:
+        currentBitCode = ""
+        while currentBitCode not in keyDict:
+            currentBitCode += str(binaryReader.readBit())
+        data += keyDict[currentBitCode]
+
+    return data
+
+def timeDecode(compressedFile: str, perBit: bool, mapped: bool) -> float:
+
+    start = time.perf_counter()
+    binaryReader = MappedFileReader(compressedFile) if mapped else BinaryFileReader(compressedFile)
+    _, totalBytes, codes = decompress._readHeader(binaryReader, *decompress._readVersion(binaryReader))
+    if perBit:
+        keyDict = {format(code, "0%db" % length): chr(symbol) for symbol, length, code in codes}
+        _readDataPerBit(binaryReader, keyDict, totalBytes)
+    else:
+        decompress._readData(binaryReader, decompress.DecodeTable(codes, count=totalBytes), totalBytes)
+    binaryReader.close()
+
+    return time.perf_counter() - start
+
+def benchDecode(sizes: List[int], perBitLimit: int, workDir: str) -> None:
+
+    print("%8s  %-12s %10s %10s" % ("size", "decoder", "seconds", "MB/s"))
+    for size in sizes:
+        sourceFile = os.path.join(workDir, "decode-%d.txt" % size)
+        compressedFile = sourceFile + ".hc"
+        generateText(sourceFile, size)
+        compressFile(sourceFile, compressedFile)
+
+        decoders = [("table", False, False), ("table-mmap", False, True)]
+        if size <= perBitLimit:
+            decoders += [("per-bit", True, False), ("per-bit-mmap", True, True)]
+        for name, perBit, mapped in decoders:
+            seconds = timeDecode(compressedFile, perBit, mapped)
+            print("%8s  %-12s %10.3f %10.2f" % (formatSize(size), name, seconds, size / MB / seconds))
+
+        os.remove(sourceFile)
+        os.remove(compressedFile)
+
+def runMeasured(command: List[str]) -> Tuple[float, int]:
+
+    # Running the command as a child process and taking its peak RSS from its resource usage (Unix only)
+    start = time.perf_counter()
+    process = subprocess.Popen(command)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError("%s exited with status %d" % (" ".join(command), process.returncode))
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peakRss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return seconds, peakRss
+
+def benchMemory(sizes: List[int], workDir: str) -> None:
+
+    # Peak RSS of compress.py and decompress.py should not grow with the input size
+    print("%8s  %-12s %10s %10s %12s" % ("size", "stage", "seconds", "MB/s", "peak RSS MB"))
+    for size in sizes:
+        sourceFile = os.path.join(workDir, "memory-%d.txt" % size)
+        compressedFile = sourceFile + ".hc"
+        decompressedFile = sourceFile + ".out"
+        generateText(sourceFile, size)
+
+        stages = [("compress", [os.path.join(SCRIPT_DIR, "compress.py"), sourceFile, compressedFile]),
+                  ("decompress", [os.path.join(SCRIPT_DIR, "decompress.py"), compressedFile, decompressedFile])]
+        for name, command in stages:
+            seconds, peakRss = runMeasured([sys.executable] + command)
+            print("%8s  %-12s %10.3f %10.2f %12.1f" % (formatSize(size), name, seconds, size / MB / seconds,
+                                                       peakRss / MB))
+
+        if not filecmp.cmp(sourceFile, decompressedFile, shallow=False):
+            raise RuntimeError("decompressed file differs from the original")
+
+        for filename in (sourceFile, compressedFile, decompressedFile):
+            os.remove(filename)
+
+def benchParallel(size: int, jobCounts: List[int], blockSize: int, workDir: str) -> None:
+
+    # Block container throughput by number of worker processes, with the speedup over one worker
+    sourceFile = os.path.join(workDir, "parallel.txt")
+    compressedFile = sourceFile + ".hc"
+    decompressedFile = sourceFile + ".out"
+    generateText(sourceFile, size)
+
+    print("%8s  %6s  %-12s %10s %10s %8s" % ("size", "jobs", "stage", "seconds", "MB/s", "speedup"))
+    baseline = {}
+    for jobs in jobCounts:
+        start = time.perf_counter()
+        compress.compressBlocks(compress.readChunks(sourceFile, blockSize), compressedFile, jobs, blockSize)
+        compressSeconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decompress.decompress(compressedFile, decompressedFile, jobs)
+        decompressSeconds = time.perf_counter() - start
+
+        if not filecmp.cmp(sourceFile, decompressedFile, shallow=False):
+            raise RuntimeError("decompressed file differs from the original")
+
+        for stage, seconds in (("compress", compressSeconds), ("decompress", decompressSeconds)):
+            baseline.setdefault(stage, seconds)
+            print("%8s  %6d  %-12s %10.3f %10.2f %7.2fx" % (formatSize(size), jobs, stage, seconds,
+                                                            size / MB / seconds, baseline[stage] / seconds))
+
+    for filename in (sourceFile, compressedFile, decompressedFile):
+        os.remove(filename)
+
+def benchStreams(size: int, streamCounts: List[int], jobCounts: List[int], blockSize: int, workDir: str) -> None:
+
+    # Size and decode MB/s of block containers whose blocks are split into interleaved streams, against
+    # single stream blocks; with more than one job every stream is decoded on a worker of its own
+    sourceFile = os.path.join(workDir, "streams.txt")
+    compressedFile = os.path.join(workDir, "streams.hc")
+    decompressedFile = os.path.join(workDir, "streams.out")
+    generateText(sourceFile, size)
+    print("%s of text in %s blocks" % (formatSize(size), formatSize(blockSize)))
+
+    print("%8s %12s %10s" % ("streams", "bytes", "overhead") + "".join(" %12s" % ("%d jobs MB/s" % jobs)
+                                                                      for jobs in jobCounts))
+    singleSize = None
+    for streams in streamCounts:
+        compress.compressBlocks(compress.readChunks(sourceFile, blockSize), compressedFile, 1, blockSize,
+                                streams=streams)
+        compressedSize = os.path.getsize(compressedFile)
+        singleSize = singleSize or compressedSize
+
+        rates = []
+        for jobs in jobCounts:
+            start = time.perf_counter()
+            decompress.decompress(compressedFile, decompressedFile, jobs)
+            rates.append(size / MB / (time.perf_counter() - start))
+            if not filecmp.cmp(sourceFile, decompressedFile, shallow=False):
+                raise RuntimeError("decompressed file differs from the original")
+
+        print("%8d %12d %9.3f%%" % (streams, compressedSize, 100 * (compressedSize - singleSize) / singleSize)
+              + "".join(" %12.2f" % rate for rate in rates))
+
+    for filename in (sourceFile, compressedFile, decompressedFile):
+        os.remove(filename)
+
+def benchSeek(size: int, reads: int, readLength: int, jobCounts: List[int], workDir: str) -> None:
+
+    sourceFile = os.path.join(workDir, "seek.txt")
+    decompressedFile = sourceFile + ".out"
+    generateText(sourceFile, size)
+    original = open(sourceFile, "rb")
+
+    # Random small reads with HuffmanReader, with and without checkpoints inside the blocks
+    rand = random.Random(0)
+    offsets = [rand.randrange(size - readLength) for _ in range(reads)]
+    layouts = [("blocks", 0), ("seekable", compress.CHECKPOINT_INTERVAL)]
+    print("%8s  %-10s %8s %12s %12s %12s" % ("size", "layout", "reads", "mean ms", "p50 ms", "p99 ms"))
+    for name, checkpointInterval in layouts:
+        compressedFile = sourceFile + "." + name + ".hc"
+        compress.compressBlocks(compress.readChunks(sourceFile), compressedFile, 1,
+                                checkpointInterval=checkpointInterval)
+        latencies = []
+        with decompress.HuffmanReader(compressedFile) as reader:
+            for offset in offsets:
+                start = time.perf_counter()
+                data = reader.read(offset, readLength)
+                latencies.append(time.perf_counter() - start)
+                original.seek(offset)
+                if data != original.read(readLength):
+                    raise RuntimeError("read returned the wrong data")
+        latencies.sort()
+        print("%8s  %-10s %8d %12.3f %12.3f %12.3f" % (formatSize(size), name, reads,
+                                                       1000 * sum(latencies) / len(latencies),
+                                                       1000 * latencies[len(latencies) // 2],
+                                                       1000 * latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]))
+
+    # Full decode of the seekable file by number of processes, which split blocks at checkpoints
+    print()
+    print("%8s  %6s %10s %10s" % ("size", "jobs", "seconds", "MB/s"))
+    for jobs in jobCounts:
+        start = time.perf_counter()
+        decompress.decompress(sourceFile + ".seekable.hc", decompressedFile, jobs)
+        seconds = time.perf_counter() - start
+        if not filecmp.cmp(sourceFile, decompressedFile, shallow=False):
+            raise RuntimeError("decompressed file differs from the original")
+        print("%8s  %6d %10.3f %10.2f" % (formatSize(size), jobs, seconds, size / MB / seconds))
+
+    original.close()
+    for filename in [sourceFile, decompressedFile] + [sourceFile + "." + name + ".hc" for name, _ in layouts]:
+        os.remove(filename)
+
+def benchBackends(sizes: List[int], pythonLimit: int, workDir: str) -> None:
+
+    # Frequency counting and encoding with each backend; both must write the same compressed file
+    backends = ["python"] + (["numpy"] if vectorized.np is not None else [])
+    if vectorized.np is None:
+        print("NumPy is not installed, only the python backend is timed")
+
+    print("%8s  %-8s %12s %12s %10s %8s" % ("size", "backend", "frequencies", "encode", "MB/s", "speedup"))
+    for size in sizes:
+        sourceFile = os.path.join(workDir, "backend-%d.txt" % size)
+        generateText(sourceFile, size)
+
+        baseline = None
+        compressedFiles = []
+        for backend in backends:
+            if backend == "python" and size > pythonLimit:
+                continue
+            compressedFile = "%s.%s.hc" % (sourceFile, backend)
+            compressedFiles.append(compressedFile)
+
+            start = time.perf_counter()
+            frequencies = compress.readFileFrequencies(sourceFile, backend)
+            frequencySeconds = time.perf_counter() - start
+            key = compress.createKey(compress.createTree(compress.createPriorityQueue(frequencies)))
+            start = time.perf_counter()
+            compress.compressChunks(compress.readChunks(sourceFile), key, compressedFile, backend)
+            encodeSeconds = time.perf_counter() - start
+
+            # Speedup over the pure Python backend, when it was run on this size
+            seconds = frequencySeconds + encodeSeconds
+            if backend == "python":
+                baseline = seconds
+            speedup = "%7.2fx" % (baseline / seconds) if baseline else "%8s" % "-"
+            print("%8s  %-8s %12.3f %12.3f %10.2f %s" % (formatSize(size), backend, frequencySeconds,
+                                                         encodeSeconds, size / MB / seconds, speedup))
+
+        if len(compressedFiles) == 2 and not filecmp.cmp(*compressedFiles, shallow=False):
+            raise RuntimeError("the backends wrote different compressed files")
+
+        for filename in [sourceFile] + compressedFiles:
+            os.remove(filename)
+
+def _record(rand: random.Random, i: int) -> str:
+
+    # One JSON log or event record
+    return '{"id": %d, "user": "%s", "event": "%s", "size": %d, "message": "%s"}\n' % (
+        i, rand.choice(WORDS[:20]), rand.choice(["open", "read", "write", "close"]), rand.randint(0, 1 << 20),
+        " ".join(rand.choices(WORDS, k=rand.randint(3, 20))))
+
+def generateRecords(directory: str, count: int, seed: int = 0) -> List[str]:
+
+    # Small similar JSON records, one per file, like a stream of log or event records
+    rand = random.Random(seed)
+    files = []
+    for i in range(count):
+        record = _record(rand, i)
+        filename = os.path.join(directory, "record-%05d.json" % i)
+        outfile = open(filename, "w")
+        outfile.write(record)
+        outfile.close()
+        files.append(filename)
+
+    return files
+
+def benchTables(count: int, sampleCount: int, workDir: str) -> None:
+
+    # Files per second compressing and decompressing many small files with a key in every file
+    # against a pretrained table that is loaded once
+    recordDir = os.path.join(workDir, "records")
+    os.mkdir(recordDir)
+    files = generateRecords(recordDir, count)
+    tableFile = os.path.join(workDir, "records.hct")
+
+    start = time.perf_counter()
+    compress.trainTable(files[:sampleCount], tableFile)
+    print("trained on %d of %d files in %.3f seconds" % (min(sampleCount, count), count,
+                                                        time.perf_counter() - start))
+
+    print("%-10s %-12s %10s %12s %14s" % ("mode", "stage", "seconds", "files/s", "mean size"))
+    for mode in ("key", "table"):
+        start = time.perf_counter()
+        if mode == "table":
+            table = compress.loadTable(tableFile)
+        for filename in files:
+            if mode == "table":
+                compress.compressWithTable(compress.readChunks(filename), os.path.getsize(filename), table,
+                                           filename + ".hc")
+            else:
+                compressFile(filename, filename + ".hc")
+        compressSeconds = time.perf_counter() - start
+        meanSize = sum(os.path.getsize(filename + ".hc") for filename in files) / count
+
+        start = time.perf_counter()
+        for filename in files:
+            decompress.decompress(filename + ".hc", filename + ".out", tables=[tableFile])
+        decompressSeconds = time.perf_counter() - start
+
+        for filename in files:
+            if not filecmp.cmp(filename, filename + ".out", shallow=False):
+                raise RuntimeError("decompressed file differs from the original")
+
+        meanRaw = sum(os.path.getsize(filename) for filename in files) / count
+        print("%-10s %-12s %10.3f %12.0f %8.1f/%.1f" % (mode, "compress", compressSeconds, count / compressSeconds,
+                                                        meanSize, meanRaw))
+        print("%-10s %-12s %10.3f %12.0f" % (mode, "decompress", decompressSeconds, count / decompressSeconds))
+
+    shutil.rmtree(recordDir)
+    os.remove(tableFile)
+
+def benchBatch(count: int, size: int, jobCounts: List[int], workDir: str) -> None:
+
+    # A directory of files of different sizes up to size
+    sourceDir = os.path.join(workDir, "batch")
+    os.mkdir(sourceDir)
+    rand = random.Random(0)
+    total = 0
+    for i in range(count):
+        fileSize = rand.randint(1, size)
+        generateText(os.path.join(sourceDir, "file-%05d.txt" % i), fileSize, seed=i)
+        total += fileSize
+    names = sorted(os.listdir(sourceDir))
+    compressScript = os.path.join(SCRIPT_DIR, "compress.py")
+    decompressScript = os.path.join(SCRIPT_DIR, "decompress.py")
+
+    print("%d files, %.1f MB in total" % (count, total / MB))
+    print("%-14s %-12s %10s %10s %10s" % ("method", "stage", "seconds", "files/s", "MB/s"))
+
+    def report(method: str, stage: str, seconds: float) -> None:
+        print("%-14s %-12s %10.3f %10.1f %10.2f" % (method, stage, seconds, count / seconds, total / MB / seconds))
+
+    # One interpreter launch per file, as a shell loop over the directory does
+    loopDir = os.path.join(workDir, "loop")
+    os.mkdir(loopDir)
+    start = time.perf_counter()
+    for name in names:
+        subprocess.run([sys.executable, compressScript, os.path.join(sourceDir, name),
+                        os.path.join(loopDir, name + ".hc")], check=True, stdout=subprocess.DEVNULL)
+    report("loop", "compress", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for name in names:
+        subprocess.run([sys.executable, decompressScript, os.path.join(loopDir, name + ".hc")], check=True,
+                       stdout=subprocess.DEVNULL)
+    report("loop", "decompress", time.perf_counter() - start)
+    shutil.rmtree(loopDir)
+
+    # One launch for the whole directory, with the files spread over the worker processes
+    archiveFile = os.path.join(workDir, "batch.hc")
+    extractDir = os.path.join(workDir, "extracted")
+    for jobs in jobCounts:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, compressScript, sourceDir, archiveFile, "--batch", "--jobs", str(jobs)],
+                       check=True, stdout=subprocess.DEVNULL)
+        report("batch -j %d" % jobs, "compress", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, decompressScript, archiveFile, extractDir, "--jobs", str(jobs)], check=True,
+                       stdout=subprocess.DEVNULL)
+        report("batch -j %d" % jobs, "decompress", time.perf_counter() - start)
+
+        for name in names:
+            if not filecmp.cmp(os.path.join(sourceDir, name), os.path.join(extractDir, name), shallow=False):
+                raise RuntimeError("extracted file differs from the original")
+        shutil.rmtree(extractDir)
+        os.remove(archiveFile)
+
+    shutil.rmtree(sourceDir)
+
+def generateJson(filename: str, size: int, seed: int = 0) -> None:
+
+    # JSON records one per line, as a log file of them
+    rand = random.Random(seed)
+    outfile = open(filename, "w", newline="")
+    written = 0
+    i = 0
+    while written < size:
+        piece = "".join(_record(rand, i + j) for j in range(1000))[:size - written]
+        outfile.write(piece)
+        written += len(piece)
+        i += 1000
+    outfile.close()
+
+def generateBinary(filename: str, size: int, seed: int = 0) -> None:
+
+    # Fixed size little endian records of a sequence number, timestamp, small counter and flag byte,
+    # like a binary log or telemetry file
+    rand = random.Random(seed)
+    record = struct.Struct("<IdHB")
+    outfile = open(filename, "wb")
+    written = 0
+    i = 0
+    timestamp = 1.6e9
+    while written < size:
+        pieces = []
+        for _ in range(1000):
+            timestamp += rand.expovariate(10)
+            pieces.append(record.pack(i, timestamp, rand.randint(0, 300), rand.choice((0, 0, 0, 1, 4))))
+            i += 1
+        piece = b"".join(pieces)[:size - written]
+        outfile.write(piece)
+        written += len(piece)
+    outfile.close()
+
+def benchContext(size: int, workDir: str) -> None:
+
+    # Compressed size and MB/s of the order-1 context mode against the order-0 mode on each kind of data
+    corpora = [("text", generateText), ("json", generateJson), ("binary", generateBinary)]
+
+    print("%-8s %-8s %12s %8s %14s %16s" % ("corpus", "mode", "bytes", "ratio", "compress MB/s", "decompress MB/s"))
+    for name, generate in corpora:
+        sourceFile = os.path.join(workDir, "context-%s" % name)
+        generate(sourceFile, size)
+        compressedFile = sourceFile + ".hc"
+        decompressedFile = sourceFile + ".out"
+
+        for mode in ("order-0", "order-1"):
+            start = time.perf_counter()
+            if mode == "order-0":
+                key = compress.createKey(compress.createTree(compress.createPriorityQueue(
+                    compress.readFileFrequencies(sourceFile))))
+                compress.compressChunks(compress.readChunks(sourceFile), key, compressedFile)
+            else:
+                frequencies = compress.readFileContextFrequencies(sourceFile)
+                compress.compressContext(compress.readChunks(sourceFile), frequencies, size, compressedFile)
+            compressSeconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            decompress.decompress(compressedFile, decompressedFile)
+            decompressSeconds = time.perf_counter() - start
+            if not filecmp.cmp(sourceFile, decompressedFile, shallow=False):
+                raise RuntimeError("decompressed file differs from the original")
+
+            compressedSize = os.path.getsize(compressedFile)
+            print("%-8s %-8s %12d %8.3f %14.2f %16.2f" % (name, mode, compressedSize, size / compressedSize,
+                                                          size / MB / compressSeconds, size / MB / decompressSeconds))
+
+        for filename in (sourceFile, compressedFile, decompressedFile):
+            os.remove(filename)
+
+def generateMixed(filename: str, size: int, seed: int = 0) -> None:
+
+    # Text followed by binary records, so the statistics change halfway through the file
+    generateText(filename + ".text", size // 2, seed)
+    generateBinary(filename + ".binary", size - size // 2, seed)
+    outfile = open(filename, "wb")
+    for part in (filename + ".text", filename + ".binary"):
+        outfile.write(compress.readData(part))
+        os.remove(part)
+    outfile.close()
+
+def benchSampled(size: int, sampleSizes: List[int], workDir: str) -> None:
+
+    # Compressed size, bytes read and MB/s of single pass compression with tables estimated from samples
+    # against the exact two pass table, on data with steady statistics and on data whose statistics change
+    corpora = [("text", generateText), ("json", generateJson), ("binary", generateBinary), ("zipf", generateZipf),
+               ("mixed", generateMixed)]
+    modes = [("two-pass", None, False)] + [("head %s" % formatSize(sample), sample, False) for sample in sampleSizes] \
+        + [("strided %s" % formatSize(sample), sample, True) for sample in sampleSizes]
+
+    # Counting the bytes every read stage takes from the input file
+    bytesRead = [0]
+    def countReads(record: stats.StageRecord) -> None:
+        if record.name == "read":
+            bytesRead[0] += record.bytesOut
+    stats.addHook(countReads)
+
+    print("%-8s %-14s %12s %8s %8s %7s %12s %14s" % ("corpus", "mode", "bytes", "ratio", "loss %", "tables",
+                                                     "bytes read", "compress MB/s"))
+    try:
+        for name, generate in corpora:
+            sourceFile = os.path.join(workDir, "sampled-%s" % name)
+            generate(sourceFile, size)
+            compressedFile = sourceFile + ".hc"
+            decompressedFile = sourceFile + ".out"
+
+            exactSize = None
+            for mode, sampleSize, strided in modes:
+                bytesRead[0] = 0
+                start = time.perf_counter()
+                if sampleSize is None:
+                    key = compress.createKey(compress.createTree(compress.createPriorityQueue(
+                        compress.readFileFrequencies(sourceFile))))
+                    compress.compressChunks(compress.readChunks(sourceFile), key, compressedFile)
+                    tables = 1
+                else:
+                    infile = open(sourceFile, "rb")
+                    _, tables = compress.compressSampled(infile, compressedFile, sampleSize, strided)
+                    infile.close()
+                seconds = time.perf_counter() - start
+                read = bytesRead[0]
+
+                decompress.decompress(compressedFile, decompressedFile)
+                if not filecmp.cmp(sourceFile, decompressedFile, shallow=False):
+                    raise RuntimeError("decompressed file differs from the original")
+
+                compressedSize = os.path.getsize(compressedFile)
+                exactSize = exactSize or compressedSize
+                print("%-8s %-14s %12d %8.3f %8.2f %7d %12d %14.2f" % (
+                    name, mode, compressedSize, size / compressedSize, 100 * (compressedSize - exactSize) / exactSize,
+                    tables, read, size / MB / seconds))
+
+            for filename in (sourceFile, compressedFile, decompressedFile):
+                os.remove(filename)
+    finally:
+        stats.removeHook(countReads)
+
+async def _echoServer(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, executor) -> None:
+
+    # Decompressing the stream a client sends and sending the data back compressed, block by block
+    encoder = AsyncEncoder(executor=executor)
+    async for data in AsyncDecoder(executor).decode(reader):
+        writer.write(await encoder.compress(data))
+        await writer.drain()
+    writer.write(await encoder.flush())
+    await writer.drain()
+    writer.close()
+
+async def _echoClient(port: int, payload: bytes, executor) -> float:
+
+    # Seconds from connecting to having the whole payload back, sending and receiving at the same time
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def pieces():
+        for offset in range(0, len(payload), 1 << 14):
+            yield payload[offset:offset + (1 << 14)]
+
+    async def send():
+        async for chunk in AsyncEncoder(executor=executor).encode(pieces()):
+            writer.write(chunk)
+            await writer.drain()
+        writer.write_eof()
+
+    sending = asyncio.create_task(send())
+    received = b"".join([data async for data in AsyncDecoder(executor).decode(reader)])
+    await sending
+    writer.close()
+
+    if received != payload:
+        raise RuntimeError("echoed data differs from the data sent")
+    return time.perf_counter() - start
+
+async def _loopStall(stop: asyncio.Event) -> float:
+
+    # Longest time the event loop was late waking up from a 1 ms sleep, which is how long it was blocked
+    stall = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stall = max(stall, time.perf_counter() - start - 0.001)
+    return stall
+
+async def _benchEcho(payload: bytes, streamCounts: List[int], executor) -> None:
+
+    server = await asyncio.start_server(lambda reader, writer: _echoServer(reader, writer, executor), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    # One untimed stream first, so starting the workers is not counted
+    await _echoClient(port, payload, executor)
+
+    print("%8s %10s %10s %10s %10s %14s" % ("streams", "p50 ms", "p95 ms", "max ms", "MB/s", "loop stall ms"))
+    for streams in streamCounts:
+        stop = asyncio.Event()
+        stall = asyncio.create_task(_loopStall(stop))
+        start = time.perf_counter()
+        latencies = sorted(await asyncio.gather(*(_echoClient(port, payload, executor) for _ in range(streams))))
+        seconds = time.perf_counter() - start
+        stop.set()
+
+        print("%8d %10.1f %10.1f %10.1f %10.2f %14.1f" % (
+            streams, 1000 * latencies[len(latencies) // 2], 1000 * latencies[(len(latencies) * 95) // 100],
+            1000 * latencies[-1], streams * len(payload) / MB / seconds, 1000 * await stall))
+
+    server.close()
+    await server.wait_closed()
+
+def generateLog(filename: str, size: int, seed: int = 0) -> None:
+
+    # Lines of a server log with fields padded to fixed widths by runs of spaces and ending in "\r\n"
+    rand = random.Random(seed)
+    levels = ["INFO", "INFO", "INFO", "DEBUG", "WARNING", "ERROR"]
+    services = ["auth", "api-gateway", "billing", "search", "scheduler"]
+    outfile = open(filename, "w", newline="")
+    written = 0
+    seconds = 0
+    while written < size:
+        lines = []
+        for _ in range(1000):
+            seconds += rand.randint(0, 3)
+            lines.append("2021-12-02 %02d:%02d:%02d  %-8s %-14s %-40s %6d ms\r\n" % (
+                seconds // 3600 % 24, seconds // 60 % 60, seconds % 60, rand.choice(levels), rand.choice(services),
+                " ".join(rand.choices(WORDS[:30], k=rand.randint(1, 6))), rand.randint(1, 5000)))
+        piece = "".join(lines)[:size - written]
+        outfile.write(piece)
+        written += len(piece)
+    outfile.close()
+
+def _countLookups(table: decompress.DecodeTable, payload, count: int) -> int:
+
+    # Walking the payload as HuffmanDecoder does, counting the primary and secondary table lookups it takes
+    # to decode count bytes; each lookup peeks at a 64 bit window starting at the current bit
+    payload = bytes(payload) + bytes(8)
+    primaryBits = table.primaryBits
+    lookups = 0
+    bit = 0
+    produced = 0
+    for lengths, symbols, limit in ((table.lengths, table.symbols, count - table.maxDecoded + 1),
+                                    (table.singleLengths, table.singleSymbols, count)):
+        while produced < limit:
+            window = (int.from_bytes(payload[bit >> 3:(bit >> 3) + 8], "big") << (bit & 7)) & 0xFFFFFFFFFFFFFFFF
+            index = window >> (64 - primaryBits)
+            lookups += 1
+            n = lengths[index]
+            if n:
+                produced += len(symbols[index])
+            else:
+                secondary = symbols[index]
+                while True:
+                    skip, subBits, subLengths, subSymbols = secondary
+                    subIndex = (window >> (64 - skip - subBits)) & ((1 << subBits) - 1)
+                    lookups += 1
+                    n = subLengths[subIndex]
+                    if n:
+                        break
+                    secondary = subSymbols[subIndex]
+                decoded = subSymbols[subIndex]
+                produced += 1 if decoded.__class__ is int else len(decoded)
+            bit += n
+
+    return lookups
+
+def benchTokens(size: int, alphabetSizes: List[int], workDir: str) -> None:
+
+    # Compressed size, symbols, table lookups and MB/s of the extended alphabet against coding single bytes
+    corpora = [("text", generateText), ("json", generateJson), ("log", generateLog), ("binary", generateBinary)]
+    modes = [("bytes", None)] + [("tokens %d" % alphabetSize, alphabetSize) for alphabetSize in alphabetSizes]
+
+    print("%-8s %-12s %7s %10s %7s %8s %9s %10s %14s %16s" % (
+        "corpus", "mode", "tokens", "bytes", "ratio", "change %", "B/symbol", "B/lookup", "compress MB/s",
+        "decompress MB/s"))
+    for name, generate in corpora:
+        sourceFile = os.path.join(workDir, "tokens-%s" % name)
+        generate(sourceFile, size)
+        compressedFile = sourceFile + ".hc"
+        decompressedFile = sourceFile + ".out"
+
+        baseSize = None
+        for mode, alphabetSize in modes:
+            start = time.perf_counter()
+            if alphabetSize is None:
+                key = compress.createKey(compress.createTree(compress.createPriorityQueue(
+                    compress.readFileFrequencies(sourceFile))))
+                compress.compressChunks(compress.readChunks(sourceFile), key, compressedFile)
+                tokenCount = 0
+                symbols = size
+            else:
+                tokenCount = compress.compressTokens(sourceFile, compressedFile, alphabetSize)
+                symbols = None
+            compressSeconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            decompress.decompress(compressedFile, decompressedFile)
+            decompressSeconds = time.perf_counter() - start
+            if not filecmp.cmp(sourceFile, decompressedFile, shallow=False):
+                raise RuntimeError("decompressed file differs from the original")
+
+            # Number of symbols the file splits into with the tokens of its header, and lookups to decode them
+            binaryReader = MappedFileReader(compressedFile)
+            version, firstUInt = decompress._readVersion(binaryReader)
+            _, totalBytes, decoder = decompress._readDecoder(binaryReader, version, firstUInt, [])
+            if symbols is None:
+                tokenizer = Tokenizer(decoder.table.expansions[ALPHABET_SIZE:])
+                symbols = sum(compress.readFileTokenFrequencies(sourceFile, tokenizer))
+            lookups = _countLookups(decoder.table, binaryReader.readBytes(binaryReader.size - binaryReader.tell()),
+                                    totalBytes)
+            binaryReader.close()
+
+            compressedSize = os.path.getsize(compressedFile)
+            baseSize = baseSize or compressedSize
+            print("%-8s %-12s %7d %10d %7.3f %8.2f %9.3f %10.3f %14.2f %16.2f" % (
+                name, mode, tokenCount, compressedSize, size / compressedSize,
+                100 * (compressedSize - baseSize) / baseSize, size / symbols, size / lookups,
+                size / MB / compressSeconds, size / MB / decompressSeconds))
+
+        for filename in (sourceFile, compressedFile, decompressedFile):
+            os.remove(filename)
+
+def benchEcho(size: int, streamCounts: List[int], processes: Optional[int], workDir: str) -> None:
+
+    # Latency of concurrent streams through a local compressing echo server, with the blocks compressed
+    # and decoded on the default thread pool or on a process pool; the client and server share one event loop
+    sourceFile = os.path.join(workDir, "echo.txt")
+    generateText(sourceFile, size)
+    payload = compress.readData(sourceFile)
+    os.remove(sourceFile)
+
+    # Workers are started by a fork server, since workers forked from this process would inherit its
+    # connections and keep them open after the server closes them
+    executor = None
+    if processes:
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("forkserver"))
+    print("%s per stream, blocks on %s" % (formatSize(size), "%d processes" % processes if processes else "threads"))
+    try:
+        asyncio.run(_benchEcho(payload, streamCounts, executor))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def generateUniform(filename: str, size: int, seed: int = 0) -> None:
+
+    # Every byte value equally likely, which Huffman coding cannot compress
+    rand = random.Random(seed)
+    outfile = open(filename, "wb")
+    for start in range(0, size, MB):
+        outfile.write(rand.randbytes(min(MB, size - start)))
+    outfile.close()
+
+def generateZipf(filename: str, size: int, seed: int = 0) -> None:
+
+    # Byte values with Zipf distributed frequencies, in a shuffled order of rank
+    rand = random.Random(seed)
+    values = list(range(256))
+    rand.shuffle(values)
+    weights = [1 / (rank + 1) for rank in range(256)]
+    outfile = open(filename, "wb")
+    for start in range(0, size, 1 << 16):
+        outfile.write(bytes(rand.choices(values, weights, k=min(1 << 16, size - start))))
+    outfile.close()
+
+# (name, generator, size, repeats) of the suite corpora in quick and full mode; tiny files are run many times,
+# since a single run is too short to time
+SUITE_CORPORA = {
+    "quick": [("uniform", generateUniform, 256 << 10, 3), ("zipf", generateZipf, 256 << 10, 3),
+              ("text", generateText, 256 << 10, 3), ("binary", generateBinary, 256 << 10, 3),
+              ("tiny", generateText, 100, 50), ("huge", generateText, 4 * MB, 1)],
+    "full": [("uniform", generateUniform, 16 * MB, 3), ("zipf", generateZipf, 16 * MB, 3),
+             ("text", generateText, 16 * MB, 3), ("binary", generateBinary, 16 * MB, 3),
+             ("tiny", generateText, 100, 500), ("huge", generateText, 512 * MB, 1)],
+}
+
+# stages of the pipeline in the order they run
+SUITE_STAGES = ["readData", "readFrequencies", "createTree", "createKey", "compress", "readKey", "decode"]
+
+def _readKeyStage(compressedFile: str) -> Tuple[MappedFileReader, int, decompress.DecodeTable]:
+
+    # Reading the header of a compressed file and building its decoding tables
+    binaryReader = MappedFileReader(compressedFile)
+    _, totalBytes, codes = decompress._readHeader(binaryReader, *decompress._readVersion(binaryReader))
+    return binaryReader, totalBytes, decompress.DecodeTable(codes, count=totalBytes)
+
+def runPipeline(sourceFile: str, compressedFile: str, measure: Callable) -> None:
+
+    # Every stage of compressing and decompressing a file, each run through measure(stage, function, *args)
+    data = measure("readData", compress.readData, sourceFile)
+    frequencies = measure("readFrequencies", compress.readFrequencies, data)
+    tree = measure("createTree", lambda: compress.createTree(compress.createPriorityQueue(frequencies)))
+    key = measure("createKey", compress.createKey, tree)
+    measure("compress", compress.compress, data, key, compressedFile)
+
+    binaryReader, totalBytes, table = measure("readKey", _readKeyStage, compressedFile)
+    decoded = measure("decode", decompress._readData, binaryReader, table, totalBytes)
+    binaryReader.close()
+
+    if decoded != data:
+        raise RuntimeError("decompressed data differs from the original")
+
+def _suiteCorpus(sourceFile: str, size: int, repeats: int, trace: bool) -> Dict[str, Dict[str, float]]:
+
+    compressedFile = sourceFile + ".hc"
+    stages = {stage: {"seconds": float("inf"), "peakBytes": None} for stage in SUITE_STAGES}
+
+    # Timing every stage, keeping the fastest of the repeats
+    def timed(stage: str, function: Callable, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        stages[stage]["seconds"] = min(stages[stage]["seconds"], time.perf_counter() - start)
+        return result
+
+    for _ in range(repeats):
+        runPipeline(sourceFile, compressedFile, timed)
+
+    # Measuring the peak memory allocated by every stage in a separate run, since tracing slows the stages
+    # down about twenty times
+    def traced(stage: str, function: Callable, *args):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        result = function(*args)
+        stages[stage]["peakBytes"] = tracemalloc.get_traced_memory()[1] - current
+        return result
+
+    if trace:
+        tracemalloc.start()
+        try:
+            runPipeline(sourceFile, compressedFile, traced)
+        finally:
+            tracemalloc.stop()
+
+    for stage in stages.values():
+        stage["mbPerSecond"] = size / MB / stage["seconds"] if stage["seconds"] > 0 else None
+    stages["compressedSize"] = os.path.getsize(compressedFile)
+    os.remove(compressedFile)
+    return stages
+
+def _gitCommit() -> Optional[str]:
+
+    # Commit of the code being measured, if it is run from a git checkout
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def _compareSuites(old: Dict, new: Dict) -> None:
+
+    # MB/s of every stage against an earlier run; positive changes are faster
+    oldResults = {result["corpus"]: result for result in old["results"]}
+    print("compared with %s" % (old.get("commit") or "an earlier run"))
+    print("%-8s %-16s %12s %12s %9s" % ("corpus", "stage", "old MB/s", "new MB/s", "change"))
+    for result in new["results"]:
+        if result["corpus"] not in oldResults:
+            continue
+        for stage in SUITE_STAGES:
+            before = oldResults[result["corpus"]]["stages"].get(stage, {}).get("mbPerSecond")
+            after = result["stages"][stage]["mbPerSecond"]
+            if before and after:
+                print("%-8s %-16s %12.2f %12.2f %+8.1f%%" % (result["corpus"], stage, before, after,
+                                                             100 * (after - before) / before))
+
+def benchSuite(mode: str, traceLimit: Optional[int], jsonFile: Optional[str], compareFile: Optional[str],
+               workDir: str) -> None:
+
+    # Every stage of the pipeline on every corpus; the corpora are generated from fixed seeds,
+    # so runs on different commits measure the same data. Peak memory is traced for corpora up to traceLimit
+    results = []
+    quiet = jsonFile == "-"
+    if not quiet:
+        print("%-8s %8s %-16s %10s %10s %12s %8s" % ("corpus", "size", "stage", "seconds", "MB/s", "peak bytes",
+                                                      "ratio"))
+    for name, generate, size, repeats in SUITE_CORPORA[mode]:
+        sourceFile = os.path.join(workDir, "suite-%s" % name)
+        generate(sourceFile, size)
+        stages = _suiteCorpus(sourceFile, size, repeats, traceLimit is None or size <= traceLimit)
+        os.remove(sourceFile)
+
+        compressedSize = stages.pop("compressedSize")
+        results.append({"corpus": name, "size": size, "repeats": repeats, "compressedSize": compressedSize,
+                        "ratio": size / compressedSize, "stages": stages})
+        if not quiet:
+            for stage in SUITE_STAGES:
+                peakBytes = stages[stage]["peakBytes"]
+                print("%-8s %8s %-16s %10.4f %10.2f %12s %8s" % (
+                    name, formatSize(size), stage, stages[stage]["seconds"], stages[stage]["mbPerSecond"] or 0,
+                    "-" if peakBytes is None else peakBytes,
+                    "%.3f" % (size / compressedSize) if stage == "compress" else ""))
+
+    suite = {"mode": mode, "traceLimit": traceLimit, "commit": _gitCommit(), "python": platform.python_version(),
+             "numpy": vectorized.np.__version__ if vectorized.np is not None else None,
+             "backend": vectorized.resolveBackend("auto"), "results": results}
+
+    if jsonFile == "-":
+        print(json.dumps(suite, indent=2))
+    elif jsonFile is not None:
+        outfile = open(jsonFile, "w")
+        json.dump(suite, outfile, indent=2)
+        outfile.close()
+
+    if compareFile is not None and not quiet:
+        infile = open(compareFile)
+        _compareSuites(json.load(infile), suite)
+        infile.close()
+
+def _legacyCreateTree(priorityQueue) -> compress.BinaryTree:
+
+    # Original tree builder, pairing neighbours of the sorted queue and merging by size; kept for comparison
+    def createSubtree(items):
+        nodes = [compress.BinaryTreeNode(item) for item in items]
+        total = sum(node.getSize() for node in nodes)
+        return compress.BinaryTree(compress.BinaryTreeNode((None, total), nodes[0], nodes[1]))
+
+    def combineSubtrees(lTree, rTree):
+        if lTree is None:
+            return rTree
+        total = lTree.getSize() + rTree.getSize()
+        return compress.BinaryTree(compress.BinaryTreeNode((None, total), lTree.getHead(), rTree.getHead()))
+
+    tree = None
+    subtrees = []
+    while len(priorityQueue) > 1:
+        subtrees.append(createSubtree(priorityQueue[:2]))
+        priorityQueue = priorityQueue[2:]
+        if len(subtrees) == 2:
+            newSubtree = combineSubtrees(subtrees[0], subtrees[1])
+            if tree is None or newSubtree.getSize() > tree.getSize():
+                tree = combineSubtrees(tree, newSubtree)
+                subtrees = []
+            else:
+                subtrees = [newSubtree]
+    if len(subtrees) == 1:
+        if subtrees[0].getSize() < tree.getSize():
+            tree = combineSubtrees(subtrees[0], tree)
+        else:
+            tree = combineSubtrees(tree, subtrees[0])
+    if len(priorityQueue) == 1:
+        lastNodeTree = compress.BinaryTree(compress.BinaryTreeNode(priorityQueue[0]))
+        if lastNodeTree.getSize() < tree.getSize():
+            tree = combineSubtrees(lastNodeTree, tree)
+        else:
+            tree = combineSubtrees(tree, lastNodeTree)
+
+    return tree
+
+def syntheticDistributions() -> Dict[str, Dict[int, int]]:
+
+    # Frequencies from flat to extremely skewed, over byte values 0 to n - 1
+    rand = random.Random(0)
+    distributions = {
+        "single": [1000],
+        "two-skewed": [999, 1],
+        "uniform-256": [1000] * 256,
+        "uniform-100": [1000] * 100,
+        "zipf-1.0": [int(1e6 / (rank + 1)) for rank in range(256)],
+        "zipf-1.5": [max(1, int(1e6 / (rank + 1) ** 1.5)) for rank in range(256)],
+        "zipf-2.0": [max(1, int(1e6 / (rank + 1) ** 2)) for rank in range(256)],
+        "geometric-0.5": [2 ** (30 - min(rank, 29)) for rank in range(64)],
+        "fibonacci": [],
+        "random": [rand.randint(1, 10000) for _ in range(200)],
+    }
+    fib = [1, 1]
+    while len(fib) < 40:
+        fib.append(fib[-1] + fib[-2])
+    distributions["fibonacci"] = fib
+
+    return {name: dict(enumerate(counts)) for name, counts in distributions.items()}
+
+def encodedBits(frequencies: Dict[int, int], tree: compress.BinaryTree, maxCodeLength: Optional[int] = None) -> int:
+
+    # Total payload bits when every byte is written with its code from the tree
+    key = compress.createKey(tree, maxCodeLength)
+    return sum(frequencies[byte] * length for byte, length, _ in key[1:])
+
+def optimalBits(frequencies: Dict[int, int]) -> int:
+
+    # Cost of an optimal prefix code, the sum of the weights of all merged nodes, using a heap
+    heap = list(frequencies.values())
+    if len(heap) == 1:
+        return heap[0]
+    heapq.heapify(heap)
+    cost = 0
+    while len(heap) > 1:
+        merged = heapq.heappop(heap) + heapq.heappop(heap)
+        cost += merged
+        heapq.heappush(heap, merged)
+
+    return cost
+
+def benchOptimality() -> int:
+
+    print("%-14s %8s %14s %14s %14s %14s" % ("distribution", "symbols", "entropy", "optimal", "huffman", "legacy"))
+    failures = 0
+    for name, frequencies in syntheticDistributions().items():
+        total = sum(frequencies.values())
+        entropy = abs(sum(count * math.log2(count / total) for count in frequencies.values()))
+
+        priorityQueue = sorted(frequencies.items(), key=lambda x: x[1])
+        huffmanBits = encodedBits(frequencies, compress.createTree(priorityQueue))
+        try:
+            legacyBits = encodedBits(frequencies, _legacyCreateTree(priorityQueue))
+        except AttributeError:
+            # the original builder fails on fewer than three characters
+            legacyBits = None
+
+        # The builder must match the optimal cost, which is at most one bit per character above the entropy
+        ok = huffmanBits == optimalBits(frequencies) and entropy - 1e-6 <= huffmanBits <= entropy + total
+        failures += not ok
+
+        print("%-14s %8d %14.0f %14d %14d %14s %s" % (name, len(frequencies), entropy, optimalBits(frequencies),
+                                                     huffmanBits, "n/a" if legacyBits is None else legacyBits,
+                                                     "" if ok else "FAIL"))
+
+    return 1 if failures else 0
+
+def benchLimits(limits: List[int]) -> None:
+
+    # Payload growth from limiting the code length, on the synthetic distributions and generated text
+    distributions = syntheticDistributions()
+    rand = random.Random(0)
+    text = " ".join(rand.choices(WORDS, [1 / (rank + 1) for rank in range(len(WORDS))], k=200000)).encode()
+    distributions["text"] = {byte: count for byte, count in enumerate(compress.readFrequencies(text)) if count}
+
+    print("%-14s %8s %8s %14s" % ("distribution", "symbols", "longest", "unlimited") +
+          "".join(" %14s" % ("limit %d" % limit) for limit in limits))
+    for name, frequencies in distributions.items():
+        tree = compress.createTree(sorted(frequencies.items(), key=lambda x: x[1]))
+        longest = max(length for _, length, _ in compress.createKey(tree)[1:])
+        unlimited = encodedBits(frequencies, tree)
+
+        # Growth over the unlimited code; a limit too short for the number of symbols cannot be met
+        costs = []
+        for limit in limits:
+            if len(frequencies) > 1 << limit:
+                costs.append("-")
+            else:
+                costs.append("%+.3f%%" % (100 * (encodedBits(frequencies, tree, limit) - unlimited) / unlimited))
+        print("%-14s %8d %8d %14d" % (name, len(frequencies), longest, unlimited) +
+              "".join(" %14s" % cost for cost in costs))
+
+# ----------------------------------------------------------------------
+
+def main():
+    parser = ArgumentParser(description="benchmark Huffman compression")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    decodeParser = subparsers.add_parser("decode", help="decode MB/s of the table decoder against the per-bit decoder, "
+                                                         "reading the file with file calls or a memory map")
+    decodeParser.add_argument("--sizes", default="1M,10M,100M,1G", help="comma separated input sizes")
+    decodeParser.add_argument("--per-bit-limit", default="10M",
+                              help="largest input to run the per-bit decoder on")
+
+    memoryParser = subparsers.add_parser("memory", help="peak RSS of compress.py and decompress.py by input size")
+    memoryParser.add_argument("--sizes", default="16M,64M,256M,1G", help="comma separated input sizes")
+
+    cores = os.cpu_count() or 1
+    defaultJobs = [1] + [jobs for jobs in (2, 4, 8, 16, 32, 64) if jobs <= cores]
+    parallelParser = subparsers.add_parser("parallel", help="block container throughput by number of processes")
+    parallelParser.add_argument("--size", default="64M", help="input size")
+    parallelParser.add_argument("--jobs", default=",".join(str(jobs) for jobs in defaultJobs),
+                                help="comma separated numbers of processes")
+    parallelParser.add_argument("--block-size", default="1M", help="bytes per block")
+
+    streamsParser = subparsers.add_parser("streams", help="decode MB/s of blocks split into interleaved streams "
+                                                          "against single stream blocks")
+    streamsParser.add_argument("--size", default="16M", help="input size")
+    streamsParser.add_argument("--streams", default="1,2,4,8", help="comma separated numbers of streams per block; "
+                                                                   "the first is the baseline")
+    streamsParser.add_argument("--jobs", default=",".join(str(jobs) for jobs in sorted({1, min(4, cores)})),
+                               help="comma separated numbers of processes")
+    streamsParser.add_argument("--block-size", default="4M", help="bytes per block")
+
+    seekParser = subparsers.add_parser("seek", help="HuffmanReader random read latency and parallel decode throughput")
+    seekParser.add_argument("--size", default="64M", help="input size")
+    seekParser.add_argument("--reads", type=int, default=1000, help="number of random reads")
+    seekParser.add_argument("--read-length", type=int, default=100, help="bytes per random read")
+    seekParser.add_argument("--jobs", default=",".join(str(jobs) for jobs in defaultJobs),
+                            help="comma separated numbers of processes for the full decode")
+
+    backendsParser = subparsers.add_parser("backends", help="frequency counting and encoding MB/s of the "
+                                                            "pure Python and NumPy backends")
+    backendsParser.add_argument("--sizes", default="10M,100M,1G", help="comma separated input sizes")
+    backendsParser.add_argument("--python-limit", default="100M",
+                                help="largest input to run the pure Python backend on")
+
+    tablesParser = subparsers.add_parser("tables", help="files/s of many small files with a key in every file "
+                                                        "against a pretrained table")
+    tablesParser.add_argument("--files", type=int, default=10000, help="number of small files")
+    tablesParser.add_argument("--samples", type=int, default=1000, help="number of files to train the table on")
+
+    batchParser = subparsers.add_parser("batch", help="files/s of compressing a directory into one archive against "
+                                                      "running compress.py and decompress.py once per file")
+    batchParser.add_argument("--files", type=int, default=500, help="number of files")
+    batchParser.add_argument("--size", default="64K", help="largest file size")
+    batchParser.add_argument("--jobs", default=",".join(str(jobs) for jobs in defaultJobs),
+                             help="comma separated numbers of processes for the archive")
+
+    limitsParser = subparsers.add_parser("limits", help="payload growth from limiting the code length")
+    limitsParser.add_argument("--limits", default="8,10,12,15", help="comma separated code length limits")
+
+    contextParser = subparsers.add_parser("context", help="ratio and MB/s of the order-1 context mode against "
+                                                          "order-0 on text, JSON and binary data")
+    contextParser.add_argument("--size", default="4M", help="size of each corpus")
+
+    sampledParser = subparsers.add_parser("sampled", help="ratio loss, bytes read and MB/s of single pass "
+                                                          "compression with sampled tables against two passes")
+    sampledParser.add_argument("--size", default="4M", help="size of each corpus")
+    sampledParser.add_argument("--samples", default="4K,64K", help="comma separated sample sizes")
+
+    tokensParser = subparsers.add_parser("tokens", help="ratio, bytes decoded per table lookup and MB/s of the "
+                                                        "extended alphabet of digrams and runs against single bytes")
+    tokensParser.add_argument("--size", default="2M", help="size of each corpus")
+    tokensParser.add_argument("--alphabets", default="300,512,1024",
+                              help="comma separated sizes of the extended alphabet")
+
+    echoParser = subparsers.add_parser("echo", help="latency of concurrent streams through a local asyncio echo "
+                                                    "server that decompresses and recompresses them")
+    echoParser.add_argument("--size", default="256K", help="bytes sent on each stream")
+    echoParser.add_argument("--streams", default="1,8,32", help="comma separated numbers of concurrent streams")
+    echoParser.add_argument("--processes", type=int, default=0,
+                            help="compress and decode blocks on this many processes instead of threads")
+
+    suiteParser = subparsers.add_parser("suite", help="time every stage of the pipeline on generated corpora, "
+                                                      "with MB/s, peak memory and compression ratio")
+    suiteMode = suiteParser.add_mutually_exclusive_group()
+    suiteMode.add_argument("--quick", dest="mode", action="store_const", const="quick",
+                           help="small corpora that run in seconds, for CI; the default")
+    suiteMode.add_argument("--full", dest="mode", action="store_const", const="full",
+                           help="large corpora and repeated runs, for tuning")
+    suiteParser.add_argument("--trace-limit", default=None,
+                             help="largest corpus to trace peak memory on, since tracing is slow; "
+                                  "defaults to 1M with --quick and no limit with --full")
+    suiteParser.add_argument("--json", default=None, metavar="FILE",
+                             help="write the results as JSON to this file, or to standard output if -")
+    suiteParser.add_argument("--compare", default=None, metavar="FILE",
+                             help="compare the MB/s of every stage with the JSON results of an earlier run")
+
+    subparsers.add_parser("optimality", help="encoded size of the tree builders against the entropy bound; "
+                                             "exits with status 1 if the Huffman code is not optimal")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "optimality":
+        return benchOptimality()
+    if args.benchmark == "limits":
+        benchLimits([int(limit) for limit in args.limits.split(",")])
+        return 0
+
+    workDir = tempfile.mkdtemp(prefix="huffman-benchmark-")
+    try:
+        if args.benchmark == "decode":
+            sizes = [parseSize(size) for size in args.sizes.split(",")]
+            benchDecode(sizes, parseSize(args.per_bit_limit), workDir)
+        elif args.benchmark == "memory":
+            benchMemory([parseSize(size) for size in args.sizes.split(",")], workDir)
+        elif args.benchmark == "parallel":
+            benchParallel(parseSize(args.size), [int(jobs) for jobs in args.jobs.split(",")],
+                          parseSize(args.block_size), workDir)
+        elif args.benchmark == "streams":
+            benchStreams(parseSize(args.size), [int(streams) for streams in args.streams.split(",")],
+                         [int(jobs) for jobs in args.jobs.split(",")], parseSize(args.block_size), workDir)
+        elif args.benchmark == "seek":
+            benchSeek(parseSize(args.size), args.reads, args.read_length, [int(jobs) for jobs in args.jobs.split(",")],
+                      workDir)
+        elif args.benchmark == "backends":
+            sizes = [parseSize(size) for size in args.sizes.split(",")]
+            benchBackends(sizes, parseSize(args.python_limit), workDir)
+        elif args.benchmark == "tables":
+            benchTables(args.files, args.samples, workDir)
+        elif args.benchmark == "batch":
+            benchBatch(args.files, parseSize(args.size), [int(jobs) for jobs in args.jobs.split(",")], workDir)
+        elif args.benchmark == "context":
+            benchContext(parseSize(args.size), workDir)
+        elif args.benchmark == "sampled":
+            benchSampled(parseSize(args.size), [parseSize(sample) for sample in args.samples.split(",")], workDir)
+        elif args.benchmark == "tokens":
+            benchTokens(parseSize(args.size), [int(alphabetSize) for alphabetSize in args.alphabets.split(",")],
+                        workDir)
+        elif args.benchmark == "suite":
+            mode = args.mode or "quick"
+            traceLimit = args.trace_limit or ("1M" if mode == "quick" else None)
+            benchSuite(mode, parseSize(traceLimit) if traceLimit else None, args.json, args.compare, workDir)
+        elif args.benchmark == "echo":
+            benchEcho(parseSize(args.size), [int(streams) for streams in args.streams.split(",")], args.processes,
+                      workDir)
+    finally:
+        shutil.rmtree(workDir)
+
+    return 0
+
+# ----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.exit(main())
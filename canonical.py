@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# canonical.py
+#
+# Canonical Huffman codes and the code length header of the .hc format.
+# ----------------------------------------------------------------------
+
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from BinaryFileIO import BinaryFileWriter, BinaryFileReader
+
+# ----------------------------------------------------------------------
+
+# Files in the original format start with the number of characters as a UInt, which is never 0
+# because empty files are not compressed. A UInt 0 marks a file that continues with a version byte.
+FORMAT_MARKER = 0
+
+# original format, starting with the number of characters and storing every character's full code
+VERSION_LEGACY = 0
+
+# single code table stored as run-length packed code lengths
+VERSION_CANONICAL = 1
+
+# independent blocks, each with its own code length table, followed by a block index
+VERSION_BLOCKS = 2
+
+# no key in the file, the codes come from a pretrained code table identified by its ID
+VERSION_DICTIONARY = 3
+
+# many files, each compressed on its own, followed by an index of their names, sizes and offsets
+VERSION_ARCHIVE = 4
+
+# order-1 model: the code of each byte is chosen by the byte before it, from a code of that context's own
+# or a code shared by the contexts that are too rare to pay for one
+VERSION_CONTEXT = 5
+
+# single pass: blocks coded with a table estimated from a sample, which is only replaced when a block's
+# cost under it drifts too far from that of a table of its own; written without knowing the total size
+VERSION_SAMPLED = 6
+
+# extended alphabet: after the total amount of bytes, a table of digram and run tokens that take the symbols
+# from 256 up, and the code lengths of the byte values and tokens, so that a single code can stand for several bytes
+VERSION_TOKENS = 7
+
+# header flag of the block container: the block index lists checkpoints inside each block
+FLAG_CHECKPOINTS = 0x01
+
+# header flag: the file carries CRC-32 checksums. A single code file, token file or sampled file ends with a UInt checksum
+# of the data and a UInt checksum of every byte of the file before it. Each block of a block container ends with a UInt
+# checksum of its data and a UInt checksum of the block's bytes before it, and the block index is followed
+# by a UInt checksum of all of the data and a UInt checksum of the bytes from the start of the index up to
+# it. An archive's file index is followed by a UInt checksum of the index, and its files carry checksums
+# of their own.
+FLAG_CHECKSUMS = 0x02
+
+# header flag of the block container: the symbols of each block are dealt round-robin to interleaved
+# streams, so that symbol k is in stream k % count. The payload starts with a UByte count of streams and
+# a jump table of the UInt length of every stream but the last, followed by the streams, each padded
+# to a whole byte, which can be decoded independently of each other
+FLAG_STREAMS = 0x04
+
+# header flag of a single code file: the file ends with a UInt checksum of the data alone. Decoding the data
+# to that checksum covers the header as well, so the checksum of the file's bytes is left out
+FLAG_DATA_CHECKSUM = 0x08
+
+# header flag of a single code file: the total amount of bytes is a UInt rather than a ULong
+FLAG_SHORT_TOTAL = 0x10
+
+# most streams a block can be split into
+MAX_STREAMS = 0xFF
+
+# size of the block container header: UInt format marker, UByte version, UByte flags and UInt block size
+HEADER_SIZE = 10
+
+# largest block of a single pass file, whose header has no block size to check a block's amount of bytes against
+MAX_SAMPLED_BLOCK_SIZE = 1 << 24
+
+# number of symbols a code length table covers
+ALPHABET_SIZE = 256
+
+# symbol after the byte values in the tables of sampled files; a byte without a code of its own is coded
+# as the escape code followed by the 8 bits of the byte
+ESCAPE = ALPHABET_SIZE
+
+# header bytes with this bit set repeat the previous code length, the other bytes are code lengths
+RUN_FLAG = 0x80
+MIN_RUN = 2
+MAX_RUN = MIN_RUN + 0x7F
+
+# longest code length the header can hold; a Huffman code only gets this deep when the total
+# of the frequencies exceeds the 127th Fibonacci number, far beyond any 64-bit file size
+MAX_CODE_LENGTH = 0x7F
+
+# ----------------------------------------------------------------------
+
+def canonicalCodes(lengths: Dict[int, int]) -> List[Tuple[int, int, int]]:
+    """
+    assign canonical codes: symbols are ordered by code length and then by value, and each code is the
+    previous code plus one, shifted left whenever the length grows
+    :param lengths: code length of each symbol that has a code
+    :return: (symbol, code length, code) for each symbol in canonical order
+    """
+    codes = []
+    code = 0
+    previousLength = 0
+    for symbol, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - previousLength
+        if code >= 1 << length:
+            raise ValueError("canonicalCodes error: code lengths do not form a prefix code")
+        codes.append((symbol, length, code))
+        code += 1
+        previousLength = length
+
+    return codes
+
+# ----------------------------------------------------------------------
+
+class EncodeTable:
+    """
+    Canonical code of every symbol of the alphabet, held in two arrays indexed by symbol value:
+    codes[symbol] is the code and lengths[symbol] its length in bits, 0 for a symbol without a code.
+    """
+
+    __slots__ = ("codes", "lengths")
+
+    def __init__(self, lengths: Dict[int, int], alphabetSize: int = ALPHABET_SIZE, escape: Optional[int] = None):
+        """
+        assign the same codes as canonicalCodes without sorting: the codes of each length are counted,
+        which gives the first code of every length, and the symbols of each length take consecutive codes
+        from it in order of symbol value
+        :param lengths: code length of each symbol that has a code
+        :param alphabetSize: number of symbols in the alphabet
+        :param escape: symbol whose code, followed by the 8 bits of the byte, becomes the code of every byte
+                       value without a code of its own; None for no escape
+        """
+        self.lengths = array("B", bytes(alphabetSize))
+        for symbol, length in lengths.items():
+            self.lengths[symbol] = length
+        longest = max(self.lengths, default=0)
+
+        # Number of codes of each length, then the first code of each length
+        counts = [0] * (longest + 1)
+        for length in self.lengths:
+            counts[length] += 1
+        counts[0] = 0
+        nextCodes = [0] * (longest + 1)
+        code = 0
+        for length in range(1, longest + 1):
+            code = (code + counts[length - 1]) << 1
+            nextCodes[length] = code
+        if longest and nextCodes[longest] + counts[longest] > 1 << longest:
+            raise ValueError("EncodeTable error: code lengths do not form a prefix code")
+
+        # Codes are packed into 64 bit integers unless one is too long for them
+        escapeLength = self.lengths[escape] if escape is not None else 0
+        widest = max(longest, escapeLength + 8 if escapeLength else 0)
+        self.codes = array("Q", bytes(8 * alphabetSize)) if widest <= 64 else [0] * alphabetSize
+        for symbol, length in enumerate(self.lengths):
+            if length:
+                self.codes[symbol] = nextCodes[length]
+                nextCodes[length] += 1
+
+        # Byte values without a code take the escape code with the byte appended
+        if escapeLength:
+            for symbol in range(min(escape, ALPHABET_SIZE)):
+                if not self.lengths[symbol]:
+                    self.codes[symbol] = self.codes[escape] << 8 | symbol
+                    self.lengths[symbol] = escapeLength + 8
+
+    # ------------------------------------------------------------------
+
+    def __getitem__(self, symbol: int) -> Optional[Tuple[int, int]]:
+        """
+        :param symbol: symbol value
+        :return: (code, code length) of the symbol, None if it has no code
+        """
+        length = self.lengths[symbol]
+        return (self.codes[symbol], length) if length else None
+
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    # ------------------------------------------------------------------
+
+    def entries(self) -> List[Tuple[int, int, int]]:
+        """
+        list the codes, for writing headers and for debugging
+        :return: (symbol, code length, code) for each symbol with a code in canonical order, as canonicalCodes
+        """
+        return sorted(((symbol, length, self.codes[symbol]) for symbol, length in enumerate(self.lengths) if length),
+                      key=lambda entry: (entry[1], entry[0]))
+
+# ----------------------------------------------------------------------
+
+def writeLengths(writer: BinaryFileWriter, lengths: Dict[int, int], alphabetSize: int = ALPHABET_SIZE) -> None:
+    """
+    write the code length of every symbol of the alphabet, 0 for symbols without a code; a UByte below
+    RUN_FLAG is the length of the next symbol and a UByte with RUN_FLAG set repeats the previous length
+    (initially 0) for the next MIN_RUN to MAX_RUN symbols
+    :param writer: file to write to
+    :param lengths: code length of each symbol that has a code
+    :param alphabetSize: number of symbols in the alphabet
+    :return: None
+    """
+    previous = 0
+    symbol = 0
+    while symbol < alphabetSize:
+        length = lengths.get(symbol, 0)
+        assert length <= MAX_CODE_LENGTH
+
+        run = 0
+        while run < MAX_RUN and symbol + run < alphabetSize and lengths.get(symbol + run, 0) == previous:
+            run += 1
+
+        if run >= MIN_RUN:
+            writer.writeUByte(RUN_FLAG | (run - MIN_RUN))
+            symbol += run
+        else:
+            writer.writeUByte(length)
+            previous = length
+            symbol += 1
+
+# ----------------------------------------------------------------------
+
+def readLengths(reader: BinaryFileReader, alphabetSize: int = ALPHABET_SIZE) -> Dict[int, int]:
+    """
+    read a code length table written by writeLengths
+    :param reader: file to read from
+    :param alphabetSize: number of symbols in the alphabet
+    :return: code length of each symbol that has a code
+    """
+    lengths = {}
+    previous = 0
+    symbol = 0
+    while symbol < alphabetSize:
+        value = reader.readUByte()
+        if value & RUN_FLAG:
+            run = (value & ~RUN_FLAG) + MIN_RUN
+        else:
+            run = 1
+            previous = value
+        if symbol + run > alphabetSize:
+            raise ValueError("readLengths error: code length runs exceed the alphabet")
+        if previous != 0:
+            for s in range(symbol, symbol + run):
+                lengths[s] = previous
+        symbol += run
+
+    return lengths
+
+# ----------------------------------------------------------------------
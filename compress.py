@@ -12,10 +12,58 @@
 # ----------------------------------------------------------------------
 
 from __future__ import annotations
-from typing import Optional, Dict, Tuple, List
+import io
+import os
+import sys
+import zlib
+from typing import Optional, Dict, Tuple, List, Iterable, Iterator
 from argparse import ArgumentParser
+from collections import Counter, deque
 
 from BinaryFileIO import BinaryFileWriter
+from canonical import MAX_CODE_LENGTH, FORMAT_MARKER, VERSION_CANONICAL, VERSION_BLOCKS, VERSION_DICTIONARY, VERSION_ARCHIVE, \
+    VERSION_CONTEXT, VERSION_SAMPLED, VERSION_TOKENS, FLAG_CHECKPOINTS, FLAG_CHECKSUMS, FLAG_STREAMS, \
+    FLAG_DATA_CHECKSUM, FLAG_SHORT_TOTAL, MAX_STREAMS, \
+    ALPHABET_SIZE, ESCAPE, HEADER_SIZE, MAX_SAMPLED_BLOCK_SIZE, EncodeTable, writeLengths
+from dictionary import writeTable, readTable
+from parallel import orderedMap
+from tokens import MAX_ALPHABET_SIZE, Tokenizer, countCandidates, selectTokens, writeTokens
+import stats
+import vectorized
+
+# number of bytes read from the file at a time
+CHUNK_SIZE = 1 << 20
+
+# number of bytes in each independently compressed block of the block container format
+BLOCK_SIZE = 1 << 20
+
+# number of bytes between the checkpoints of a seekable block container
+CHECKPOINT_INTERVAL = 1 << 14
+
+# number of interleaved streams each block is split into with --streams, unless --stream-count is given
+STREAMS = 4
+
+# shortest code length limit that leaves room for a code for every byte value
+MIN_CODE_LENGTH_LIMIT = 8
+
+# number of bytes the first table of a single pass compression is estimated from
+SAMPLE_SIZE = 1 << 16
+
+# number of evenly spaced pieces a strided sample is read in
+SAMPLE_PIECES = 16
+
+# number of bytes in each block of a single pass compression, the points where its table can be replaced
+SAMPLED_BLOCK_SIZE = 1 << 16
+
+# fraction by which a block's cost under the current table may exceed the cost of a table of its own,
+# header included, before the table is replaced
+DRIFT = 0.05
+
+# the escape symbol is counted as 1 in 2**ESCAPE_SHIFT bytes, which keeps its code short
+ESCAPE_SHIFT = 12
+
+# number of symbols of the extended alphabet with --extended-alphabet, the 256 byte values included
+EXTENDED_ALPHABET_SIZE = 512
 
 # ----------------------------------------------------------------------
 class BinaryTree:
@@ -35,7 +83,7 @@ class BinaryTreeNode:
     This class only serves to be a data structure with no additional functionality.
     """
 
-    def __init__(self, data: tuple[str, int], left=None, right=None):
+    def __init__(self, data: tuple[int, int], left=None, right=None):
         self.left = left
         self.right = right
         self.data = data
@@ -62,201 +110,1134 @@ class BinaryTreeNode:
 
 # ----------------------------------------------------------------------
 
-def _createSubtree(items) -> BinaryTree:
-
-    # Creating BinaryTreeNodes for the frequencies in items
-    nodes = []
-    total = 0
-    for i in items:
-        node = BinaryTreeNode(i)
-        total += node.getSize()
-        nodes.append(node)
-
-    # Creating a root node and a tree with that root
-    root = BinaryTreeNode((None, total), nodes[0], nodes[1])
-    tree = BinaryTree(root)
-    return tree
-
 def _combineSubtrees(lTree: BinaryTree, rTree: BinaryTree) -> BinaryTree:
 
-    # Edge case for the combining the first subtree
-    if lTree is None:
-        return rTree
-
     # Creating a new root for the tree and attaching the trees as children of the root
     total = lTree.getSize() + rTree.getSize()
     root = BinaryTreeNode((None, total), lTree.getHead(), rTree.getHead())
     tree = BinaryTree(root)
     return tree
 
-def _generateKeys(node: BinaryTreeNode, bitCode: str = "") -> List[Tuple]:
-    # Recursive post order traversal of binary tree
-    keys = []
+def _popSmallest(leaves: deque, merged: deque) -> BinaryTree:
+
+    # Both queues are in ascending order, so the smallest tree is at the front of one of them.
+    # Leaves win ties, which keeps the longest code as short as possible
+    if not merged or (leaves and leaves[0].getSize() <= merged[0].getSize()):
+        return leaves.popleft()
+    return merged.popleft()
+
+def _leafDepths(tree: BinaryTree) -> List[Tuple[int, int, int]]:
+
+    # Walking the tree with an explicit stack, so a deep tree cannot exhaust the recursion limit
+    leaves = []
+    stack = [(tree.getHead(), 0)]
+    while stack:
+        node, depth = stack.pop()
+        nodeData = node.getData()
+        # If the node isn't a filler node, its byte is a leaf at this depth
+        if nodeData[0] is not None:
+            leaves.append((nodeData[0], nodeData[1], depth))
+        for child in (node.getRight(), node.getLeft()):
+            if child:
+                stack.append((child, depth + 1))
+
+    return leaves
+
+def _limitedLengths(leaves: List[Tuple[int, int]], maxCodeLength: int) -> Dict[int, int]:
+
+    # A single byte value gets a one bit code
+    if len(leaves) == 1:
+        return {leaves[0][0]: 1}
+    if len(leaves) > 1 << maxCodeLength:
+        raise ValueError("%d symbols cannot have codes of at most %d bits" % (len(leaves), maxCodeLength))
+
+    # Package-merge: starting from the leaves in ascending order of frequency, the items of each level are
+    # paired into packages and merged with the leaves again, once for every bit a code may have.
+    # Each item is (frequency, bytes it contains), leaves sort before packages of equal frequency
+    ordered = sorted(((frequency, [byte]) for byte, frequency in leaves), key=lambda item: item[0])
+    items = ordered
+    for _ in range(maxCodeLength - 1):
+        packages = [(items[i][0] + items[i + 1][0], items[i][1] + items[i + 1][1]) for i in range(0, len(items) - 1, 2)]
+        items = sorted(ordered + packages, key=lambda item: item[0])
+
+    # The cheapest 2n - 2 items give an optimal code within the limit:
+    # each byte's code length is the number of those items it appears in
+    lengths = {}
+    for _, contained in items[:2 * len(leaves) - 2]:
+        for byte in contained:
+            lengths[byte] = lengths.get(byte, 0) + 1
+
+    return lengths
+
+def readChunks(sourceFile, chunkSize: int = CHUNK_SIZE) -> Iterator[bytes]:
+
+    infile = open(sourceFile, "rb")
+
+    # Yielding the file a fixed amount of bytes at a time so it is never held in memory
+    while True:
+        with stats.stage("read") as record:
+            chunk = infile.read(chunkSize)
+            record.bytesOut = len(chunk)
+        if not chunk:
+            break
+        yield chunk
 
-    if node.getLeft():
-        # Searching left subtree, add 0 to bitCode
-        keys += _generateKeys(node.getLeft(), bitCode + "0")
-    if node.getRight():
-        # Searching right subtree, add 1 to binary code
-        keys += _generateKeys(node.getRight(), bitCode + "1")
+    infile.close()
 
-    nodeData = node.getData()
-    # If the node isn't a filler node, the character node's data is stored in the key
-    if nodeData[0] is not None:
-        keys.append((nodeData[0], len(bitCode), bitCode))
+def readData(sourceFile) -> bytes:
 
-    return keys
+    # Joining all chunks of the file into one bytes object at once
+    return b"".join(readChunks(sourceFile))
 
-def readData(sourceFile) -> str:
+def readFrequencies(data: bytes, backend: str = "auto") -> List[int]:
 
-    infile = open(sourceFile, "r")
-    fileContents = ""
+    with stats.stage("histogram", len(data)):
+        # Counting with a single bincount when NumPy is available
+        if vectorized.resolveBackend(backend) == "numpy":
+            return vectorized.byteFrequencies(data)
 
-    # Accumulating all lines in file to a string
-    line = infile.readline()
-    while line:
-        fileContents += line
-        line = infile.readline()
+        frequencies = [0] * ALPHABET_SIZE
 
-    infile.close()
+        # Counting each byte value that occurs with a single scan of the data in C per value
+        for byte in set(data):
+            frequencies[byte] = data.count(bytes((byte,)))
 
-    return fileContents
+        return frequencies
 
-def readFrequencies(data: str) -> Dict[str, int]:
+def readFileFrequencies(sourceFile, backend: str = "auto") -> List[int]:
 
-    frequencies = {}
+    frequencies = [0] * ALPHABET_SIZE
 
-    for i in range(len(data)):
-        char = data[i]
+    # Adding up the frequencies of each chunk of the file
+    for chunk in readChunks(sourceFile):
+        for byte, count in enumerate(readFrequencies(chunk, backend)):
+            frequencies[byte] += count
 
-        # Checking dictionary for character
-        if char in frequencies:
-            # Increment character frequency
-            frequencies[char] += 1
-        else:
-            # Initialize character frequency
-            frequencies[char] = 1
+    return frequencies
+
+def readContextFrequencies(data: bytes, previous: int = 0, backend: str = "auto") -> List[int]:
+
+    with stats.stage("histogram", len(data)):
+        # Frequency of every pair of a byte and the byte before it, at index previous byte * 256 + byte
+        if vectorized.resolveBackend(backend) == "numpy":
+            return vectorized.pairFrequencies(data, previous)
+
+        frequencies = [0] * (ALPHABET_SIZE * ALPHABET_SIZE)
+        for (before, byte), count in Counter(zip(bytes((previous,)) + data[:-1], data)).items():
+            frequencies[before << 8 | byte] = count
+
+        return frequencies
+
+def readFileContextFrequencies(sourceFile, backend: str = "auto") -> List[int]:
+
+    frequencies = [0] * (ALPHABET_SIZE * ALPHABET_SIZE)
+
+    # Adding up the pairs of each chunk of the file, the first byte of a chunk following the last of the one before
+    previous = 0
+    for chunk in readChunks(sourceFile):
+        for pair, count in enumerate(readContextFrequencies(chunk, previous, backend)):
+            if count:
+                frequencies[pair] += count
+        previous = chunk[-1]
 
     return frequencies
 
+def createPriorityQueue(frequencies: List[int]) -> List[Tuple[int, int]]:
+
+    # Ordering the bytes that occur by frequency
+    return sorted(((byte, count) for byte, count in enumerate(frequencies) if count), key=lambda x: x[1])
+
 def createTree(priorityQueue) -> BinaryTree:
 
-    # Initializing local variables
-    tree = None
-    subtrees = []
+    with stats.stage("tree"):
+        return _createTree(priorityQueue)
 
-    # Creating subtrees as long as there are at least 2 items in queue
-    while len(priorityQueue) > 1:
+def _createTree(priorityQueue) -> BinaryTree:
 
-        # Creating subtree, appending to subtree array and deleting used frequencies from priorityQueue
-        subtree = _createSubtree(priorityQueue[:2])
-        subtrees.append(subtree)
-        priorityQueue = priorityQueue[2:]
+    # Two-queue Huffman construction: the priority queue holds the bytes in ascending order of
+    # frequency, and every merged tree is at least as large as the one merged before it, so both
+    # queues stay sorted and the two smallest trees are always found at their fronts
+    leaves = deque(BinaryTree(BinaryTreeNode(item)) for item in priorityQueue)
+    merged = deque()
 
-        # If there are two subtrees, combine them
-        if len(subtrees) == 2:
-            newSubtree = _combineSubtrees(subtrees[0], subtrees[1])
+    # A single byte value still needs a one bit code, so it is placed under a root of its own
+    if len(leaves) == 1:
+        leaf = leaves[0]
+        return BinaryTree(BinaryTreeNode((None, leaf.getSize()), leaf.getHead()))
 
-            # If the new tree has a bigger size, it is combined with the whole tree.
-            if tree is None or newSubtree.getSize() > tree.getSize():
-                tree = _combineSubtrees(tree, newSubtree)
-                subtrees = []
-            else:
-                # Otherwise it stays in the subtrees array
-                subtrees = [newSubtree]
+    # Repeatedly combining the two smallest trees until one tree remains
+    while len(leaves) + len(merged) > 1:
+        lTree = _popSmallest(leaves, merged)
+        rTree = _popSmallest(leaves, merged)
+        merged.append(_combineSubtrees(lTree, rTree))
 
-    # If there is a leftover single subtree, combine accordingly
-    if len(subtrees) == 1:
-        if subtrees[0].getSize() < tree.getSize():
-            tree = _combineSubtrees(subtrees[0], tree)
-        else:
-            tree = _combineSubtrees(tree, subtrees[0])
+    return merged[0]
 
-    # If there is a leftover single node, it is appended accordingly
-    if len(priorityQueue) == 1:
-        lastNodeTree = BinaryTree(BinaryTreeNode(priorityQueue[0]))
-        if lastNodeTree.getSize() < tree.getSize():
-            tree = _combineSubtrees(lastNodeTree, tree)
-        else:
-            tree = _combineSubtrees(tree, lastNodeTree)
+def createKey(tree: BinaryTree, maxCodeLength: Optional[int] = None, alphabetSize: int = ALPHABET_SIZE) -> List[Tuple]:
 
-    return tree
+    with stats.stage("key"):
+        return _createKey(tree, maxCodeLength, alphabetSize)
+
+def _createKey(tree: BinaryTree, maxCodeLength: Optional[int] = None, alphabetSize: int = ALPHABET_SIZE) -> List[Tuple]:
+
+    # Only the code lengths are taken from the tree; the codes themselves are reassigned canonically
+    # so that the decompressor can rebuild them from the lengths alone
+    leaves = _leafDepths(tree)
+    lengths = {byte: depth for byte, _, depth in leaves}
 
-def createKey(tree: BinaryTree) -> List[Tuple]:
+    # If the tree is deeper than allowed, the lengths are replaced by the best ones within the limit
+    if maxCodeLength is not None and max(lengths.values()) > maxCodeLength:
+        lengths = _limitedLengths([(byte, frequency) for byte, frequency, _ in leaves], maxCodeLength)
 
-    # Creating key from tree and inserting header into keys
-    keys = _generateKeys(tree.getHead())
+    # Keys hold the integer code of each byte; encoding uses the EncodeTable rebuilt from them by _keyCodes
+    keys = EncodeTable(lengths, alphabetSize).entries()
+
+    # Inserting header into keys
     header = (tree.getSize(), len(keys))
     keys.insert(0, header)
 
     return keys
 
-def compress(data: str, key: List[Tuple], compressedFile: str):
+def payloadBits(frequencies: List[int], key: List[Tuple]) -> int:
+
+    # Size of the encoded data: every byte takes as many bits as its code
+    return sum(frequencies[byte] * length for byte, length, _ in key[1:])
+
+def _keyCodes(key: List[Tuple]) -> EncodeTable:
+
+    # Switching list of keys to arrays indexed by byte value holding the integer value and length of its code
+    return EncodeTable(_keyLengths(key))
+
+def _keyLengths(key: List[Tuple]) -> Dict[int, int]:
+
+    # Only the code length of each byte is needed to rebuild the key
+    return {byte: length for byte, length, _ in key[1:]}
+
+def _encode(bitWriter: BinaryFileWriter, chunks: Iterable[bytes], keyTable: EncodeTable,
+            backend: str = "auto") -> int:
+
+    vector = vectorized.resolveBackend(backend) == "numpy"
+    arrays = None
+
+    # Writing data one chunk at a time, returning the checksum of all of it
+    checksum = 0
+    writeBits = bitWriter.writeBits
+    # Plain lists of the table's values are indexed fastest, since their integers already exist
+    codes, lengths = list(keyTable.codes), list(keyTable.lengths)
+    for chunk in chunks:
+        with stats.stage("encode", len(chunk)) as record:
+            start = bitWriter.bitPosition()
+            checksum = zlib.crc32(chunk, checksum)
+
+            # Encoding large chunks in bulk when NumPy is available and every code fits in a 64 bit integer
+            bulk = vector and len(chunk) >= vectorized.MIN_VECTOR_SIZE
+            if bulk:
+                arrays = arrays or vectorized.codeArrays(keyTable)
+                vector = bulk = arrays is not None
+
+            if bulk:
+                vectorized.encode(bitWriter, chunk, arrays)
+            else:
+                for byte in chunk:
+                    writeBits(codes[byte], lengths[byte])
+
+            record.bytesOut = (bitWriter.bitPosition() - start) // 8
+
+    return checksum
+
+def _writeChecksums(bitWriter: BinaryFileWriter, checksum: int):
+
+    # Checksum of the data, then of every byte of the file before this last one
+    bitWriter.writeUInt(checksum)
+    bitWriter.writeUInt(bitWriter.checksum())
+
+def compress(data: bytes, key: List[Tuple], compressedFile: str, backend: str = "auto"):
+
+    compressChunks([data], key, compressedFile, backend)
+
+def compressChunks(chunks: Iterable[bytes], key: List[Tuple], compressedFile: str, backend: str = "auto"):
+
+    bitWriter = BinaryFileWriter(compressedFile)
+
+    with stats.stage("header") as record:
+        # Writing the header: format marker, version, flags and total amount of bytes, as a UInt if it fits
+        shortTotal = key[0][0] <= 0xFFFFFFFF
+        bitWriter.writeUInt(FORMAT_MARKER)
+        bitWriter.writeUByte(VERSION_CANONICAL)
+        bitWriter.writeUByte(FLAG_DATA_CHECKSUM | (FLAG_SHORT_TOTAL if shortTotal else 0))
+        if shortTotal:
+            bitWriter.writeUInt(key[0][0])
+        else:
+            bitWriter.writeULong(key[0][0])
+
+        # Writing key data and then the data itself, followed by the checksum of the data
+        writeLengths(bitWriter, _keyLengths(key))
+        record.bytesOut = bitWriter.bitPosition() // 8
+    bitWriter.writeUInt(_encode(bitWriter, chunks, _keyCodes(key), backend))
+
+    bitWriter.close()
+
+def compress_bytes(data, backend: str = "auto", maxCodeLength: Optional[int] = None) -> bytes:
+    """
+    compress data held in memory into a compressed file held in memory
+    :param data: bytes-like object to compress
+    :param backend: backend to count frequencies and encode with
+    :param maxCodeLength: longest code allowed, None for no limit
+    :return: the compressed file, which decompress.decompress_bytes and decompress.py read
+    """
+    data = bytes(data)
+
+    # Data without any bytes is stored as a header with no codes
+    key = [(0, 0)]
+    if data:
+        key = createKey(createTree(createPriorityQueue(readFrequencies(data, backend))), maxCodeLength)
+
+    compressed = io.BytesIO()
+    compressChunks([data], key, compressed, backend)
+    return compressed.getvalue()
+
+def _encodeStreams(bitWriter: BinaryFileWriter, data: bytes, keyTable: EncodeTable, streams: int,
+                   backend: str = "auto"):
+
+    # Dealing the bytes round-robin to the streams and encoding each stream on its own
+    encoded = []
+    for stream in range(streams):
+        packed = io.BytesIO()
+        streamWriter = BinaryFileWriter(packed)
+        _encode(streamWriter, [data[stream::streams]], keyTable, backend)
+        streamWriter.close()
+        encoded.append(packed.getvalue())
+
+    # Stream count and the jump table of the length of every stream but the last, then the streams
+    bitWriter.writeUByte(streams)
+    for stream in encoded[:-1]:
+        bitWriter.writeUInt(len(stream))
+    for stream in encoded:
+        bitWriter.writeBytes(stream)
+
+def compressBlock(data: bytes, checkpointInterval: int = 0, backend: str = "auto",
+                  maxCodeLength: Optional[int] = None, streams: int = 1) -> Tuple[int, bytes, List[Tuple[int, int]]]:
+
+    # Creating a key from this block's frequencies alone
+    key = createKey(createTree(createPriorityQueue(readFrequencies(data, backend))), maxCodeLength)
+    keyTable = _keyCodes(key)
+
+    # Encoding the payload first so its length can be written before it,
+    # noting the bit position of every checkpointInterval-th byte
+    payload = io.BytesIO()
+    bitWriter = BinaryFileWriter(payload)
+    checkpoints = []
+    if streams > 1:
+        _encodeStreams(bitWriter, data, keyTable, streams, backend)
+    elif checkpointInterval > 0:
+        for start in range(0, len(data), checkpointInterval):
+            checkpoints.append((start, bitWriter.bitPosition()))
+            _encode(bitWriter, [data[start:start + checkpointInterval]], keyTable, backend)
+    else:
+        _encode(bitWriter, [data], keyTable, backend)
+    bitWriter.close()
+
+    # Block: amount of bytes, key data, payload length, payload and checksums
+    block = io.BytesIO()
+    bitWriter = BinaryFileWriter(block)
+    with stats.stage("header") as record:
+        bitWriter.writeUInt(len(data))
+        writeLengths(bitWriter, _keyLengths(key))
+        bitWriter.writeUInt(len(payload.getvalue()))
+        payloadStart = bitWriter.bitPosition()
+        record.bytesOut = payloadStart // 8
+    bitWriter.writeBytes(payload.getvalue())
+    _writeChecksums(bitWriter, zlib.crc32(data))
+    bitWriter.close()
+
+    # Checkpoints as (byte in block, bit from the start of the block)
+    checkpoints = [(start, payloadStart + bit) for start, bit in checkpoints]
+    return len(data), block.getvalue(), checkpoints
+
+def compressBlocks(chunks: Iterable[bytes], compressedFile: str, jobs: Optional[int] = 1,
+                   blockSize: int = BLOCK_SIZE, checkpointInterval: int = 0, backend: str = "auto",
+                   maxCodeLength: Optional[int] = None, streams: int = 1):
+
+    # Checkpoints are bit positions in a single stream, so a block cannot have both
+    if streams > 1 and checkpointInterval > 0:
+        raise ValueError("Blocks split into streams cannot have checkpoints")
+    if not 1 <= streams <= MAX_STREAMS:
+        raise ValueError("The number of streams must be from 1 to %d" % MAX_STREAMS)
+
+    bitWriter = BinaryFileWriter(compressedFile)
+    flags = blockFlags(checkpointInterval, streams)
+    index = BlockIndex(writeBlockHeader(bitWriter, flags, blockSize))
+
+    # The checksum of all of the data is taken as the blocks are handed to the worker processes
+    def items():
+        for chunk in chunks:
+            index.addData(chunk)
+            yield chunk, checkpointInterval, backend, maxCodeLength, streams
+
+    # Compressing blocks on the worker processes and writing them in order,
+    # remembering where each block and each checkpoint starts in the data and in the file
+    for rawLength, block, checkpoints in orderedMap(compressBlock, items(), jobs):
+        index.addBlock(rawLength, block, checkpoints)
+        bitWriter.writeBytes(block)
+
+    index.write(bitWriter, flags)
+    bitWriter.close()
+
+def blockFlags(checkpointInterval: int = 0, streams: int = 1) -> int:
+
+    # Block containers always carry checksums, and flag checkpoints and streams when they have them
+    return FLAG_CHECKSUMS | (FLAG_CHECKPOINTS if checkpointInterval > 0 else 0) | (FLAG_STREAMS if streams > 1 else 0)
+
+def writeBlockHeader(bitWriter: BinaryFileWriter, flags: int, blockSize: int) -> int:
+
+    # Writing the header: format marker, version, flags and block size, returning the offset of the first block
+    bitWriter.writeUInt(FORMAT_MARKER)
+    bitWriter.writeUByte(VERSION_BLOCKS)
+    bitWriter.writeUByte(flags)
+    bitWriter.writeUInt(blockSize)
+    return HEADER_SIZE
+
+def writeBlockIndex(bitWriter: BinaryFileWriter, flags: int, index: List[Tuple[int, int, List[Tuple[int, int]]]],
+                    totalBytes: int, offset: int, checksum: int = 0):
+
+    # A block of 0 bytes ends the blocks
+    bitWriter.writeUInt(0)
+    indexOffset = offset + 4
+
+    # Packing the block index on its own so its checksum can be taken
+    packed = io.BytesIO()
+    indexWriter = BinaryFileWriter(packed)
+    for uncompressedOffset, compressedOffset, checkpoints in index:
+        indexWriter.writeULong(uncompressedOffset)
+        indexWriter.writeULong(compressedOffset)
+        if flags & FLAG_CHECKPOINTS:
+            indexWriter.writeUInt(len(checkpoints))
+            for uncompressedCheckpoint, bitOffset in checkpoints:
+                indexWriter.writeULong(uncompressedCheckpoint)
+                indexWriter.writeULong(bitOffset)
+    if flags & FLAG_CHECKSUMS:
+        indexWriter.writeUInt(checksum)
+    indexWriter.close()
+
+    # Writing the block index with the checksum of the data, the checksum of both, and the trailer pointing to the index
+    bitWriter.writeBytes(packed.getvalue())
+    if flags & FLAG_CHECKSUMS:
+        bitWriter.writeUInt(zlib.crc32(packed.getvalue()))
+    bitWriter.writeUInt(len(index))
+    bitWriter.writeULong(totalBytes)
+    bitWriter.writeULong(indexOffset)
+
+class BlockIndex:
+    """
+    Bookkeeping of a block container as its blocks are written: where each block and each checkpoint starts
+    in the data and in the file, and the checksum of all of the data, for writeBlockIndex to write at the end.
+    """
+
+    def __init__(self, offset: int = HEADER_SIZE):
+        """
+        :param offset: offset of the first block in the file
+        """
+        # (uncompressed offset, file offset, checkpoints) of every block written
+        self.entries: List[Tuple[int, int, List[Tuple[int, int]]]] = []
+        self.totalBytes = 0
+        self.offset = offset
+        # checksum of all of the data added so far
+        self.checksum = 0
+
+    def addData(self, data: bytes) -> None:
+        """
+        add the bytes of the next block to the checksum of all of the data
+        :param data: the bytes of the block
+        :return: None
+        """
+        self.checksum = zlib.crc32(data, self.checksum)
+
+    def addBlock(self, rawLength: int, block: bytes, checkpoints: List[Tuple[int, int]]) -> None:
+        """
+        add a block written after the blocks before it
+        :param rawLength: amount of bytes in the block
+        :param block: the compressed block
+        :param checkpoints: (byte in block, bit from the start of the block) of every checkpoint, as compressBlock
+                            returns them
+        :return: None
+        """
+        checkpoints = [(self.totalBytes + start, self.offset * 8 + bit) for start, bit in checkpoints]
+        self.entries.append((self.totalBytes, self.offset, checkpoints))
+        self.totalBytes += rawLength
+        self.offset += len(block)
+
+    def write(self, bitWriter: BinaryFileWriter, flags: int) -> None:
+        """
+        end the blocks and write the block index and trailer
+        :param bitWriter: writer positioned after the last block
+        :param flags: flags of the block container
+        :return: None
+        """
+        writeBlockIndex(bitWriter, flags, self.entries, self.totalBytes, self.offset, self.checksum)
+
+def _sampleFiles(path) -> List[str]:
+
+    # A directory stands for every file below it
+    if not os.path.isdir(path):
+        return [path]
+
+    files = []
+    for directory, _, names in os.walk(path):
+        files += [os.path.join(directory, name) for name in sorted(names)]
+    return sorted(files)
+
+def trainTable(sampleFiles: Iterable[str], tableFile: str, backend: str = "auto",
+               maxCodeLength: Optional[int] = None) -> int:
+
+    # Every byte value starts with a frequency of 1 so the table can encode data the samples lack
+    frequencies = [1] * ALPHABET_SIZE
+
+    # Adding up the frequencies of every sample file
+    for sampleFile in sampleFiles:
+        for byte, count in enumerate(readFileFrequencies(sampleFile, backend)):
+            frequencies[byte] += count
+
+    # Saving the code lengths of the key; the table is referred to by the ID writeTable returns
+    key = createKey(createTree(createPriorityQueue(frequencies)), maxCodeLength)
+    return writeTable(tableFile, _keyLengths(key))
+
+def loadTable(tableFile: str) -> Tuple[int, EncodeTable]:
+
+    # Reading a table once so it can be used for any number of files; any byte may occur in them
+    identifier, lengths = readTable(tableFile)
+    if len(lengths) != ALPHABET_SIZE:
+        raise ValueError("Table %s does not have a code for every byte value" % tableFile)
+    return identifier, EncodeTable(lengths)
+
+def compressWithTable(chunks: Iterable[bytes], totalBytes: int, table: Tuple[int, EncodeTable],
+                      compressedFile, backend: str = "auto"):
+
+    bitWriter = BinaryFileWriter(compressedFile)
+
+    # Writing the header: format marker, version, flags, the ID of the table in place of a key,
+    # and total amount of bytes
+    identifier, keyTable = table
+    with stats.stage("header") as record:
+        bitWriter.writeUInt(FORMAT_MARKER)
+        bitWriter.writeUByte(VERSION_DICTIONARY)
+        bitWriter.writeUByte(FLAG_CHECKSUMS)
+        bitWriter.writeUInt(identifier)
+        bitWriter.writeULong(totalBytes)
+        record.bytesOut = bitWriter.bitPosition() // 8
+
+    # Writing the data itself with the table's codes, followed by the checksums
+    _writeChecksums(bitWriter, _encode(bitWriter, chunks, keyTable, backend))
+
+    bitWriter.close()
 
+def _lengthsSize(lengths: Dict[int, int], alphabetSize: int = ALPHABET_SIZE) -> int:
+
+    # Number of header bytes the packed code lengths take
+    packed = io.BytesIO()
+    bitWriter = BinaryFileWriter(packed)
+    writeLengths(bitWriter, lengths, alphabetSize)
+    bitWriter.close()
+    return len(packed.getvalue())
+
+def createContextKeys(frequencies: List[int], maxCodeLength: Optional[int] = None) -> Tuple[Optional[List[Tuple]],
+                                                                                             Dict[int, List[Tuple]]]:
+
+    contexts = [frequencies[context << 8:(context + 1) << 8] for context in range(ALPHABET_SIZE)]
+
+    # Starting from the order-0 code of the whole data as the code every context shares
+    order0 = [sum(counts) for counts in zip(*contexts)]
+    sharedLengths = _keyLengths(createKey(createTree(createPriorityQueue(order0)), maxCodeLength))
+
+    # A context gets a code of its own when the bits it saves pay for the code lengths it adds to the header
+    contextKeys = {}
+    for context, counts in enumerate(contexts):
+        if not any(counts):
+            continue
+        key = createKey(createTree(createPriorityQueue(counts)), maxCodeLength)
+        ownBits = payloadBits(counts, key) + 8 * _lengthsSize(_keyLengths(key))
+        sharedBits = sum(counts[byte] * length for byte, length in sharedLengths.items())
+        if ownBits < sharedBits:
+            contextKeys[context] = key
+
+    # The shared code is rebuilt from the rare contexts alone, which only makes it fit them better
+    shared = [0] * ALPHABET_SIZE
+    for context, counts in enumerate(contexts):
+        if context not in contextKeys:
+            for byte, count in enumerate(counts):
+                shared[byte] += count
+    sharedKey = createKey(createTree(createPriorityQueue(shared)), maxCodeLength) if any(shared) else None
+
+    return sharedKey, contextKeys
+
+def _encodeContext(bitWriter: BinaryFileWriter, chunks: Iterable[bytes],
+                   keyTables: List[EncodeTable], backend: str = "auto") -> int:
+
+    vector = vectorized.resolveBackend(backend) == "numpy"
+    arrays = None
+
+    # Writing data one chunk at a time with the code of the byte before each byte, starting from byte 0,
+    # returning the checksum of all of it
+    previous = 0
+    checksum = 0
+    writeBits = bitWriter.writeBits
+    contextCodes = [list(keyTable.codes) for keyTable in keyTables]
+    contextLengths = [list(keyTable.lengths) for keyTable in keyTables]
+    for chunk in chunks:
+        with stats.stage("encode", len(chunk)) as record:
+            start = bitWriter.bitPosition()
+            checksum = zlib.crc32(chunk, checksum)
+
+            bulk = vector and len(chunk) >= vectorized.MIN_VECTOR_SIZE
+            if bulk:
+                arrays = arrays or vectorized.contextArrays(keyTables)
+                vector = bulk = arrays is not None
+
+            if bulk:
+                vectorized.encode(bitWriter, chunk, arrays, previous)
+                previous = chunk[-1]
+            else:
+                for byte in chunk:
+                    writeBits(contextCodes[previous][byte], contextLengths[previous][byte])
+                    previous = byte
+
+            record.bytesOut = (bitWriter.bitPosition() - start) // 8
+
+    return checksum
+
+def compressContext(chunks: Iterable[bytes], frequencies: List[int], totalBytes: int, compressedFile,
+                    backend: str = "auto", maxCodeLength: Optional[int] = None):
+
+    sharedKey, contextKeys = createContextKeys(frequencies, maxCodeLength)
     bitWriter = BinaryFileWriter(compressedFile)
 
-    # Writing only the header
-    bitWriter.writeUInt(key[0][0])
-    bitWriter.writeUShort(key[0][1])
+    with stats.stage("header") as record:
+        # Writing the header: format marker, version, flags and total amount of bytes
+        bitWriter.writeUInt(FORMAT_MARKER)
+        bitWriter.writeUByte(VERSION_CONTEXT)
+        bitWriter.writeUByte(FLAG_CHECKSUMS)
+        bitWriter.writeULong(totalBytes)
+
+        # One bit per context, most significant bit first, set when the context has a code of its own
+        bitmap = bytearray(ALPHABET_SIZE // 8)
+        for context in contextKeys:
+            bitmap[context >> 3] |= 0x80 >> (context & 7)
+        bitWriter.writeBytes(bytes(bitmap))
+
+        # Writing the shared code lengths, then those of every context with its own code in order
+        writeLengths(bitWriter, _keyLengths(sharedKey) if sharedKey else {})
+        for context in sorted(contextKeys):
+            writeLengths(bitWriter, _keyLengths(contextKeys[context]))
+        record.bytesOut = bitWriter.bitPosition() // 8
+
+    # Contexts without a code of their own all point to the same shared table
+    sharedTable = _keyCodes(sharedKey) if sharedKey else EncodeTable({})
+    keyTables = [_keyCodes(contextKeys[context]) if context in contextKeys else sharedTable
+                 for context in range(ALPHABET_SIZE)]
+    _writeChecksums(bitWriter, _encodeContext(bitWriter, chunks, keyTables, backend))
+
+    bitWriter.close()
+
+def createSampledKey(frequencies: List[int], maxCodeLength: Optional[int] = None) -> List[Tuple]:
+
+    # Byte values missing from the frequencies share the escape symbol, which is only needed if there are any
+    counts = list(frequencies) + [0]
+    if not all(frequencies):
+        counts[ESCAPE] = max(1, sum(frequencies) >> ESCAPE_SHIFT)
+
+    return createKey(createTree(createPriorityQueue(counts)), maxCodeLength, ALPHABET_SIZE + 1)
+
+def _sampledTable(key: List[Tuple]) -> EncodeTable:
+
+    # Codes of the byte values, the ones without a code of their own taking the escape code and the byte
+    return EncodeTable(_keyLengths(key), ALPHABET_SIZE + 1, ESCAPE)
+
+def _tableBits(frequencies: List[int], keyTable: EncodeTable) -> int:
+
+    # Size of data with these frequencies encoded with the table, escaped bytes included
+    return sum(count * length for count, length in zip(frequencies, keyTable.lengths))
+
+def _stridedSample(infile, sampleSize: int) -> bytes:
+
+    # SAMPLE_PIECES evenly spaced pieces of a seekable file, so the sample sees all of it and not just its start
+    if not infile.seekable():
+        raise ValueError("Strided sampling needs a seekable file")
+    size = infile.seek(0, os.SEEK_END)
+    pieceSize = max(1, sampleSize // SAMPLE_PIECES)
+    pieces = []
+    with stats.stage("read") as record:
+        for piece in range(SAMPLE_PIECES):
+            infile.seek(piece * max(0, size - pieceSize) // max(1, SAMPLE_PIECES - 1))
+            pieces.append(infile.read(pieceSize))
+        infile.seek(0)
+        record.bytesOut = sum(len(piece) for piece in pieces)
+
+    return b"".join(pieces)
+
+def _streamBlocks(infile, blockSize: int, head: bytes = b"") -> Iterator[bytes]:
+
+    # Blocks of the stream, starting with bytes already read from it; a pipe may return fewer bytes than asked
+    pending = bytearray(head)
+    while True:
+        while len(pending) < blockSize:
+            with stats.stage("read") as record:
+                chunk = infile.read(blockSize - len(pending))
+                record.bytesOut = len(chunk)
+            if not chunk:
+                break
+            pending += chunk
+        if not pending:
+            return
+        yield bytes(pending[:blockSize])
+        del pending[:blockSize]
+
+def compressSampled(infile, compressedFile, sampleSize: int = SAMPLE_SIZE, strided: bool = False,
+                    blockSize: int = SAMPLED_BLOCK_SIZE, drift: float = DRIFT, backend: str = "auto",
+                    maxCodeLength: Optional[int] = None) -> Tuple[int, int]:
+
+    # Blocks are decoded whole, so they are limited to a size the decoder accepts
+    if not 0 < blockSize <= MAX_SAMPLED_BLOCK_SIZE:
+        raise ValueError("The block size of a single pass file must be from 1 to %d" % MAX_SAMPLED_BLOCK_SIZE)
+
+    # The first table is estimated from the first sampleSize bytes, which are kept to be encoded,
+    # or from pieces spread over a seekable file
+    head = b""
+    if strided:
+        sample = _stridedSample(infile, sampleSize)
+    else:
+        with stats.stage("read") as record:
+            head = sample = infile.read(sampleSize)
+            record.bytesOut = len(head)
+    key = createSampledKey(readFrequencies(sample, backend), maxCodeLength)
+    keyTable = _sampledTable(key)
+    newTable = True
+
+    bitWriter = BinaryFileWriter(compressedFile)
+
+    # Writing the header: format marker, version and flags; the total amount of bytes is not known yet
+    bitWriter.writeUInt(FORMAT_MARKER)
+    bitWriter.writeUByte(VERSION_SAMPLED)
+    bitWriter.writeUByte(FLAG_CHECKSUMS)
+
+    totalBytes = 0
+    tableCount = 0
+    checksum = 0
+    for block in _streamBlocks(infile, blockSize, head):
+        # Replacing the table when this block would cost too much more with it than with a table of its own
+        frequencies = readFrequencies(block, backend)
+        blockKey = createSampledKey(frequencies, maxCodeLength)
+        blockTable = _sampledTable(blockKey)
+        ownBits = _tableBits(frequencies, blockTable) + 8 * _lengthsSize(_keyLengths(blockKey), ALPHABET_SIZE + 1)
+        if _tableBits(frequencies, keyTable) > ownBits * (1 + drift):
+            key, keyTable, newTable = blockKey, blockTable, True
+
+        # Encoding the payload first so its length can be written before it
+        payload = io.BytesIO()
+        payloadWriter = BinaryFileWriter(payload)
+        checksum = zlib.crc32(block, checksum)
+        _encode(payloadWriter, [block], keyTable, backend)
+        payloadWriter.close()
+
+        # Block: amount of bytes, whether a new table follows, the table, payload length and payload
+        with stats.stage("header") as record:
+            start = bitWriter.bitPosition()
+            bitWriter.writeUInt(len(block))
+            bitWriter.writeUByte(1 if newTable else 0)
+            if newTable:
+                writeLengths(bitWriter, _keyLengths(key), ALPHABET_SIZE + 1)
+                tableCount += 1
+                newTable = False
+            bitWriter.writeUInt(len(payload.getvalue()))
+            record.bytesOut = (bitWriter.bitPosition() - start) // 8
+        bitWriter.writeBytes(payload.getvalue())
+        totalBytes += len(block)
+
+    # A block of 0 bytes ends the blocks, followed by the checksums
+    bitWriter.writeUInt(0)
+    _writeChecksums(bitWriter, checksum)
+
+    bitWriter.close()
+    return totalBytes, tableCount
+
+def readFileTokenScores(sourceFile, backend: str = "auto") -> Dict[bytes, int]:
+
+    scores = Counter()
 
-    keyDict = {}
-    # Writing key data
-    for i in range(1, len(key)):
+    # Adding up the symbols every candidate token would save in each chunk of the file
+    for chunk in readChunks(sourceFile):
+        scores.update(countCandidates(chunk, backend))
 
-        # (Character, bitCode length, bitCode) for given char
-        charData = key[i]
+    return scores
 
-        # Switching list of keys to dictionary mapping chars to binary code for writing input data
-        keyDict[charData[0]] = charData[2]
+def readFileTokenFrequencies(sourceFile, tokenizer: Tokenizer) -> List[int]:
 
-        # Writing character ascii value and amount
-        bitWriter.writeUByte(ord(charData[0]))
-        bitWriter.writeUShort(charData[1])
+    frequencies = [0] * tokenizer.alphabetSize
 
-        # Writing individual bits for character code
-        for num in charData[2]:
-            bitWriter.writeBit(int(num))
+    # Splitting each chunk of the file into symbols and adding up how often each occurs
+    for chunk in readChunks(sourceFile):
+        for symbol, count in enumerate(tokenizer.frequencies(tokenizer.tokenize(chunk))):
+            frequencies[symbol] += count
 
-    # Writing data
-    for char in data:
-        for num in keyDict[char]:
-            bitWriter.writeBit(int(num))
+    return frequencies
+
+def _encodeTokens(bitWriter: BinaryFileWriter, chunks: Iterable[bytes], keyTable: EncodeTable, tokenizer: Tokenizer,
+                  backend: str = "auto") -> int:
+
+    vector = vectorized.resolveBackend(backend) == "numpy"
+    arrays = None
+
+    # Writing data one chunk at a time as symbols of the extended alphabet, returning the checksum of all of it
+    checksum = 0
+    writeBits = bitWriter.writeBits
+    codes, lengths = list(keyTable.codes), list(keyTable.lengths)
+    for chunk in chunks:
+        checksum = zlib.crc32(chunk, checksum)
+        symbols = tokenizer.tokenize(chunk)
+        with stats.stage("encode", len(chunk)) as record:
+            start = bitWriter.bitPosition()
+
+            # The tokenizer returns an array of symbols with NumPy, which is encoded in bulk like bytes
+            bulk = vector and tokenizer.vector and len(symbols) >= vectorized.MIN_VECTOR_SIZE
+            if bulk:
+                arrays = arrays or vectorized.codeArrays(keyTable)
+                vector = bulk = arrays is not None
+
+            if bulk:
+                vectorized.encode(bitWriter, symbols, arrays)
+            else:
+                for symbol in (symbols.tolist() if tokenizer.vector else symbols):
+                    writeBits(codes[symbol], lengths[symbol])
+
+            record.bytesOut = (bitWriter.bitPosition() - start) // 8
+
+    return checksum
+
+def compressTokens(sourceFile, compressedFile, alphabetSize: int = EXTENDED_ALPHABET_SIZE, backend: str = "auto",
+                   maxCodeLength: Optional[int] = None) -> int:
+
+    # First pass: choosing the digrams and runs that save the most symbols as the tokens
+    tokens = selectTokens(readFileTokenScores(sourceFile, backend), alphabetSize)
+    tokenizer = Tokenizer(tokens, backend)
+
+    # Second pass: counting the symbols the file splits into, and creating a key over the extended alphabet
+    frequencies = readFileTokenFrequencies(sourceFile, tokenizer)
+    key = createKey(createTree(createPriorityQueue(frequencies)), maxCodeLength, tokenizer.alphabetSize)
+
+    bitWriter = BinaryFileWriter(compressedFile)
+
+    with stats.stage("header") as record:
+        # Writing the header: format marker, version, flags and total amount of bytes
+        bitWriter.writeUInt(FORMAT_MARKER)
+        bitWriter.writeUByte(VERSION_TOKENS)
+        bitWriter.writeUByte(FLAG_CHECKSUMS)
+        bitWriter.writeULong(os.path.getsize(sourceFile))
+
+        # Writing the tokens, then the code lengths of the byte values and tokens
+        writeTokens(bitWriter, tokens)
+        writeLengths(bitWriter, _keyLengths(key), tokenizer.alphabetSize)
+        record.bytesOut = bitWriter.bitPosition() // 8
+
+    # Third pass: encoding the file split into symbols again, followed by the checksums
+    keyTable = EncodeTable(_keyLengths(key), tokenizer.alphabetSize)
+    _writeChecksums(bitWriter, _encodeTokens(bitWriter, readChunks(sourceFile), keyTable, tokenizer, backend))
 
     bitWriter.close()
+    return len(tokens)
+
+def _archiveFiles(directory) -> List[Tuple[str, str]]:
+
+    # Every file below the directory, with its path relative to the directory using / separators
+    files = []
+    for parent, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(parent, name)
+            files.append((path, os.path.relpath(path, directory).replace(os.sep, "/")))
+
+    return sorted(files, key=lambda file: file[1])
+
+def compressMember(sourceFile, backend: str = "auto", maxCodeLength: Optional[int] = None) -> Tuple[int, bytes]:
+
+    # Compressing one file of an archive in memory, as a complete compressed file of its own
+    size = os.path.getsize(sourceFile)
+    if size == 0:
+        return 0, b""
+
+    key = createKey(createTree(createPriorityQueue(readFileFrequencies(sourceFile, backend))), maxCodeLength)
+    member = io.BytesIO()
+    compressChunks(readChunks(sourceFile), key, member, backend)
+
+    return size, member.getvalue()
+
+def compressArchive(directory, archiveFile, jobs: Optional[int] = 1, backend: str = "auto",
+                    maxCodeLength: Optional[int] = None) -> int:
+
+    files = _archiveFiles(directory)
+    bitWriter = BinaryFileWriter(archiveFile)
+
+    # Writing the header: format marker, version and flags
+    bitWriter.writeUInt(FORMAT_MARKER)
+    bitWriter.writeUByte(VERSION_ARCHIVE)
+    bitWriter.writeUByte(FLAG_CHECKSUMS)
+    offset = 6
+
+    # Compressing the files on the worker processes, which read the files themselves,
+    # and writing them in order while remembering where each one starts
+    index = []
+    items = ((path, backend, maxCodeLength) for path, _ in files)
+    for (_, name), (size, member) in zip(files, orderedMap(compressMember, items, jobs)):
+        index.append((name, size, offset, len(member)))
+        bitWriter.writeBytes(member)
+        offset += len(member)
+
+    # Writing the file index and its checksum, then the trailer with the amount of files and the offset of the index
+    packed = io.BytesIO()
+    indexWriter = BinaryFileWriter(packed)
+    for name, size, memberOffset, memberLength in index:
+        encodedName = name.encode("utf-8")
+        indexWriter.writeUShort(len(encodedName))
+        indexWriter.writeBytes(encodedName)
+        indexWriter.writeULong(size)
+        indexWriter.writeULong(memberOffset)
+        indexWriter.writeULong(memberLength)
+    indexWriter.close()
+    bitWriter.writeBytes(packed.getvalue())
+    bitWriter.writeUInt(zlib.crc32(packed.getvalue()))
+    bitWriter.writeUInt(len(index))
+    bitWriter.writeULong(offset)
+
+    bitWriter.close()
+    return len(index)
 
 def main():
     parser = ArgumentParser(description="compress file using Huffman compression algorithm")
-    parser.add_argument("file", help="file to compress")
-    parser.add_argument("compressedFile", nargs="?", default=None, help="name of compressed file to create; defaults to adding .hc suffix if not supplied")
+    parser.add_argument("file", help="file to compress, directory to compress with --batch, "
+                                     "or - for standard input with --single-pass")
+    parser.add_argument("compressedFile", nargs="?", default=None, help="name of compressed file to create, or - for standard output with --single-pass; defaults to adding .hc suffix if not supplied, or to standard output for standard input")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="split the file into independently compressed blocks and compress them on this many processes")
+    parser.add_argument("--block-size", type=int, default=None,
+                        help="number of bytes in each block when using --jobs, --streams or --single-pass; defaults to %d, "
+                             "or %d with --single-pass" % (BLOCK_SIZE, SAMPLED_BLOCK_SIZE))
+    parser.add_argument("--streams", action="store_true",
+                        help="split every block into interleaved streams, which can be decoded independently; "
+                             "writes a block container")
+    parser.add_argument("--stream-count", type=int, default=None, metavar="N",
+                        help="number of interleaved streams with --streams, which it implies; defaults to %d" % STREAMS)
+    parser.add_argument("--seekable", action="store_true",
+                        help="write the block container with checkpoints in its index for random access reads")
+    parser.add_argument("--checkpoint-interval", type=int, default=CHECKPOINT_INTERVAL,
+                        help="number of bytes between checkpoints when using --seekable; defaults to %d"
+                             % CHECKPOINT_INTERVAL)
+    parser.add_argument("--backend", choices=vectorized.BACKENDS, default="auto",
+                        help="count frequencies and encode with NumPy or pure Python; auto uses NumPy if it is installed")
+    parser.add_argument("--batch", action="store_true",
+                        help="compress every file below the directory file into a single archive, using --jobs processes")
+    parser.add_argument("--max-code-length", type=int, default=None,
+                        help="limit codes to this many bits, %d to %d, so they fit fixed size decoding tables"
+                             % (MIN_CODE_LENGTH_LIMIT, MAX_CODE_LENGTH))
+    parser.add_argument("--table", default=None,
+                        help="compress with the codes of a pretrained table file instead of writing a key")
+    parser.add_argument("--train", default=None, metavar="TABLE",
+                        help="train a table file on file, or on every file in it if it is a directory, instead of compressing")
+    parser.add_argument("--context", action="store_true",
+                        help="code every byte with a code chosen by the byte before it (order-1), "
+                             "for data whose bytes depend on their neighbours such as text and logs")
+    parser.add_argument("--single-pass", action="store_true",
+                        help="read the file once, coding it with a table estimated from a sample and replacing "
+                             "the table between blocks when the data drifts away from it; works on pipes")
+    parser.add_argument("--sample-size", type=int, default=SAMPLE_SIZE,
+                        help="number of bytes to estimate the first table from with --single-pass; defaults to %d"
+                             % SAMPLE_SIZE)
+    parser.add_argument("--strided", action="store_true",
+                        help="take the sample as %d pieces spread over the file instead of from its start; "
+                             "needs a seekable file" % SAMPLE_PIECES)
+    parser.add_argument("--drift", type=float, default=DRIFT,
+                        help="replace the table when a block would take this fraction more bits with it than "
+                             "with a table of its own; defaults to %g" % DRIFT)
+    parser.add_argument("--extended-alphabet", action="store_true",
+                        help="code the most frequent byte pairs and runs of a byte value as symbols of their own; "
+                             "for text and logs")
+    parser.add_argument("--alphabet-size", type=int, default=None, metavar="SIZE",
+                        help="number of symbols in all with --extended-alphabet, which it implies; defaults to %d"
+                             % EXTENDED_ALPHABET_SIZE)
+    parser.add_argument("--stats", action="store_true",
+                        help="report the time, bytes in and out and allocated memory blocks of every stage "
+                             "on standard error, or to --stats-file; stages run on worker processes are not included")
+    parser.add_argument("--stats-format", choices=("text", "json"), default=None,
+                        help="write the --stats report as a table or as JSON, implying --stats; defaults to text")
+    parser.add_argument("--stats-file", default=None, metavar="FILE",
+                        help="write the --stats report to FILE instead of standard error")
+    parser.add_argument("--profile", default=None, metavar="FILE",
+                        help="profile the run with cProfile, writing the statistics to FILE and listing the "
+                             "slowest functions with --stats")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="trace memory with tracemalloc, adding the peak of every stage and the top "
+                             "allocation sites to the --stats output")
     args = parser.parse_args()
+    # Report format: --stats-format alone is enough to ask for a report
+    statsFormat = args.stats_format or ("text" if args.stats else None)
+
+    # Measuring the stages of the whole run when asked to
+    with stats.report(statsFormat, args.profile, args.trace_memory, args.stats_file):
+        return _compress(args)
+
+def _compress(args) -> int:
 
     fileToCompress = args.file
+
+    try:
+        vectorized.resolveBackend(args.backend)
+    except ValueError as error:
+        print(error)
+        return 1
+
+    maxCodeLength = args.max_code_length
+    if maxCodeLength is not None and not MIN_CODE_LENGTH_LIMIT <= maxCodeLength <= MAX_CODE_LENGTH:
+        print("--max-code-length must be from %d to %d" % (MIN_CODE_LENGTH_LIMIT, MAX_CODE_LENGTH))
+        return 1
+
+    # Training a table on sample data for later use with --table
+    if args.train is not None:
+        identifier = trainTable(_sampleFiles(fileToCompress), args.train, args.backend, maxCodeLength)
+        print("Trained table %s with ID %08x" % (args.train, identifier))
+        return 0
+
     compressedFile = args.compressedFile
     if compressedFile is None:
-        compressedFile = fileToCompress + ".hc"
+        compressedFile = "-" if fileToCompress == "-" else fileToCompress.rstrip("/" + os.sep) + ".hc"
+
+    if args.batch and (args.table is not None or args.seekable):
+        print("--batch cannot be combined with --table or --seekable")
+        return 1
 
-    # Reading data from file
-    data: str = readData(fileToCompress)
+    if args.context and (args.batch or args.table is not None or args.jobs is not None or args.seekable):
+        print("--context cannot be combined with --batch, --table, --jobs or --seekable")
+        return 1
+
+    # Interleaved streams: --stream-count alone is enough to ask for them
+    streams = args.stream_count if args.stream_count is not None else STREAMS if args.streams else None
+
+    if streams is not None and (args.batch or args.table is not None or args.context or args.seekable
+                                     or args.single_pass):
+        print("--streams cannot be combined with --batch, --table, --context, --seekable or --single-pass")
+        return 1
+
+    # Extended alphabet: --alphabet-size alone is enough to ask for it
+    alphabetSize = args.alphabet_size if args.alphabet_size is not None \
+        else EXTENDED_ALPHABET_SIZE if args.extended_alphabet else None
+
+    if alphabetSize is not None:
+        if args.batch or args.table is not None or args.jobs is not None or args.seekable or args.context \
+                or args.single_pass or streams is not None:
+            print("--extended-alphabet cannot be combined with --batch, --table, --jobs, --seekable, --context, "
+                  "--single-pass or --streams")
+            return 1
+        if not ALPHABET_SIZE < alphabetSize <= MAX_ALPHABET_SIZE:
+            print("--alphabet-size must be from %d to %d" % (ALPHABET_SIZE + 1, MAX_ALPHABET_SIZE))
+            return 1
+
+    # Single pass: the file is read once, so it may be a pipe, and the compressed file may be standard output
+    if args.single_pass:
+        if args.batch or args.table is not None or args.jobs is not None or args.seekable or args.context:
+            print("--single-pass cannot be combined with --batch, --table, --jobs, --seekable or --context")
+            return 1
+        if args.sample_size <= 0 or args.drift < 0:
+            print("--sample-size must be positive and --drift must not be negative")
+            return 1
+        infile = sys.stdin.buffer if fileToCompress == "-" else open(fileToCompress, "rb")
+        try:
+            compressSampled(infile, sys.stdout.buffer if compressedFile == "-" else compressedFile, args.sample_size,
+                            args.strided, args.block_size or SAMPLED_BLOCK_SIZE, args.drift, args.backend,
+                            maxCodeLength)
+        except ValueError as error:
+            # Messages go to standard error, since standard output may be the compressed file
+            print(error, file=sys.stderr)
+            return 1
+        finally:
+            if infile is not sys.stdin.buffer:
+                infile.close()
+        return 0
+
+    if fileToCompress == "-" or compressedFile == "-":
+        print("Standard input and output can only be used with --single-pass")
+        return 1
+
+    # Archive of a directory: the files are compressed independently on the worker processes
+    if args.batch:
+        if not os.path.isdir(fileToCompress):
+            print("%s is not a directory" % fileToCompress)
+            return 1
+        count = compressArchive(fileToCompress, compressedFile, args.jobs or 1, args.backend, maxCodeLength)
+        print("Compressed %d files into %s" % (count, compressedFile))
+        return 0
 
     # If there is no data, cannot perform compression
-    if data == "":
+    if os.path.getsize(fileToCompress) == 0:
         print("Empty file, nothing to compress")
         return 1
 
-    # Determining frequencies of characters in data
-    frequencies: Dict[str, int] = readFrequencies(data)
-
-    # Ordering frequencies as a priority queue and creating a sorted binary tree for the characters
-    priorityQueue = sorted(frequencies.items(), key=lambda x: x[1])
+    # Extended alphabet: choosing tokens, counting the symbols the file splits into, then compressing it
+    if alphabetSize is not None:
+        try:
+            compressTokens(fileToCompress, compressedFile, alphabetSize, args.backend, maxCodeLength)
+        except ValueError as error:
+            print(error)
+            return 1
+        return 0
+
+    # Context mode: counting pairs of bytes, then compressing with a code for each preceding byte
+    if args.context:
+        frequencies = readFileContextFrequencies(fileToCompress, args.backend)
+        compressContext(readChunks(fileToCompress), frequencies, os.path.getsize(fileToCompress), compressedFile,
+                        args.backend, maxCodeLength)
+        return 0
+
+    # Dictionary mode: the codes come from the table, so no frequencies are counted and no key is written
+    if args.table is not None:
+        if args.jobs is not None or args.seekable:
+            print("--table cannot be combined with --jobs or --seekable")
+            return 1
+        try:
+            table = loadTable(args.table)
+        except (OSError, ValueError) as error:
+            print(error)
+            return 1
+        compressWithTable(readChunks(fileToCompress), os.path.getsize(fileToCompress), table, compressedFile,
+                          args.backend)
+        return 0
+
+    # Block container: every block gets its own key, so blocks are compressed independently
+    if args.jobs is not None or args.seekable or streams is not None:
+        checkpointInterval = args.checkpoint_interval if args.seekable else 0
+        blockSize = args.block_size or BLOCK_SIZE
+        try:
+            compressBlocks(readChunks(fileToCompress, blockSize), compressedFile, args.jobs or 1, blockSize,
+                           checkpointInterval, args.backend, maxCodeLength, 1 if streams is None else streams)
+        except ValueError as error:
+            print(error)
+            return 1
+        return 0
+
+    # Determining frequencies of each byte value in the file, reading it one chunk at a time
+    frequencies: List[int] = readFileFrequencies(fileToCompress, args.backend)
+
+    # Ordering frequencies as a priority queue and creating a sorted binary tree for the bytes
+    priorityQueue = createPriorityQueue(frequencies)
     tree: BinaryTree = createTree(priorityQueue)
 
     # Creating a key from the traversal of the binary tree
-    key = createKey(tree)
-    # Using key to compress file
-    compress(data, key, compressedFile)
+    key = createKey(tree, maxCodeLength)
+
+    # Reporting how much the length limit costs against the unlimited code
+    if maxCodeLength is not None:
+        limitedBits = payloadBits(frequencies, key)
+        unlimitedBits = payloadBits(frequencies, createKey(tree))
+        print("Codes limited to %d bits: %d payload bytes, %.3f%% more than without the limit"
+              % (maxCodeLength, (limitedBits + 7) // 8, 100 * (limitedBits - unlimitedBits) / unlimitedBits))
+    # Using key to compress file, reading it a second time one chunk at a time
+    compressChunks(readChunks(fileToCompress), key, compressedFile, args.backend)
 
     return 0
 # ----------------------------------------------------------------------
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -11,22 +11,608 @@
 
 # ----------------------------------------------------------------------
 
-from typing import Optional, Dict
+import io
+import os
+import struct
+import sys
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple, Iterator
 from argparse import ArgumentParser
 
 from BinaryFileIO import *
+from canonical import FORMAT_MARKER, VERSION_LEGACY, VERSION_CANONICAL, VERSION_BLOCKS, VERSION_DICTIONARY, \
+    VERSION_ARCHIVE, VERSION_CONTEXT, VERSION_SAMPLED, VERSION_TOKENS, FLAG_CHECKPOINTS, FLAG_CHECKSUMS, FLAG_STREAMS, \
+    FLAG_DATA_CHECKSUM, FLAG_SHORT_TOTAL, ALPHABET_SIZE, \
+    ESCAPE, HEADER_SIZE, MAX_SAMPLED_BLOCK_SIZE, \
+    EncodeTable, canonicalCodes, readLengths
+from dictionary import findTables, readTable
+from parallel import orderedMap
+from tokens import readTokens
+import stats
+
+# number of bits resolved by a single lookup in the primary decoding table
+PRIMARY_BITS = 12
+
+# widest secondary decoding table; longer codes chain through further tables of at most this many bits,
+# so the tables grow with the number of codes rather than exponentially with their length
+SECONDARY_BITS = 8
+
+# number of compressed bytes read from the file at a time
+CHUNK_SIZE = 1 << 20
+
+# number of bytes decoded and written to the output file at a time
+DECODE_BLOCK_SIZE = 1 << 20
+
+# size of the block container trailer: UInt amount of blocks, ULong total bytes and ULong index offset
+TRAILER_SIZE = 20
+
+# size of the archive trailer: UInt amount of files and ULong index offset
+ARCHIVE_TRAILER_SIZE = 12
+
+# size of the checksums ending a file or block with FLAG_CHECKSUMS: UInt data checksum and UInt file checksum
+CHECKSUMS_SIZE = 8
+
+# number of blocks whose decoding tables a HuffmanReader keeps
+BLOCK_CACHE_SIZE = 16
+
+# number of pretrained code tables whose decoding tables are kept between decompressions
+TABLE_CACHE_SIZE = 16
+
+# big endian 64 bit word the decoder refills its bit buffer with
+WORD = struct.Struct('>Q')
+
+# ----------------------------------------------------------------------
+
+class DecodeTable:
+    """
+    Lookup tables for decoding a prefix code several bits at a time.
+    The primary table is indexed by the next primaryBits bits of the stream. Each entry holds the number
+    of bits it consumes and the bytes it produces, which may be several symbols when their codes are short;
+    without such entries the primary table is no wider than the longest code.
+    Codes longer than primaryBits share an entry that points to a secondary table for the next bits, at most
+    SECONDARY_BITS of them, whose entries either resolve a code or point to a further secondary table.
+    With expansions, a symbol may stand for several bytes, and the secondary tables hold bytes objects
+    instead of byte values.
+    """
+
+    def __init__(self, codes: List[Tuple[int, int, int]], primaryBits: int = PRIMARY_BITS, multiSymbol: bool = True,
+                 expansions: Optional[List[bytes]] = None, count: Optional[int] = None):
+        """
+        build the lookup tables
+        :param codes: (symbol, code length, code) for every symbol
+        :param primaryBits: width of the primary table index; without the entries resolving several symbols,
+                            no more than the longest code
+        :param multiSymbol: whether to build the entries resolving several symbols; without them
+                            lengths and symbols are the single symbol entries
+        :param expansions: bytes each symbol stands for, None if every symbol is a byte value
+        :param count: number of bytes the tables will decode, None if not known; when there are fewer of them
+                      than primary table entries, the entries resolving several symbols are not built
+        """
+        # Building the entries resolving several symbols costs more than it saves on fewer bytes than there are
+        # entries, and without them the primary table needs no more bits than the longest code
+        longest = max([length for _, length, _ in codes], default=1)
+        if count is not None and count < 1 << primaryBits:
+            multiSymbol = False
+        self.primaryBits = primaryBits if multiSymbol else min(primaryBits, longest)
+        self.expansions = expansions
+        # bits that must be in the bit buffer before a lookup
+        self.maxLength = max(longest, self.primaryBits)
+        # most bytes a single symbol and a single primary table entry can produce
+        self.maxExpansion = max(map(len, expansions or [b"."]))
+        self.maxDecoded = self.primaryBits * self.maxExpansion
+
+        size = 1 << self.primaryBits
+        # (code length, byte value) for every index whose leading bits are a complete code
+        single: List[Optional[Tuple[int, int]]] = [None] * size
+        # codes too long for the primary table, grouped by their first primaryBits bits
+        longCodes: Dict[int, List[Tuple[int, int, int]]] = {}
+
+        for symbol, length, code in codes:
+            if length <= self.primaryBits:
+                shift = self.primaryBits - length
+                start = code << shift
+                for i in range(start, start + (1 << shift)):
+                    if single[i] is not None:
+                        raise ValueError("DecodeTable error: key is not a prefix code")
+                    single[i] = (length, symbol)
+            else:
+                prefix = code >> (length - self.primaryBits)
+                longCodes.setdefault(prefix, []).append((symbol, length - self.primaryBits, code))
+
+        # entries resolving as many symbols as possible, and entries resolving exactly one
+        self.lengths = [0] * size
+        self.symbols: List = [None] * size
+        self.singleLengths = [0] * size
+        self.singleSymbols: List = [None] * size
+
+        for i in range(size):
+            if single[i] is not None:
+                if multiSymbol:
+                    self.lengths[i], self.symbols[i] = self._resolveShortCodes(single, i)
+                self.singleLengths[i] = single[i][0]
+                self.singleSymbols[i] = expansions[single[i][1]] if expansions else bytes((single[i][1],))
+            elif i in longCodes:
+                self.symbols[i] = self.singleSymbols[i] = self._createSecondary(longCodes[i], self.primaryBits)
+
+        if not multiSymbol:
+            self.lengths, self.symbols = self.singleLengths, self.singleSymbols
+
+    # ------------------------------------------------------------------
+
+    def _resolveShortCodes(self, single: List, index: int) -> Tuple[int, bytes]:
+        """
+        decode as many whole symbols as the bits of a primary table index determine
+        :param single: single symbol entries of the primary table
+        :param index: primary table index
+        :return: number of bits consumed and the decoded bytes
+        """
+        mask = (1 << self.primaryBits) - 1
+        used, symbol = single[index]
+        decoded = [symbol]
+
+        while used < self.primaryBits:
+            # the remaining known bits lead the next lookup and the unknown bits trail them;
+            # the next symbol is only determined if its code fits within the known bits
+            entry = single[(index << used) & mask]
+            if entry is None or used + entry[0] > self.primaryBits:
+                break
+            used += entry[0]
+            decoded.append(entry[1])
+
+        if self.expansions:
+            return used, b"".join([self.expansions[symbol] for symbol in decoded])
+        return used, bytes(decoded)
+
+    # ------------------------------------------------------------------
+
+    def _createSecondary(self, codes: List[Tuple[int, int, int]], skip: int) -> Tuple[int, int, List[int], List]:
+        """
+        build the table for codes sharing their first skip bits, and the tables chained from it
+        :param codes: (symbol, length beyond the shared bits, full code) for each code sharing them
+        :param skip: number of bits the codes share, which come before this table's index
+        :return: (skip, index width, total code lengths, symbols) where each symbol is a byte value, or a bytes
+                 object with expansions, and entries with a length of 0 hold the next table or None
+        """
+        subBits = min(SECONDARY_BITS, max(length for _, length, _ in codes))
+        lengths = [0] * (1 << subBits)
+        symbols: List = [None] * (1 << subBits)
+        # codes too long for this table, grouped by their next subBits bits
+        longCodes: Dict[int, List[Tuple[int, int, int]]] = {}
+
+        for symbol, length, code in codes:
+            if length > subBits:
+                prefix = (code >> (length - subBits)) & ((1 << subBits) - 1)
+                longCodes.setdefault(prefix, []).append((symbol, length - subBits, code))
+                continue
+            shift = subBits - length
+            start = (code & ((1 << length) - 1)) << shift
+            for i in range(start, start + (1 << shift)):
+                if lengths[i] != 0:
+                    raise ValueError("DecodeTable error: key is not a prefix code")
+                lengths[i] = length + skip
+                symbols[i] = self.expansions[symbol] if self.expansions else symbol
+
+        for prefix, group in longCodes.items():
+            if lengths[prefix] != 0:
+                raise ValueError("DecodeTable error: key is not a prefix code")
+            symbols[prefix] = self._createSecondary(group, skip + subBits)
+
+        return skip, subBits, lengths, symbols
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
+
+class HuffmanDecoder:
+    """
+    Decodes a bitstream with a DecodeTable, peeking at a bit buffer that is refilled 64 bits at a time.
+    Input can be fed in pieces; the bit buffer and any unread input carry over between calls to decode.
+    Fed input may be a memoryview of a memory mapped file, which is read in place.
+    """
+
+    def __init__(self, table: DecodeTable, bitBuffer: int = 0, bitCount: int = 0):
+        """
+        :param table: lookup tables for the code
+        :param bitBuffer: bits already read from the stream that have not been decoded
+        :param bitCount: number of bits in bitBuffer
+        """
+        self.table = table
+        self.bitBuffer = bitBuffer
+        self.bitCount = bitCount
+        self.data = b""
+        self.pos = 0
+
+    # ------------------------------------------------------------------
+
+    def feed(self, data) -> None:
+        """
+        add compressed bytes to decode
+        :param data: bytes-like object that follows the previously fed data in the stream
+        :return: None
+        """
+        if self.pos < len(self.data):
+            data = b"".join((self.data[self.pos:], data))
+        self.data = data
+        self.pos = 0
+
+    # ------------------------------------------------------------------
+
+    def unreadBytes(self) -> bytes:
+        """
+        get the fed bytes that follow the last byte holding decoded bits, such as checksums after the data
+        :return: the whole bytes not decoded yet
+        """
+        whole = self.bitCount // 8
+        head = (self.bitBuffer & ((1 << 8 * whole) - 1)).to_bytes(whole, "big")
+        return head + bytes(self.data[self.pos:])
+
+    # ------------------------------------------------------------------
+
+    def decode(self, count: int, final: bool = True) -> bytearray:
+        """
+        decode up to count bytes, or a few more if the last symbol decoded stands for several bytes
+        :param count: number of bytes to decode
+        :param final: whether all of the input has been fed; if not, decoding stops when the fed bits
+                      might not hold a complete code and the rest is decoded after the next feed
+        :return: the decoded bytes
+        """
+        table = self.table
+        out = self._allocate(count, final, table.maxExpansion)
+
+        # multi-symbol entries are used while a whole entry fits in the output,
+        # then the last few bytes are decoded one symbol at a time
+        o = self._decodeInto(out, 0, len(out) - table.maxDecoded + 1, table.lengths, table.symbols, final)
+        o = self._decodeInto(out, o, len(out), table.singleLengths, table.singleSymbols, final)
+
+        del out[o:]
+        return out
+
+    # ------------------------------------------------------------------
+
+    def _allocate(self, count: int, final: bool, expansion: int = 1) -> bytearray:
+        """
+        allocate the output of decode, checking count against the input first: every code takes at least a bit
+        :param count: number of bytes to decode
+        :param final: whether all of the input has been fed
+        :param expansion: most bytes a single symbol stands for
+        :return: buffer of count bytes, or of as many as the fed input can hold if that is fewer and not final
+        """
+        most = (self.bitCount + 8 * (len(self.data) - self.pos)) * expansion
+        if count > most:
+            if final:
+                raise ValueError("HuffmanDecoder error: compressed data is truncated")
+            count = most
+        return bytearray(count)
+
+    # ------------------------------------------------------------------
+
+    def _decodeInto(self, out: bytearray, o: int, limit: int, lengths: List[int], symbols: List,
+                    final: bool) -> int:
+        """
+        decode entries into out until position limit is reached or the input runs out
+        :param out: preallocated output buffer
+        :param o: position in out to write the next bytes to
+        :param limit: position in out to stop at
+        :param lengths: primary table bit lengths to use
+        :param symbols: primary table entries to use
+        :param final: whether zero bits may be peeked past the end of the input
+        :return: position in out after the last decoded byte
+        """
+        table = self.table
+        primaryBits = table.primaryBits
+        mask = (1 << primaryBits) - 1
+        need = table.maxLength
+
+        acc = self.bitBuffer
+        bitCount = self.bitCount
+        data = self.data
+        pos = self.pos
+        end = len(data)
+        padding = 0
+        unpackWord = WORD.unpack_from
+
+        while o < limit:
+            if bitCount < need:
+                # dropping consumed bits and refilling the bit buffer
+                acc &= (1 << bitCount) - 1
+                while bitCount < need and pos < end:
+                    if pos + 8 <= end:
+                        acc = (acc << 64) | unpackWord(data, pos)[0]
+                        bitCount += 64
+                        pos += 8
+                    else:
+                        chunk = data[pos:end]
+                        acc = (acc << (8 * len(chunk))) | int.from_bytes(chunk, "big")
+                        bitCount += 8 * len(chunk)
+                        pos = end
+                if bitCount < need:
+                    if not final:
+                        break
+                    # past the end of the input, zero bits are peeked so the last codes can be looked up;
+                    # once more of them are peeked than the longest code, the codes have run past the input
+                    acc <<= need - bitCount
+                    padding += need - bitCount
+                    bitCount = need
+                    if padding > need:
+                        raise ValueError("HuffmanDecoder error: compressed data is truncated")
+
+            index = (acc >> (bitCount - primaryBits)) & mask
+            n = lengths[index]
+            if n:
+                decoded = symbols[index]
+                k = len(decoded)
+                out[o:o + k] = decoded
+                o += k
+                bitCount -= n
+            else:
+                # following the chain of secondary tables until an entry resolves a code
+                secondary = symbols[index]
+                while True:
+                    if secondary is None:
+                        raise ValueError("HuffmanDecoder error: invalid code in compressed data")
+                    skip, subBits, subLengths, subSymbols = secondary
+                    index = (acc >> (bitCount - skip - subBits)) & ((1 << subBits) - 1)
+                    n = subLengths[index]
+                    if n:
+                        break
+                    secondary = subSymbols[index]
+                decoded = subSymbols[index]
+                if decoded.__class__ is int:
+                    out[o] = decoded
+                    o += 1
+                else:
+                    k = len(decoded)
+                    out[o:o + k] = decoded
+                    o += k
+                bitCount -= n
+
+        if bitCount < padding:
+            raise ValueError("HuffmanDecoder error: compressed data is truncated")
+
+        # keeping only the unread bits that came from the input
+        self.bitCount = bitCount - padding
+        self.bitBuffer = (acc >> padding) & ((1 << self.bitCount) - 1)
+        self.pos = pos
+        return o
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
+
+class ContextDecoder(HuffmanDecoder):
+    """
+    Decodes a bitstream of order-1 codes, where the DecodeTable for each byte is chosen by the byte before it.
+    Since the table changes with every byte, bytes are decoded one symbol at a time.
+    """
+
+    def __init__(self, tables: List[DecodeTable], bitBuffer: int = 0, bitCount: int = 0, previous: int = 0):
+        """
+        :param tables: lookup tables for each previous byte value; contexts sharing a code share the same table
+        :param bitBuffer: bits already read from the stream that have not been decoded
+        :param bitCount: number of bits in bitBuffer
+        :param previous: byte value before the first byte to decode
+        """
+        super().__init__(tables[previous], bitBuffer, bitCount)
+        self.previous = previous
+        self.need = max(table.maxLength for table in tables)
+
+        # (primary bits, mask, bit lengths, byte values or secondary tables) for each previous byte value
+        entries = {}
+        self.contexts = []
+        for table in tables:
+            if id(table) not in entries:
+                values = [symbol[0] if isinstance(symbol, bytes) else symbol for symbol in table.singleSymbols]
+                entries[id(table)] = (table.primaryBits, (1 << table.primaryBits) - 1, table.singleLengths, values)
+            self.contexts.append(entries[id(table)])
+
+    # ------------------------------------------------------------------
+
+    def decode(self, count: int, final: bool = True) -> bytearray:
+        """
+        decode up to count bytes
+        :param count: number of bytes to decode
+        :param final: whether all of the input has been fed; if not, decoding stops when the fed bits
+                      might not hold a complete code and the rest is decoded after the next feed
+        :return: the decoded bytes
+        """
+        out = self._allocate(count, final)
+        count = len(out)
+        o = 0
+        contexts = self.contexts
+        need = self.need
+        previous = self.previous
+
+        acc = self.bitBuffer
+        bitCount = self.bitCount
+        data = self.data
+        pos = self.pos
+        end = len(data)
+        padding = 0
+        unpackWord = WORD.unpack_from
+
+        while o < count:
+            if bitCount < need:
+                # dropping consumed bits and refilling the bit buffer
+                acc &= (1 << bitCount) - 1
+                while bitCount < need and pos < end:
+                    if pos + 8 <= end:
+                        acc = (acc << 64) | unpackWord(data, pos)[0]
+                        bitCount += 64
+                        pos += 8
+                    else:
+                        chunk = data[pos:end]
+                        acc = (acc << (8 * len(chunk))) | int.from_bytes(chunk, "big")
+                        bitCount += 8 * len(chunk)
+                        pos = end
+                if bitCount < need:
+                    if not final:
+                        break
+                    # past the end of the input, zero bits are peeked so the last codes can be looked up;
+                    # once more of them are peeked than the longest code, the codes have run past the input
+                    acc <<= need - bitCount
+                    padding += need - bitCount
+                    bitCount = need
+                    if padding > need:
+                        raise ValueError("HuffmanDecoder error: compressed data is truncated")
+
+            primaryBits, mask, lengths, values = contexts[previous]
+            index = (acc >> (bitCount - primaryBits)) & mask
+            n = lengths[index]
+            if n:
+                previous = values[index]
+            else:
+                secondary = values[index]
+                while True:
+                    if secondary is None:
+                        raise ValueError("HuffmanDecoder error: invalid code in compressed data")
+                    skip, subBits, subLengths, subSymbols = secondary
+                    index = (acc >> (bitCount - skip - subBits)) & ((1 << subBits) - 1)
+                    n = subLengths[index]
+                    if n:
+                        break
+                    secondary = subSymbols[index]
+                previous = subSymbols[index]
+            out[o] = previous
+            o += 1
+            bitCount -= n
+
+        if bitCount < padding:
+            raise ValueError("HuffmanDecoder error: compressed data is truncated")
+
+        # keeping only the unread bits that came from the input, and the context of the next byte
+        self.bitCount = bitCount - padding
+        self.bitBuffer = (acc >> padding) & ((1 << self.bitCount) - 1)
+        self.pos = pos
+        self.previous = previous
+
+        del out[o:]
+        return out
+
+    # ------------------------------------------------------------------
 
 # ----------------------------------------------------------------------
 
-def _readKey(binaryReader: BinaryFileReader, amntUniqueChar: int) -> Dict[str, str]:
+class HuffmanReader:
+    """
+    Random access reads from a block container .hc file. The block index at the end of the file locates
+    the block holding a range, and the checkpoints of a file compressed with --seekable locate the bit to
+    start decoding at inside that block, so only the compressed bits covering the range are read.
+    Blocks split into interleaved streams have no checkpoints and are decoded whole.
+    The file is memory mapped and those bits are decoded in place.
+    """
+
+    def __init__(self, filename):
+        """
+        open a block container file for reading
+        :param filename: path to a file compressed with --jobs or --seekable
+        """
+        self.reader = MappedFileReader(filename)
+        try:
+            version, _ = _readVersion(self.reader)
+        except ValueError:
+            version = None
+        if version != VERSION_BLOCKS:
+            self.reader.close()
+            raise ValueError("HuffmanReader error: file is not a block container")
+
+        self.flags, self.size, self.index = _readBlockIndex(self.reader)
+        self.blockStarts = [blockStart for blockStart, _, _ in self.index]
+        self.checkpointStarts = [[checkpoint for checkpoint, _ in checkpoints] for _, _, checkpoints in self.index]
+        # (amount of bytes, decoding tables, payload start bit, payload end bit) of recently used blocks
+        self.blockTables = OrderedDict()
+
+    # ------------------------------------------------------------------
+
+    def read(self, offset: int, length: int) -> bytes:
+        """
+        read bytes from the uncompressed data
+        :param offset: position of the first byte to read
+        :param length: number of bytes to read
+        :return: the bytes, fewer than length if the data ends first
+        """
+        end = min(offset + length, self.size)
+        pieces = []
+
+        while offset < end:
+            # Finding the block holding offset and the last checkpoint at or before offset
+            block = bisect_right(self.blockStarts, offset) - 1
+            blockStart, _, checkpoints = self.index[block]
+            rawLength, table, payloadStart, payloadEnd = self._blockTable(block)
+            checkpointStarts = self.checkpointStarts[block]
+
+            # Interleaved streams have no checkpoints, so the whole block is decoded
+            if self.flags & FLAG_STREAMS:
+                stop = min(end, blockStart + rawLength)
+                data = _decodeInterleaved(table, rawLength, _readPayload(self.reader, payloadStart, payloadEnd))
+                pieces.append(data[offset - blockStart:stop - blockStart])
+                offset = stop
+                continue
+
+            start, startBit = blockStart, payloadStart
+            i = bisect_right(checkpointStarts, offset) - 1
+            if i >= 0:
+                start, startBit = checkpoints[i]
+
+            # The first checkpoint at or after the last byte wanted from this block bounds the bits to read
+            stop = min(end, blockStart + rawLength)
+            j = bisect_left(checkpointStarts, stop)
+            endBit = checkpoints[j][1] if j < len(checkpoints) else payloadEnd
+
+            data = _decodeBits(self.reader, table, startBit, endBit, stop - start)
+            pieces.append(data[offset - start:])
+            offset = stop
+
+        return b"".join(pieces)
+
+    # ------------------------------------------------------------------
+
+    def _blockTable(self, block: int) -> Tuple[int, DecodeTable, int, int]:
+        """
+        get a block's decoding tables, reading them from the file if they are not cached
+        :param block: number of the block
+        :return: (amount of bytes, decoding tables, payload start bit, payload end bit)
+        """
+        if block in self.blockTables:
+            self.blockTables.move_to_end(block)
+        else:
+            self.blockTables[block] = _readBlockTable(self.reader, self.index[block][1])
+            if len(self.blockTables) > BLOCK_CACHE_SIZE:
+                self.blockTables.popitem(last=False)
+
+        return self.blockTables[block]
+
+    # ------------------------------------------------------------------
+
+    def close(self):
+        """
+        close the file
+        :return: None
+        """
+        self.reader.close()
+
+    # ------------------------------------------------------------------
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
+
+def _readKey(binaryReader: BinaryFileReader, amntUniqueChar: int) -> Dict[str, int]:
 
     keyDict = {}
 
     # While dictionary has less keys than amount of unique characters...
     while (len(keyDict) < amntUniqueChar):
 
-        # Getting the character and amount of bits in its code
-        char = chr(binaryReader.readUByte())
+        # Getting the byte value and amount of bits in its code
+        byte = binaryReader.readUByte()
         amntBits = binaryReader.readUShort()
 
         bitCode = ""
@@ -35,80 +621,1029 @@ def _readKey(binaryReader: BinaryFileReader, amntUniqueChar: int) -> Dict[str, s
         for i in range(amntBits):
             bitCode += str(binaryReader.readBit())
 
-        # Creating entry from that bitCode to the respective character
-        keyDict[bitCode] = char
+        # Creating entry from that bitCode to the respective byte value
+        keyDict[bitCode] = byte
 
     return keyDict
 
-def _readData(binaryReader: BinaryFileReader, keyDict: Dict[str, str], totalBytes: int) -> str:
+def _readVersion(binaryReader: BinaryFileReader) -> Tuple[int, int]:
+
+    # Files in the original format start with the total amount of bytes,
+    # newer files start with a format marker followed by a version byte
+    firstUInt = binaryReader.readUInt()
+    if firstUInt == FORMAT_MARKER:
+        return binaryReader.readUByte(), firstUInt
+
+    return VERSION_LEGACY, firstUInt
+
+def _readHeader(binaryReader: BinaryFileReader, version: int,
+                firstUInt: int) -> Tuple[int, int, List[Tuple[int, int, int]]]:
+
+    if version == VERSION_LEGACY:
+        # Reading key data and converting it to (byte value, code length, code) entries
+        flags = 0
+        totalBytes = firstUInt
+        amntUniqueChar = binaryReader.readUShort()
+        keyDict = _readKey(binaryReader, amntUniqueChar)
+        codes = [(byte, len(bitCode), int(bitCode, 2)) for bitCode, byte in keyDict.items()]
+
+    elif version == VERSION_CANONICAL:
+        # Flags, then the total amount of bytes and the code length of each byte value
+        flags = binaryReader.readUByte()
+        totalBytes = binaryReader.readUInt() if flags & FLAG_SHORT_TOTAL else binaryReader.readULong()
+        codes = canonicalCodes(readLengths(binaryReader))
+
+    else:
+        raise ValueError("Unsupported .hc format version %d" % version)
+
+    return flags, totalBytes, codes
+
+# decoding tables of recently used pretrained code tables, by table ID
+_tableCache = OrderedDict()
+
+def _loadTable(identifier: int, tablePaths: List[str]) -> DecodeTable:
+
+    # Files compressed with the same table share its decoding tables, so only the first one reads the table
+    if identifier in _tableCache:
+        _tableCache.move_to_end(identifier)
+        return _tableCache[identifier]
+
+    tableFile = findTables(tablePaths).get(identifier)
+    if tableFile is None:
+        raise ValueError("Code table %08x not found" % identifier)
+    _, lengths = readTable(tableFile)
+
+    _tableCache[identifier] = DecodeTable(canonicalCodes(lengths))
+    if len(_tableCache) > TABLE_CACHE_SIZE:
+        _tableCache.popitem(last=False)
+
+    return _tableCache[identifier]
+
+def _readDictionaryHeader(binaryReader: BinaryFileReader, tablePaths: List[str]) -> Tuple[int, int, DecodeTable]:
+
+    # Flags, then the ID of the table the file was compressed with and the total amount of bytes
+    flags = binaryReader.readUByte()
+    identifier = binaryReader.readUInt()
+    totalBytes = binaryReader.readULong()
+
+    return flags, totalBytes, _loadTable(identifier, tablePaths)
+
+def _contextTable(lengths: Dict[int, int]) -> DecodeTable:
+
+    # Context codes are decoded one symbol at a time
+    return DecodeTable(canonicalCodes(lengths), multiSymbol=False)
+
+def _readContextHeader(binaryReader: BinaryFileReader) -> Tuple[int, int, List[DecodeTable]]:
+
+    # Flags, then the total amount of bytes and a bit for each context with a code of its own
+    flags = binaryReader.readUByte()
+    totalBytes = binaryReader.readULong()
+    bitmap = bytes(binaryReader.readBytes(ALPHABET_SIZE // 8))
+    if len(bitmap) != ALPHABET_SIZE // 8:
+        raise ValueError("Compressed file is truncated")
+
+    # The shared code lengths come first, then those of every context with its own code in order
+    shared = _contextTable(readLengths(binaryReader))
+    tables = []
+    for context in range(ALPHABET_SIZE):
+        if bitmap[context >> 3] & (0x80 >> (context & 7)):
+            tables.append(_contextTable(readLengths(binaryReader)))
+        else:
+            tables.append(shared)
+
+    return flags, totalBytes, tables
+
+def _readTokenHeader(binaryReader: BinaryFileReader) -> Tuple[int, int, DecodeTable]:
+
+    # Flags, then the total amount of bytes, the tokens and the code lengths of the byte values and tokens
+    flags = binaryReader.readUByte()
+    totalBytes = binaryReader.readULong()
+    tokens = readTokens(binaryReader)
+    lengths = readLengths(binaryReader, ALPHABET_SIZE + len(tokens))
+
+    # Symbols from 256 up decode to the bytes of their tokens
+    expansions = [bytes((byte,)) for byte in range(ALPHABET_SIZE)] + tokens
+    return flags, totalBytes, DecodeTable(canonicalCodes(lengths), expansions=expansions, count=totalBytes)
+
+def _readData(binaryReader: BinaryFileReader, table: DecodeTable, totalBytes: int) -> bytearray:
+
+    # Handing the unread bits of the current byte and the rest of the file to the decoder
+    bitBuffer, bitCount, remaining = binaryReader.readRemaining()
+    decoder = HuffmanDecoder(table, bitBuffer, bitCount)
+    decoder.feed(remaining)
+
+    return decoder.decode(totalBytes)
+
+def _readDecoder(binaryReader, version: int, firstUInt: int,
+                 tablePaths: List[str]) -> Tuple[int, int, HuffmanDecoder]:
+
+    with stats.stage("header"):
+        # Reading the rest of the header: flags, total amount of bytes and the code of each byte value,
+        # or the table to take the codes from
+        if version == VERSION_DICTIONARY:
+            flags, totalBytes, table = _readDictionaryHeader(binaryReader, tablePaths)
+        elif version == VERSION_CONTEXT:
+            # A table for every context, with the contexts that share a code sharing one table
+            flags, totalBytes, tables = _readContextHeader(binaryReader)
+            return flags, totalBytes, ContextDecoder(tables, *binaryReader.takeBits())
+        elif version == VERSION_TOKENS:
+            # Symbols of the extended alphabet decode to one or more bytes each
+            flags, totalBytes, table = _readTokenHeader(binaryReader)
+        else:
+            flags, totalBytes, codes = _readHeader(binaryReader, version, firstUInt)
+            # Building the decoding tables once from the codes
+            table = DecodeTable(codes, count=totalBytes)
+
+        # The decoder continues from the unread bits of the current byte
+        return flags, totalBytes, HuffmanDecoder(table, *binaryReader.takeBits())
+
+def _decodePieces(binaryReader, decoder: HuffmanDecoder, totalBytes: int, end: Optional[int] = None,
+                  flags: int = 0) -> Iterator[bytearray]:
+
+    remaining = totalBytes
+    final = False
+    checksum = 0
+
+    # Decoding at most DECODE_BLOCK_SIZE bytes at a time,
+    # feeding the decoder another chunk of the file, up to end if given, whenever it runs out of input
+    while remaining > 0:
+        count = min(remaining, DECODE_BLOCK_SIZE)
+        with stats.stage("decode") as record:
+            block = decoder.decode(count, final)
+            record.bytesOut = len(block)
+        if block:
+            if flags & (FLAG_CHECKSUMS | FLAG_DATA_CHECKSUM):
+                checksum = zlib.crc32(block, checksum)
+            yield block
+        remaining -= len(block)
+
+        if len(block) < count:
+            with stats.stage("read") as record:
+                chunk = binaryReader.readBytes(CHUNK_SIZE if end is None
+                                               else min(CHUNK_SIZE, end - binaryReader.tell()))
+                record.bytesOut = len(chunk)
+            final = len(chunk) == 0
+            decoder.feed(chunk)
+
+    # The checksum of the data follows the byte holding the last code
+    if flags & (FLAG_CHECKSUMS | FLAG_DATA_CHECKSUM):
+        stored = decoder.unreadBytes()[:4]
+        if len(stored) < 4:
+            stored += bytes(binaryReader.readBytes(4 - len(stored)))
+        if len(stored) < 4:
+            raise ValueError("Compressed file is truncated")
+        if UINT.unpack(stored)[0] != checksum:
+            raise ValueError("Checksum mismatch: decompressed data is corrupt")
+
+def _decodeToFile(binaryReader: MappedFileReader, decoder: HuffmanDecoder, totalBytes: int, destinationFile,
+                  end: Optional[int] = None, flags: int = 0) -> None:
+
+    # Writing the decoded data to the output file a block at a time
+    _writePieces(_decodePieces(binaryReader, decoder, totalBytes, end, flags), destinationFile)
+
+def _openOutput(destinationFile):
+
+    # The output file, or standard output if it is -
+    return sys.stdout.buffer if destinationFile == "-" else open(destinationFile, "wb")
 
-    data = ""
+def _closeOutput(outfile) -> None:
 
-    # Only reading data while they are more characters
-    while len(data) < totalBytes:
+    # Standard output is flushed and left open for the rest of the program
+    if outfile is sys.stdout.buffer:
+        outfile.flush()
+    else:
+        outfile.close()
 
-        currentBitCode = ""
+def _write(outfile, data) -> None:
 
-        # Checking if binary code matches character in dictionary
-        while currentBitCode not in keyDict:
-            # If not, adding another bit to the code
-            currentBitCode += str(binaryReader.readBit())
+    # Writing decoded data, measured as the write stage
+    with stats.stage("write", len(data)) as record:
+        outfile.write(data)
+        record.bytesOut = len(data)
 
-        # If so, accumulating to data string
-        data += keyDict[currentBitCode]
+def _streamRanges(payload) -> List[Tuple[int, int]]:
+
+    # Stream count and the jump table of the length of every stream but the last, which takes the rest
+    if len(payload) < 1:
+        raise ValueError("Compressed file is truncated")
+    count = payload[0]
+    if count == 0:
+        raise ValueError("Invalid stream count in compressed data")
+    if len(payload) < 1 + 4 * (count - 1):
+        raise ValueError("Compressed file is truncated")
+    lengths = struct.unpack_from("<%dI" % (count - 1), payload, 1)
+
+    # (start, end) of every stream in the payload
+    ranges = []
+    start = 1 + 4 * (count - 1)
+    for length in lengths:
+        ranges.append((start, start + length))
+        start += length
+    if start > len(payload):
+        raise ValueError("Compressed file is truncated")
+    ranges.append((start, len(payload)))
+
+    return ranges
+
+def _decodeInterleaved(table: DecodeTable, rawLength: int, payload) -> bytearray:
+
+    # Decoding every stream on its own, then dealing its bytes back to every count-th position from its own
+    ranges = _streamRanges(payload)
+    count = len(ranges)
+    data = bytearray(rawLength)
+    for stream, (start, end) in enumerate(ranges):
+        decoder = HuffmanDecoder(table)
+        decoder.feed(payload[start:end])
+        data[stream::count] = decoder.decode(len(range(stream, rawLength, count)))
 
     return data
 
-def _writeData(data: str, destinationFile) -> None:
+def checkBlockLength(rawLength: int, payloadLength: int, blockSize: int) -> None:
+
+    # A block holds no more than the block size, and every byte's code takes at least a bit of the payload,
+    # so a corrupt amount of bytes is caught before anything is decoded
+    if rawLength > blockSize:
+        raise ValueError("Block of %d bytes is larger than the block size of %d" % (rawLength, blockSize))
+    if payloadLength * 8 < rawLength:
+        raise ValueError("Block of %d bytes cannot fit in a payload of %d bytes" % (rawLength, payloadLength))
+
+def decompressBlock(rawLength: int, lengths: Dict[int, int], payload: bytes,
+                    checksum: Optional[int] = None, streams: bool = False) -> bytearray:
+
+    with stats.stage("decode", len(payload)) as record:
+        # Rebuilding this block's codes from its code lengths and decoding the whole block,
+        # one stream after another if it is split into interleaved streams
+        table = DecodeTable(canonicalCodes(lengths), count=rawLength)
+        if streams:
+            data = _decodeInterleaved(table, rawLength, payload)
+        else:
+            decoder = HuffmanDecoder(table)
+            decoder.feed(payload)
+            data = decoder.decode(rawLength)
+        record.bytesOut = len(data)
+
+    # Checking the decoded block against the checksum stored with it, if any
+    if checksum is not None and zlib.crc32(data) != checksum:
+        raise ValueError("Checksum mismatch: decompressed block is corrupt")
+    return data
+
+def _readBlocks(binaryReader: BinaryFileReader, flags: int,
+                blockSize: int) -> Iterator[Tuple[int, Dict[int, int], bytes, Optional[int]]]:
+
+    # Reading blocks in order until the block of 0 bytes that ends them,
+    # with the checksum of each block's data when the file has checksums
+    number = 0
+    rawLength = binaryReader.readUInt()
+    while rawLength != 0:
+        try:
+            lengths = readLengths(binaryReader)
+            payloadLength = binaryReader.readUInt()
+            checkBlockLength(rawLength, payloadLength, blockSize)
+            payload = binaryReader.readBytes(payloadLength)
+            if len(payload) != payloadLength:
+                raise ValueError("Compressed file is truncated")
+        except ValueError as error:
+            raise ValueError("Block %d: %s" % (number, error))
+        checksum = None
+        if flags & FLAG_CHECKSUMS:
+            # The checksum of the block's bytes is only needed to verify the file without decoding it
+            checksum = binaryReader.readUInt()
+            binaryReader.readUInt()
+
+        yield rawLength, lengths, payload, checksum
+        number += 1
+        rawLength = binaryReader.readUInt()
+
+def _decodeBlocks(binaryReader: BinaryFileReader) -> Iterator[bytearray]:
+
+    # Flags, then the block size that no block is larger than
+    flags = binaryReader.readUByte()
+    blockSize = binaryReader.readUInt()
+
+    # Decoding blocks in order; the block index at the end of the file is not needed to read every block
+    for number, (rawLength, lengths, payload, checksum) in enumerate(_readBlocks(binaryReader, flags, blockSize)):
+        try:
+            yield decompressBlock(rawLength, lengths, payload, checksum, bool(flags & FLAG_STREAMS))
+        except ValueError as error:
+            raise ValueError("Block %d: %s" % (number, error))
 
-    outfile = open(destinationFile, "w")
-    outfile.write(data)
-    outfile.close()
+def _decompressBlocks(binaryReader: BinaryFileReader, destinationFile) -> None:
 
-def decompress(sourceFile, destinationFile) -> str:
+    _writePieces(_decodeBlocks(binaryReader), destinationFile)
 
-    # Initializing binary reader
-    binaryReader = BinaryFileReader(sourceFile)
+def _sampledTable(lengths: Dict[int, int]) -> DecodeTable:
 
-    # Getting header info from file: total amount of characters and amount of unique characters
+    # The escape code is split into a code for every byte value without a code of its own, so escaped
+    # bytes are decoded by the same lookups as the others
+    codes = EncodeTable(lengths, ALPHABET_SIZE + 1, ESCAPE).entries()
+    return DecodeTable([(symbol, length, code) for symbol, length, code in codes if symbol != ESCAPE])
+
+def _decodeSampled(binaryReader: BinaryFileReader) -> Iterator[bytearray]:
+
+    flags = binaryReader.readUByte()
+    table = None
+    checksum = 0
+
+    # Decoding blocks in order until the block of 0 bytes that ends them; a block without a table of its own
+    # is coded with the table of the block before it
+    number = 0
+    rawLength = binaryReader.readUInt()
+    while rawLength != 0:
+        try:
+            if binaryReader.readUByte():
+                with stats.stage("header"):
+                    table = _sampledTable(readLengths(binaryReader, ALPHABET_SIZE + 1))
+            elif table is None:
+                raise ValueError("No code table before the block")
+            payloadLength = binaryReader.readUInt()
+            checkBlockLength(rawLength, payloadLength, MAX_SAMPLED_BLOCK_SIZE)
+            payload = binaryReader.readBytes(payloadLength)
+            if len(payload) != payloadLength:
+                raise ValueError("Compressed file is truncated")
+
+            with stats.stage("decode", payloadLength) as record:
+                decoder = HuffmanDecoder(table)
+                decoder.feed(payload)
+                data = decoder.decode(rawLength)
+                record.bytesOut = len(data)
+        except ValueError as error:
+            raise ValueError("Block %d: %s" % (number, error))
+
+        checksum = zlib.crc32(data, checksum)
+        yield data
+        number += 1
+        rawLength = binaryReader.readUInt()
+
+    # The checksum of all of the data follows the blocks
+    if flags & FLAG_CHECKSUMS and binaryReader.readUInt() != checksum:
+        raise ValueError("Checksum mismatch: decompressed data is corrupt")
+
+def _writePieces(pieces: Iterator[bytearray], destinationFile) -> None:
+
+    # Writing decoded data to the output file, or to standard output if it is -
+    outfile = _openOutput(destinationFile)
     try:
-        totalBytes = binaryReader.readUInt()
-        amntUniqueChar = binaryReader.readUShort()
+        for data in pieces:
+            _write(outfile, data)
+    finally:
+        _closeOutput(outfile)
+
+def _readBlockIndex(binaryReader: MappedFileReader) -> Tuple[int, int, List[Tuple[int, int, List[Tuple[int, int]]]]]:
+
+    # Flags and the block size follow the format marker and version at the start of the file
+    if binaryReader.size < HEADER_SIZE + TRAILER_SIZE:
+        raise ValueError("Compressed file is truncated")
+    binaryReader.seek(5)
+    flags = binaryReader.readUByte()
+    blockSize = binaryReader.readUInt()
+
+    # The trailer at the end of the file holds the amount of blocks, total amount of bytes and index offset;
+    # with checksums, the index ends with the checksum of the data and is followed by its own checksum
+    binaryReader.seek(binaryReader.size - TRAILER_SIZE)
+    blockCount = binaryReader.readUInt()
+    totalBytes = binaryReader.readULong()
+    indexOffset = binaryReader.readULong()
+    indexEnd = binaryReader.size - TRAILER_SIZE - (CHECKSUMS_SIZE if flags & FLAG_CHECKSUMS else 0)
+    if not HEADER_SIZE + 4 <= indexOffset <= indexEnd:
+        raise ValueError("Compressed file is truncated")
+    if flags & FLAG_CHECKSUMS and not _checksumMatches(binaryReader, indexOffset, indexEnd + 4):
+        raise ValueError("Checksum mismatch: block index is corrupt")
+
+    # Every block takes at least 16 bytes of the index, and every checkpoint another 16
+    if blockCount * 16 > indexEnd - indexOffset:
+        raise ValueError("Block index is corrupt: it cannot hold %d blocks" % blockCount)
+
+    # Reading (uncompressed offset, file offset, checkpoints) for every block,
+    # where each checkpoint is an (uncompressed offset, bit offset in the file) pair
+    binaryReader.seek(indexOffset)
+    index = []
+    for number in range(blockCount):
+        uncompressedOffset = binaryReader.readULong()
+        compressedOffset = binaryReader.readULong()
+        checkpoints = []
+        if flags & FLAG_CHECKPOINTS:
+            count = binaryReader.readUInt()
+            if binaryReader.tell() + 16 * count > indexEnd:
+                raise ValueError("Block index is corrupt: block %d cannot have %d checkpoints" % (number, count))
+            for _ in range(count):
+                checkpoints.append((binaryReader.readULong(), binaryReader.readULong()))
+        index.append((uncompressedOffset, compressedOffset, checkpoints))
+    if binaryReader.tell() != indexEnd:
+        raise ValueError("Block index is corrupt: its size does not match its blocks")
+
+    # Blocks follow the header in order, each holding 1 byte up to the block size and ending where the next
+    # one starts, the last one at the total amount of bytes and the block of 0 bytes; checkpoints lie in order
+    # inside their block
+    bounds = [(start, offset) for start, offset, _ in index] + [(totalBytes, indexOffset - 4)]
+    if bounds[0] != (0, HEADER_SIZE if index else indexOffset - 4):
+        raise ValueError("Block index is corrupt: the first block does not start the data")
+    for number, ((start, offset, checkpoints), (end, endOffset)) in enumerate(zip(index, bounds[1:])):
+        if not 0 < end - start <= blockSize or offset >= endOffset:
+            raise ValueError("Block index is corrupt: block %d is out of order or larger than the block size" % number)
+        bit = offset * 8
+        for checkpoint, checkpointBit in checkpoints:
+            if not start <= checkpoint < end or not bit <= checkpointBit <= endOffset * 8:
+                raise ValueError("Block index is corrupt: a checkpoint of block %d is outside it" % number)
+            start, bit = checkpoint + 1, checkpointBit
+
+    return flags, totalBytes, index
+
+def _readDataChecksum(binaryReader: MappedFileReader) -> int:
+
+    # With FLAG_CHECKSUMS, the checksum of the data and the checksum of the index come just before the trailer
+    binaryReader.seek(binaryReader.size - TRAILER_SIZE - 8)
+    return binaryReader.readUInt()
+
+def _readBlockTable(binaryReader: MappedFileReader, compressedOffset: int) -> Tuple[int, DecodeTable, int, int]:
+
+    # Block: amount of bytes, key data, payload length and payload, which must fit the block size in the header
+    binaryReader.seek(6)
+    blockSize = binaryReader.readUInt()
+    binaryReader.seek(compressedOffset)
+    rawLength = binaryReader.readUInt()
+    lengths = readLengths(binaryReader)
+    payloadLength = binaryReader.readUInt()
+    checkBlockLength(rawLength, payloadLength, blockSize)
+    payloadStart = binaryReader.tell()
+
+    # Amount of bytes, decoding tables, and the first and last bit of the payload in the file
+    return rawLength, DecodeTable(canonicalCodes(lengths), count=rawLength), payloadStart * 8, (payloadStart + payloadLength) * 8
+
+def _decodeBits(binaryReader: MappedFileReader, table: DecodeTable, startBit: int, endBit: int,
+                count: int) -> bytearray:
+
+    # Viewing only the bytes holding bits startBit to endBit of the file
+    binaryReader.seek(startBit // 8)
+    data = binaryReader.readBytes((endBit + 7) // 8 - startBit // 8)
+    if len(data) == 0:
+        return bytearray()
+
+    # Dropping the bits of the first byte that come before startBit
+    skip = startBit % 8
+    decoder = HuffmanDecoder(table, data[0] & (0xFF >> skip), 8 - skip)
+    decoder.feed(data[1:])
+
+    return decoder.decode(count)
+
+def decodeRange(sourceFile, compressedOffset: int, count: int, startBit: Optional[int],
+                endBit: Optional[int]) -> bytearray:
+
+    # Decoding count bytes of the block at compressedOffset, starting at a checkpoint's bit
+    # and reading no further than the next checkpoint's bit; None stands for the payload's start or end
+    binaryReader = MappedFileReader(sourceFile)
+    _, table, payloadStart, payloadEnd = _readBlockTable(binaryReader, compressedOffset)
+    data = _decodeBits(binaryReader, table, payloadStart if startBit is None else startBit,
+                       payloadEnd if endBit is None else endBit, count)
+    binaryReader.close()
+
+    return data
+
+def _readPayload(binaryReader: MappedFileReader, payloadStart: int, payloadEnd: int):
+
+    # Viewing the payload between two bit positions on byte boundaries
+    binaryReader.seek(payloadStart // 8)
+    return binaryReader.readBytes((payloadEnd - payloadStart) // 8)
+
+def decodeInterleavedStream(sourceFile, compressedOffset: int, stream: int) -> bytearray:
+
+    # Decoding one of the interleaved streams of the block at compressedOffset, which holds every
+    # count-th byte of the block starting from byte stream
+    binaryReader = MappedFileReader(sourceFile)
+    rawLength, table, payloadStart, payloadEnd = _readBlockTable(binaryReader, compressedOffset)
+    payload = _readPayload(binaryReader, payloadStart, payloadEnd)
+    ranges = _streamRanges(payload)
+    start, end = ranges[stream]
+
+    decoder = HuffmanDecoder(table)
+    decoder.feed(payload[start:end])
+    data = decoder.decode(len(range(stream, rawLength, len(ranges))))
+    binaryReader.close()
+
+    return data
+
+def _decompressStreams(sourceFile, outfile, index: List[Tuple[int, int, List[Tuple[int, int]]]], totalBytes: int,
+                       jobs: Optional[int]) -> int:
+
+    # Amount of bytes and number of streams of every block, from the start of each block's payload,
+    # which must agree with the block index
+    binaryReader = MappedFileReader(sourceFile)
+    blocks = []
+    ends = [start for start, _, _ in index[1:]] + [totalBytes]
+    try:
+        for number, ((start, compressedOffset, _), end) in enumerate(zip(index, ends)):
+            binaryReader.seek(compressedOffset)
+            rawLength = binaryReader.readUInt()
+            readLengths(binaryReader)
+            binaryReader.readUInt()
+            count = binaryReader.readUByte()
+            if rawLength != end - start:
+                raise ValueError("Block %d: holds %d bytes, the block index says %d" % (number, rawLength, end - start))
+            if count == 0:
+                raise ValueError("Block %d: Invalid stream count in compressed data" % number)
+            blocks.append((rawLength, count))
+    finally:
+        binaryReader.close()
+
+    # Every stream of every block is decoded by a worker; the streams of each block are dealt back together
+    # in order, and the data of each block is written once all of its streams are in
+    items = [(sourceFile, compressedOffset, stream)
+             for (_, compressedOffset, _), (_, count) in zip(index, blocks) for stream in range(count)]
+    streams = orderedMap(decodeInterleavedStream, items, jobs)
+    checksum = 0
+    for rawLength, count in blocks:
+        data = bytearray(rawLength)
+        for stream in range(count):
+            data[stream::count] = next(streams)
+        checksum = zlib.crc32(data, checksum)
+        _write(outfile, data)
+
+    return checksum
+
+def _decompressIndexed(sourceFile, destinationFile, jobs: Optional[int]) -> None:
+
+    binaryReader = MappedFileReader(sourceFile)
+    flags, totalBytes, index = _readBlockIndex(binaryReader)
+    expected = _readDataChecksum(binaryReader) if flags & FLAG_CHECKSUMS else None
+    binaryReader.close()
+
+    # Blocks split into interleaved streams are decoded a stream on each worker
+    if flags & FLAG_STREAMS:
+        outfile = _openOutput(destinationFile)
+        try:
+            checksum = _decompressStreams(sourceFile, outfile, index, totalBytes, jobs)
+        finally:
+            _closeOutput(outfile)
+        if expected is not None and checksum != expected:
+            raise ValueError("Checksum mismatch: decompressed data is corrupt")
+        return
+
+    # Splitting the blocks at their checkpoints into ranges of at least a quarter of each worker's share
+    workers = jobs or os.cpu_count() or 1
+    target = max(1, totalBytes // (4 * workers))
+    items = []
+    for i, (blockStart, compressedOffset, checkpoints) in enumerate(index):
+        blockEnd = index[i + 1][0] if i + 1 < len(index) else totalBytes
+        rangeStart, rangeBit = blockStart, None
+        for checkpoint, bit in checkpoints[1:]:
+            if checkpoint - rangeStart >= target:
+                items.append((sourceFile, compressedOffset, checkpoint - rangeStart, rangeBit, bit))
+                rangeStart, rangeBit = checkpoint, bit
+        items.append((sourceFile, compressedOffset, blockEnd - rangeStart, rangeBit, None))
+
+    # Each worker reads its own range of the file; results are written in order.
+    # Ranges need not cover whole blocks, so the data is checked against the checksum of all of it
+    checksum = 0
+    outfile = _openOutput(destinationFile)
+    try:
+        for data in orderedMap(decodeRange, items, jobs):
+            checksum = zlib.crc32(data, checksum)
+            outfile.write(data)
+    finally:
+        _closeOutput(outfile)
+    if expected is not None and checksum != expected:
+        raise ValueError("Checksum mismatch: decompressed data is corrupt")
+
+def _readArchiveIndex(binaryReader: MappedFileReader) -> List[Tuple[str, int, int, int]]:
+
+    # The trailer at the end of the file holds the amount of files and the offset of the file index
+    binaryReader.seek(binaryReader.size - ARCHIVE_TRAILER_SIZE)
+    fileCount = binaryReader.readUInt()
+    indexOffset = binaryReader.readULong()
+
+    # Reading (name, size, offset in the archive, compressed length) for every file
+    binaryReader.seek(indexOffset)
+    index = []
+    for _ in range(fileCount):
+        name = bytes(binaryReader.readBytes(binaryReader.readUShort())).decode("utf-8")
+        index.append((name, binaryReader.readULong(), binaryReader.readULong(), binaryReader.readULong()))
+
+    return index
+
+def _memberPath(directory, name: str) -> str:
+
+    # Names come from the archive, so they must not lead outside the directory being extracted to
+    parts = name.split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        raise ValueError("Unsafe file name %s in archive" % name)
+
+    return os.path.join(directory, *parts)
+
+def extractMember(archiveFile, memberOffset: int, memberLength: int, destinationFile) -> None:
+
+    os.makedirs(os.path.dirname(destinationFile), exist_ok=True)
+
+    # Empty files are stored without any data
+    if memberLength == 0:
+        open(destinationFile, "wb").close()
+        return
+
+    # Each file is a complete compressed file inside the archive, decoded without reading past its end
+    binaryReader = MappedFileReader(archiveFile)
+    binaryReader.seek(memberOffset)
+    try:
+        flags, totalBytes, codes = _readHeader(binaryReader, *_readVersion(binaryReader))
+        decoder = HuffmanDecoder(DecodeTable(codes, count=totalBytes), *binaryReader.takeBits())
+        _decodeToFile(binaryReader, decoder, totalBytes, destinationFile, memberOffset + memberLength, flags)
+    except ValueError as error:
+        raise ValueError("%s: %s" % (destinationFile, error))
+    finally:
+        binaryReader.close()
+
+def extractArchive(archiveFile, destinationDirectory, names: Optional[List[str]] = None,
+                   jobs: Optional[int] = 1) -> int:
+
+    binaryReader = MappedFileReader(archiveFile)
+    index = _readArchiveIndex(binaryReader)
+    binaryReader.close()
+
+    # Selected files are found through the index, so the other files are never read
+    if names is not None:
+        entries = {entry[0]: entry for entry in index}
+        missing = [name for name in names if name not in entries]
+        if missing:
+            raise ValueError("Not in archive: %s" % ", ".join(missing))
+        index = [entries[name] for name in dict.fromkeys(names)]
+
+    # Each worker maps the archive and decodes its own files
+    items = [(archiveFile, memberOffset, memberLength, _memberPath(destinationDirectory, name))
+             for name, _, memberOffset, memberLength in index]
+    for _ in orderedMap(extractMember, items, jobs):
+        pass
+
+    return len(items)
+
+def decompress(sourceFile, destinationFile, jobs: Optional[int] = 1, tables: Optional[List[str]] = None,
+               names: Optional[List[str]] = None) -> str:
+
+    # Messages go to standard error when standard output is the decompressed file
+    messages = sys.stderr if destinationFile == "-" else sys.stdout
+
+    # Initializing binary reader over a memory map of the file
+    binaryReader = MappedFileReader(sourceFile)
+
+    # Getting the format version from the file
+    try:
+        version, firstUInt = _readVersion(binaryReader)
     # If no header information
     except ValueError:
-        print("Empty file, nothing to decompress")
+        print("Empty file, nothing to decompress", file=messages)
+        binaryReader.close()
         return 1
 
-    # Reading key data and creating key that maps binary code to character
-    keyDict = _readKey(binaryReader, amntUniqueChar)
+    # Blocks carry their own keys and can be decoded independently;
+    # worker processes find their blocks through the block index at the end of the file
+    if version == VERSION_BLOCKS:
+        try:
+            if jobs == 1:
+                _decompressBlocks(binaryReader, destinationFile)
+            else:
+                _decompressIndexed(sourceFile, destinationFile, jobs)
+        except ValueError as error:
+            print(error, file=messages)
+            return 1
+        finally:
+            binaryReader.close()
+        return ""
+
+    # Sampled files are read from start to end, each block with the last table written before it
+    if version == VERSION_SAMPLED:
+        try:
+            _writePieces(_decodeSampled(binaryReader), destinationFile)
+        except ValueError as error:
+            print(error, file=messages)
+            return 1
+        finally:
+            binaryReader.close()
+        return ""
+
+    # Archives are extracted into the destination directory, only the named files if names are given
+    if version == VERSION_ARCHIVE:
+        binaryReader.close()
+        if destinationFile == "-":
+            print("Archives hold many files and can only be extracted to a directory", file=messages)
+            return 1
+        try:
+            extractArchive(sourceFile, destinationFile, names, jobs)
+        except ValueError as error:
+            print(error, file=messages)
+            return 1
+        return ""
+
+    # Reading the rest of the header; the table of a file compressed with --table is searched for
+    # next to the file unless tables are given
+    try:
+        flags, totalBytes, decoder = _readDecoder(binaryReader, version, firstUInt,
+                                                  tables or [os.path.dirname(os.path.abspath(sourceFile))])
 
-    # Reading data using the key and writing data to output file
-    data = _readData(binaryReader, keyDict, totalBytes)
-    _writeData(data, destinationFile)
+        # Reading data using the tables and writing it to the output file a block at a time,
+        # checking it against the checksum at the end of the file if it has one
+        _decodeToFile(binaryReader, decoder, totalBytes, destinationFile, None, flags)
+    except ValueError as error:
+        print(error, file=messages)
+        return 1
+    finally:
+        binaryReader.close()
 
     return ""
 
+def _checksumMatches(binaryReader: MappedFileReader, start: int, end: int) -> bool:
+
+    # The UInt at end holds the checksum of the bytes from start up to it
+    binaryReader.seek(end)
+    stored = binaryReader.readUInt()
+    binaryReader.seek(start)
+    with stats.stage("checksum", end - start):
+        return zlib.crc32(binaryReader.readBytes(end - start)) == stored
+
+def _verifyCoded(binaryReader: MappedFileReader, start: int, end: int, tablePaths: List[str]) -> None:
+
+    # A file with a single code, from start up to end: checking its header, then the checksum of its bytes,
+    # or decoding it without keeping the data, against the checksum of the data if it has one
+    binaryReader.seek(start)
+    version, firstUInt = _readVersion(binaryReader)
+    if version in (VERSION_BLOCKS, VERSION_ARCHIVE, VERSION_SAMPLED):
+        raise ValueError("Unexpected .hc format version %d" % version)
+    flags, totalBytes, decoder = _readDecoder(binaryReader, version, firstUInt, tablePaths)
+
+    if flags & FLAG_CHECKSUMS:
+        if end - start < CHECKSUMS_SIZE or binaryReader.tell() > end - CHECKSUMS_SIZE:
+            raise ValueError("Compressed file is truncated")
+        if not _checksumMatches(binaryReader, start, end - 4):
+            raise ValueError("Checksum mismatch: compressed file is corrupt")
+    else:
+        for _ in _decodePieces(binaryReader, decoder, totalBytes, end, flags):
+            pass
+
+def _verifyBlock(binaryReader: MappedFileReader, offset: int, flags: int, blockSize: int) -> Tuple[int, int]:
+
+    # Block: amount of bytes, key data, payload length and payload, then its checksums
+    binaryReader.seek(offset)
+    rawLength = binaryReader.readUInt()
+    if rawLength == 0:
+        return 0, binaryReader.tell()
+    lengths = readLengths(binaryReader)
+    payloadLength = binaryReader.readUInt()
+    checkBlockLength(rawLength, payloadLength, blockSize)
+    payloadStart = binaryReader.tell()
+    end = payloadStart + payloadLength + (CHECKSUMS_SIZE if flags & FLAG_CHECKSUMS else 0)
+    if end > binaryReader.size:
+        raise ValueError("Compressed file is truncated")
+
+    # The block's bytes are checked against its checksum, or decoded without keeping the data if it has none
+    if flags & FLAG_CHECKSUMS:
+        if not _checksumMatches(binaryReader, offset, end - 4):
+            raise ValueError("Checksum mismatch: compressed block is corrupt")
+    else:
+        binaryReader.seek(payloadStart)
+        decompressBlock(rawLength, lengths, binaryReader.readBytes(payloadLength), None, bool(flags & FLAG_STREAMS))
+
+    return rawLength, end
+
+def _verifyBlocks(binaryReader: MappedFileReader) -> List[str]:
+
+    problems = []
+    binaryReader.seek(5)
+    flags = binaryReader.readUByte()
+    blockSize = binaryReader.readUInt()
+
+    # The block index tells where every block should start, so a corrupt block can be stepped over
+    try:
+        _, totalBytes, index = _readBlockIndex(binaryReader)
+    except ValueError as error:
+        problems.append("Block index: %s" % error)
+        index = None
+    starts = [compressedOffset for _, compressedOffset, _ in index] if index is not None else []
+
+    # Checking every block in order; the data of a corrupt block is lost, the blocks after it are not
+    number = 0
+    offset = HEADER_SIZE
+    uncompressedOffset = 0
+    while True:
+        if index is not None and number < len(index):
+            uncompressedOffset = index[number][0]
+            if starts[number] != offset:
+                problems.append("Block %d: starts at byte %d of the file, the block index says %d"
+                                % (number, offset, starts[number]))
+        try:
+            rawLength, end = _verifyBlock(binaryReader, offset, flags, blockSize)
+        except ValueError as error:
+            rawLength, end = None, None
+            problems.append("Block %d at byte %d of the file, data from byte %d: %s"
+                            % (number, offset, uncompressedOffset, error))
+        if rawLength == 0:
+            break
+
+        if end is None:
+            # Continuing at the next block the index knows of, if there is one
+            following = [start for start in starts if start > offset]
+            if not following:
+                problems.append("Blocks after byte %d of the file cannot be found" % offset)
+                break
+            number = starts.index(following[0])
+            offset = following[0]
+            continue
+
+        number += 1
+        offset = end
+        uncompressedOffset += rawLength
+
+    if index is not None and number != len(index):
+        problems.append("Block index lists %d blocks, the file has %d" % (len(index), number))
+
+    return problems
+
+def _verifySampled(binaryReader: MappedFileReader) -> None:
+
+    # The blocks of a sampled file are only found by reading them in order, so a corrupt file is checked as
+    # a whole against the checksum of its bytes, or decoded without keeping the data if it has no checksums
+    flags = binaryReader.readUByte()
+    if flags & FLAG_CHECKSUMS:
+        if binaryReader.size < binaryReader.tell() + 4 + CHECKSUMS_SIZE:
+            raise ValueError("Compressed file is truncated")
+        if not _checksumMatches(binaryReader, 0, binaryReader.size - 4):
+            raise ValueError("Checksum mismatch: compressed file is corrupt")
+    else:
+        binaryReader.seek(5)
+        for _ in _decodeSampled(binaryReader):
+            pass
+
+def _verifyArchive(binaryReader: MappedFileReader) -> List[str]:
+
+    binaryReader.seek(5)
+    flags = binaryReader.readUByte()
+    try:
+        index = _readArchiveIndex(binaryReader)
+        if flags & FLAG_CHECKSUMS:
+            binaryReader.seek(binaryReader.size - ARCHIVE_TRAILER_SIZE + 4)
+            indexOffset = binaryReader.readULong()
+            indexEnd = binaryReader.size - ARCHIVE_TRAILER_SIZE - 4
+            if not indexOffset <= indexEnd or not _checksumMatches(binaryReader, indexOffset, indexEnd):
+                raise ValueError("Checksum mismatch: file index is corrupt")
+    except ValueError as error:
+        return ["File index: %s" % error]
+
+    # Every file is a complete compressed file of its own
+    problems = []
+    for name, _, memberOffset, memberLength in index:
+        if memberLength == 0:
+            continue
+        try:
+            if memberOffset + memberLength > binaryReader.size:
+                raise ValueError("Compressed file is truncated")
+            _verifyCoded(binaryReader, memberOffset, memberOffset + memberLength, [])
+        except ValueError as error:
+            problems.append("%s at byte %d of the archive: %s" % (name, memberOffset, error))
+
+    return problems
+
+def verify(sourceFile, tables: Optional[List[str]] = None) -> List[str]:
+    """
+    check a compressed file without writing its data: the structure of the headers and block index, and
+    the checksums of the file, of every block and of every file of an archive; files without checksums
+    are decoded with the data thrown away
+    :param sourceFile: path of the compressed file
+    :param tables: table files, or directories of them, to find the table of a file compressed with --table in;
+                   defaults to the directory of the file
+    :return: a description of every problem found, naming the block or archived file it is in; empty if intact
+    """
+    binaryReader = MappedFileReader(sourceFile)
+    try:
+        version, _ = _readVersion(binaryReader)
+        if version == VERSION_BLOCKS:
+            return _verifyBlocks(binaryReader)
+        if version == VERSION_ARCHIVE:
+            return _verifyArchive(binaryReader)
+        if version == VERSION_SAMPLED:
+            _verifySampled(binaryReader)
+            return []
+        _verifyCoded(binaryReader, 0, binaryReader.size,
+                     tables or [os.path.dirname(os.path.abspath(sourceFile))])
+    except ValueError as error:
+        return [str(error)]
+    finally:
+        binaryReader.close()
+
+    return []
+
+def decodeStream(infile, tables: Optional[List[str]] = None) -> Iterator[bytearray]:
+
+    # Decoding a compressed file from a binary stream, which is read once from start to end
+    # and need not be seekable, yielding the data a block at a time
+    binaryReader = BinaryFileReader(infile)
+    version, firstUInt = _readVersion(binaryReader)
+
+    if version == VERSION_ARCHIVE:
+        raise ValueError("Archives hold many files and can only be extracted to a directory")
+
+    # Blocks are decoded in order as they are read; the block index at the end is not needed
+    if version == VERSION_BLOCKS:
+        yield from _decodeBlocks(binaryReader)
+        return
+    if version == VERSION_SAMPLED:
+        yield from _decodeSampled(binaryReader)
+        return
+
+    flags, totalBytes, decoder = _readDecoder(binaryReader, version, firstUInt, tables or [])
+    yield from _decodePieces(binaryReader, decoder, totalBytes, None, flags)
+
+def decompress_bytes(data, tables: Optional[List[str]] = None) -> bytes:
+    """
+    decompress a compressed file held in memory
+    :param data: bytes-like object holding any compressed file other than an archive
+    :param tables: table files, or directories of them, to find the table of a file compressed with --table in
+    :return: the decompressed data
+    """
+    return b"".join(decodeStream(io.BytesIO(data), tables))
+
 def main():
     parser = ArgumentParser(description="decompress file using Huffman compression algorithm")
-    parser.add_argument("file", help="file to decompress")
+    parser.add_argument("file", help="file to decompress, or - for standard input")
     parser.add_argument("decompressedFile", nargs="?", default=None,
-                        help="name of decompressed file to create; defaults to removing .hc suffix if not supplied or using .dc if no .huc suffix at end")
+                        help="name of decompressed file, or directory to extract an archive to, to create, or - for standard output; defaults to removing .hc suffix if not supplied or using .dc if no .huc suffix at end, or to standard output for standard input")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of processes decoding the blocks of a file compressed with --jobs, "
+                             "or the files of an archive; defaults to 1")
+    parser.add_argument("--only", action="append", default=None, metavar="NAME",
+                        help="extract only this file of an archive; may be repeated")
+    parser.add_argument("--list", action="store_true", help="list the files of an archive instead of extracting them")
+    parser.add_argument("--verify", action="store_true",
+                        help="check the structure and checksums of the file without writing its data, "
+                             "reporting every corrupt block or archived file")
+    parser.add_argument("--tables", action="append", default=None, metavar="PATH",
+                        help="table file, or directory of .hct table files, to find the table of a file compressed "
+                             "with --table in; may be repeated; defaults to the directory of the file")
+    parser.add_argument("--stats", action="store_true",
+                        help="report the time, bytes in and out and allocated memory blocks of every stage "
+                             "on standard error, or to --stats-file; stages run on worker processes are not included")
+    parser.add_argument("--stats-format", choices=("text", "json"), default=None,
+                        help="write the --stats report as a table or as JSON, implying --stats; defaults to text")
+    parser.add_argument("--stats-file", default=None, metavar="FILE",
+                        help="write the --stats report to FILE instead of standard error")
+    parser.add_argument("--profile", default=None, metavar="FILE",
+                        help="profile the run with cProfile, writing the statistics to FILE and listing the "
+                             "slowest functions with --stats")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="trace memory with tracemalloc, adding the peak of every stage and the top "
+                             "allocation sites to the --stats output")
     args = parser.parse_args()
+    # Report format: --stats-format alone is enough to ask for a report
+    statsFormat = args.stats_format or ("text" if args.stats else None)
 
     fileToDecompress = args.file
+
+    # Listing the size and name of every file in an archive from its index
+    if args.list:
+        binaryReader = MappedFileReader(fileToDecompress)
+        try:
+            if _readVersion(binaryReader)[0] != VERSION_ARCHIVE:
+                raise ValueError("%s is not an archive" % fileToDecompress)
+            for name, size, _, _ in _readArchiveIndex(binaryReader):
+                print("%12d  %s" % (size, name))
+        except ValueError as error:
+            print(error)
+            return 1
+        finally:
+            binaryReader.close()
+        return 0
+
+    # Checking the file instead of decompressing it
+    if args.verify:
+        with stats.report(statsFormat, args.profile, args.trace_memory, args.stats_file):
+            problems = verify(fileToDecompress, args.tables)
+        for problem in problems:
+            print(problem)
+        if problems:
+            return 1
+        print("%s: OK" % fileToDecompress)
+        return 0
+
     decompressedFile = args.decompressedFile
+
+    # Standard input cannot be memory mapped, so it is decoded as a stream; messages go to standard error,
+    # since standard output may be the decompressed file
+    if fileToDecompress == "-":
+        with stats.report(statsFormat, args.profile, args.trace_memory, args.stats_file):
+            try:
+                _writePieces(decodeStream(sys.stdin.buffer, args.tables), decompressedFile or "-")
+            except ValueError as error:
+                print(error, file=sys.stderr)
+                return 1
+        return 0
+
     if decompressedFile is None:
         if fileToDecompress[-3:] == ".hc":
             decompressedFile = fileToDecompress[:-3]
         else:
             decompressedFile = fileToDecompress + ".huc"
 
-    # Decompress file to output file
-    decompress(fileToDecompress, decompressedFile)
+    # Decompress file to output file, measuring the stages when asked to
+    with stats.report(statsFormat, args.profile, args.trace_memory, args.stats_file):
+        if decompress(fileToDecompress, decompressedFile, args.jobs, args.tables, args.only) == 1:
+            return 1
 
     return 0
 
 # ----------------------------------------------------------------------
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
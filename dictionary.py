@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# dictionary.py
+#
+# Pretrained code table files (.hct). A table holds the code length of every byte value and is
+# identified by the CRC-32 of its code lengths, which .hc files in dictionary mode store in place
+# of a key.
+# ----------------------------------------------------------------------
+
+import io
+import os
+import zlib
+from typing import Dict, Iterable, Tuple
+
+from BinaryFileIO import BinaryFileWriter, BinaryFileReader
+from canonical import writeLengths, readLengths
+
+# start of every table file
+TABLE_MAGIC = b"HCT"
+
+# version of the table file layout
+TABLE_VERSION = 1
+
+# file name suffix of table files, used when searching a directory for tables
+TABLE_SUFFIX = ".hct"
+
+# ----------------------------------------------------------------------
+
+def tableId(lengths: Dict[int, int]) -> int:
+    """
+    identify a code table by its contents, so a table file that is renamed or copied keeps its ID
+    :param lengths: code length of each byte value
+    :return: CRC-32 of the packed code lengths
+    """
+    packed = io.BytesIO()
+    writer = BinaryFileWriter(packed)
+    writeLengths(writer, lengths)
+    writer.close()
+    return zlib.crc32(packed.getvalue())
+
+# ----------------------------------------------------------------------
+
+def writeTable(tableFile, lengths: Dict[int, int]) -> int:
+    """
+    save a code table: the magic bytes, the layout version, the table ID and the packed code lengths
+    :param tableFile: path of the table file to create
+    :param lengths: code length of each byte value
+    :return: ID of the table
+    """
+    identifier = tableId(lengths)
+    writer = BinaryFileWriter(tableFile)
+    writer.writeBytes(TABLE_MAGIC)
+    writer.writeUByte(TABLE_VERSION)
+    writer.writeUInt(identifier)
+    writeLengths(writer, lengths)
+    writer.close()
+    return identifier
+
+# ----------------------------------------------------------------------
+
+def readTableId(reader: BinaryFileReader) -> int:
+    """
+    read the start of a table file
+    :param reader: table file positioned at its start
+    :return: ID of the table
+    """
+    if reader.readBytes(len(TABLE_MAGIC)) != TABLE_MAGIC:
+        raise ValueError("Not a code table file")
+    version = reader.readUByte()
+    if version != TABLE_VERSION:
+        raise ValueError("Unsupported code table version %d" % version)
+    return reader.readUInt()
+
+# ----------------------------------------------------------------------
+
+def readTable(tableFile) -> Tuple[int, Dict[int, int]]:
+    """
+    load a code table saved by writeTable
+    :param tableFile: path of the table file
+    :return: (ID of the table, code length of each byte value)
+    """
+    reader = BinaryFileReader(tableFile)
+    try:
+        identifier = readTableId(reader)
+        lengths = readLengths(reader)
+    finally:
+        reader.close()
+
+    if tableId(lengths) != identifier:
+        raise ValueError("Code table file %s is corrupt" % tableFile)
+    return identifier, lengths
+
+# ----------------------------------------------------------------------
+
+def findTables(paths: Iterable[str]) -> Dict[int, str]:
+    """
+    locate table files by ID
+    :param paths: table files, and directories whose .hct files are tables
+    :return: path of the table file for each table ID found
+    """
+    tables = {}
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                candidates = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                              if name.endswith(TABLE_SUFFIX)]
+            else:
+                candidates = [path]
+        except OSError as error:
+            raise ValueError("Cannot read table directory %s: %s" % (path, error.strerror))
+
+        for candidate in candidates:
+            # Paths that cannot be opened are reported like any other bad argument
+            try:
+                reader = BinaryFileReader(candidate)
+            except OSError as error:
+                raise ValueError("Cannot read table file %s: %s" % (candidate, error.strerror))
+            try:
+                tables.setdefault(readTableId(reader), candidate)
+            except ValueError:
+                # files that are not tables are skipped
+                pass
+            finally:
+                reader.close()
+
+    return tables
+
+# ----------------------------------------------------------------------
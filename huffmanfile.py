@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# huffmanfile.py
+#
+# File object interface to .hc files, in the manner of gzip.GzipFile. A HuffmanFile wraps any binary
+# stream: reading decodes a compressed file as it is read, writing compresses data into a block
+# container as it is written. Neither needs the stream to be seekable, so sockets and pipes work too.
+# ----------------------------------------------------------------------
+
+import io
+from typing import List, Optional
+
+from BinaryFileIO import BinaryFileWriter
+from compress import BLOCK_SIZE, BlockIndex, blockFlags, compressBlock, writeBlockHeader
+from decompress import decodeStream
+
+# ----------------------------------------------------------------------
+
+class HuffmanFile(io.BufferedIOBase):
+    """
+    Reads the data of a compressed file, in any format but an archive, from a binary stream,
+    or writes data to a binary stream as a block container that decompress.py can read.
+    """
+
+    def __init__(self, filename=None, mode: str = "rb", fileobj=None, blockSize: int = BLOCK_SIZE,
+                 checkpointInterval: int = 0, backend: str = "auto", maxCodeLength: Optional[int] = None,
+                 tables: Optional[List[str]] = None, streams: int = 1):
+        """
+        open a compressed file
+        :param filename: path of the compressed file, used when fileobj is not given
+        :param mode: "rb" to read or "wb" to write
+        :param fileobj: binary stream to read from or write to; it is left open by close
+        :param blockSize: number of bytes in each block when writing
+        :param checkpointInterval: number of bytes between checkpoints when writing, 0 for none
+        :param backend: backend to count frequencies and encode with when writing
+        :param maxCodeLength: longest code allowed when writing, None for no limit
+        :param tables: table files, or directories of them, to find the table of a file compressed with --table in
+        :param streams: number of interleaved streams to split every block into when writing; cannot be combined
+                        with checkpoints
+        """
+        super().__init__()
+        if mode not in ("r", "rb", "w", "wb"):
+            raise ValueError("HuffmanFile error: invalid mode %s" % mode)
+        if fileobj is None and filename is None:
+            raise ValueError("HuffmanFile error: a filename or fileobj is needed")
+        if streams > 1 and checkpointInterval > 0:
+            raise ValueError("HuffmanFile error: blocks split into streams cannot have checkpoints")
+
+        self.mode = mode[0]
+        self.ownsFile = fileobj is None
+        self.fileobj = open(filename, self.mode + "b") if fileobj is None else fileobj
+        self.name = filename if filename is not None else getattr(fileobj, "name", "")
+
+        # reading: decoded pieces still to come, and the decoded bytes not read yet
+        self.tables = tables
+        self.pieces = None
+        self.buffer = b""
+        self.bufferOffset = 0
+
+        # writing: bytes waiting for a block to fill, and the block index of the blocks written
+        self.blockSize = blockSize
+        self.checkpointInterval = checkpointInterval
+        self.backend = backend
+        self.maxCodeLength = maxCodeLength
+        self.streams = streams
+        self.flags = blockFlags(checkpointInterval, streams)
+        self.pending = bytearray()
+        self.started = False
+        self.index = BlockIndex()
+
+    # ------------------------------------------------------------------
+
+    def readable(self) -> bool:
+        return self.mode == "r"
+
+    def writable(self) -> bool:
+        return self.mode == "w"
+
+    def seekable(self) -> bool:
+        return False
+
+    # ------------------------------------------------------------------
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        """
+        read decompressed bytes
+        :param size: number of bytes to read, -1 or None for all of the rest
+        :return: the bytes, fewer than size only at the end of the data
+        """
+        self._checkReadable()
+        if size is None or size < 0:
+            pieces = [self._take(len(self.buffer))]
+            pieces += [bytes(piece) for piece in self._remainingPieces()]
+            return b"".join(pieces)
+
+        pieces = []
+        while size > 0 and self._fill():
+            piece = self._take(size)
+            pieces.append(piece)
+            size -= len(piece)
+        return b"".join(pieces)
+
+    # ------------------------------------------------------------------
+
+    def read1(self, size: int = -1) -> bytes:
+        """
+        read decompressed bytes, decoding at most one more block
+        :param size: largest number of bytes to read, -1 for as many as are available
+        :return: the bytes, none only at the end of the data
+        """
+        self._checkReadable()
+        if not self._fill():
+            return b""
+        return self._take(len(self.buffer) if size is None or size < 0 else size)
+
+    # ------------------------------------------------------------------
+
+    def peek(self, size: int = 0) -> bytes:
+        """
+        get decompressed bytes without reading them
+        :param size: ignored; the rest of the current block is returned
+        :return: at least one byte, none only at the end of the data
+        """
+        self._checkReadable()
+        if not self._fill():
+            return b""
+        return self.buffer[self.bufferOffset:]
+
+    # ------------------------------------------------------------------
+
+    def write(self, data) -> int:
+        """
+        compress data, writing every block it completes
+        :param data: bytes-like object following the data written before
+        :return: number of bytes taken
+        """
+        if self.closed:
+            raise ValueError("HuffmanFile error: write to a closed file")
+        if self.mode != "w":
+            raise io.UnsupportedOperation("HuffmanFile error: file is not open for writing")
+
+        data = memoryview(data).cast("B")
+        self.pending += data
+        while len(self.pending) >= self.blockSize:
+            self._writeBlock(bytes(self.pending[:self.blockSize]))
+            del self.pending[:self.blockSize]
+
+        return len(data)
+
+    # ------------------------------------------------------------------
+
+    def close(self) -> None:
+        """
+        finish the compressed file when writing, then close the stream if the HuffmanFile opened it
+        :return: None
+        """
+        if self.closed:
+            return
+        try:
+            if self.mode == "w":
+                # the last block, then the block index and trailer
+                self._writeHeader()
+                if self.pending:
+                    self._writeBlock(bytes(self.pending))
+                    self.pending = bytearray()
+                bitWriter = BinaryFileWriter(self.fileobj)
+                self.index.write(bitWriter, self.flags)
+                bitWriter.close()
+            elif self.pieces is not None:
+                self.pieces.close()
+        finally:
+            if self.ownsFile:
+                self.fileobj.close()
+            super().close()
+
+    # ------------------------------------------------------------------
+
+    def _checkReadable(self) -> None:
+        """
+        check that the file is open for reading
+        :return: None
+        """
+        if self.closed:
+            raise ValueError("HuffmanFile error: read from a closed file")
+        if self.mode != "r":
+            raise io.UnsupportedOperation("HuffmanFile error: file is not open for reading")
+
+    # ------------------------------------------------------------------
+
+    def _remainingPieces(self):
+        """
+        get the decoded pieces not read yet, starting to decode the stream on the first call
+        :return: iterator over the decoded pieces
+        """
+        if self.pieces is None:
+            self.pieces = decodeStream(self.fileobj, self.tables)
+        return self.pieces
+
+    # ------------------------------------------------------------------
+
+    def _fill(self) -> bool:
+        """
+        decode the next piece when every decoded byte has been read
+        :return: whether there are decoded bytes to read
+        """
+        while self.bufferOffset >= len(self.buffer):
+            piece = next(self._remainingPieces(), None)
+            if piece is None:
+                return False
+            self.buffer = bytes(piece)
+            self.bufferOffset = 0
+
+        return True
+
+    # ------------------------------------------------------------------
+
+    def _take(self, size: int) -> bytes:
+        """
+        read decoded bytes from the current piece
+        :param size: largest number of bytes to read
+        :return: the bytes
+        """
+        piece = self.buffer[self.bufferOffset:self.bufferOffset + size]
+        self.bufferOffset += len(piece)
+        return piece
+
+    # ------------------------------------------------------------------
+
+    def _writeHeader(self) -> None:
+        """
+        write the header, once before the first block
+        :return: None
+        """
+        if self.started:
+            return
+        self.started = True
+
+        bitWriter = BinaryFileWriter(self.fileobj)
+        writeBlockHeader(bitWriter, self.flags, self.blockSize)
+        bitWriter.close()
+
+    # ------------------------------------------------------------------
+
+    def _writeBlock(self, data: bytes) -> None:
+        """
+        compress one block, write it and add it to the block index
+        :param data: the bytes of the block
+        :return: None
+        """
+        self._writeHeader()
+        rawLength, block, checkpoints = compressBlock(data, self.checkpointInterval, self.backend,
+                                                      self.maxCodeLength, self.streams)
+
+        self.index.addData(data)
+        self.index.addBlock(rawLength, block, checkpoints)
+        self.fileobj.write(block)
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# parallel.py
+#
+# Ordered fan-out of independent work items over a process pool.
+# ----------------------------------------------------------------------
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+# ----------------------------------------------------------------------
+
+def orderedMap(function: Callable, items: Iterable[Tuple], jobs: Optional[int] = 1) -> Iterator:
+    """
+    call function(*item) for every item on a pool of worker processes and yield the results in the
+    order of the items; only a few items per worker are in flight, so memory use stays bounded
+    :param function: module level function to call, so it can be sent to the workers
+    :param items: tuple of arguments for each call
+    :param jobs: number of worker processes, 1 to run everything in this process, None for every core
+    :return: iterator over the results
+    """
+    if jobs == 1:
+        for item in items:
+            yield function(*item)
+        return
+
+    workers = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, *item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# ----------------------------------------------------------------------
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# stats.py
+#
+# Stage instrumentation for compressing and decompressing. Each stage (read, histogram, tree, key,
+# header, encode, decode, write) is measured for wall time, bytes in and out and the net number of
+# memory blocks it allocated, and every measurement is passed to the registered hooks. Without hooks
+# a stage costs one function call and no measurement is taken.
+# ----------------------------------------------------------------------
+
+import cProfile
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# number of functions and allocation sites listed by the deep dive captures
+TOP_COUNT = 20
+
+# ----------------------------------------------------------------------
+
+class StageRecord:
+    """
+    Measurement of one run of a stage. The stage sets bytesOut itself when it knows how much it produced.
+    """
+
+    def __init__(self, name: str, bytesIn: int = 0):
+        """
+        :param name: name of the stage
+        :param bytesIn: number of bytes the stage consumes
+        """
+        self.name = name
+        self.bytesIn = bytesIn
+        self.bytesOut = 0
+        self.seconds = 0.0
+        # net change in the number of memory blocks allocated by the interpreter
+        self.allocatedBlocks = 0
+        # peak memory traced during the stage, None unless tracemalloc is tracing
+        self.peakBytes: Optional[int] = None
+
+# ----------------------------------------------------------------------
+
+# functions called with the StageRecord of every stage that finishes
+_hooks: List[Callable[[StageRecord], None]] = []
+
+def addHook(hook: Callable[[StageRecord], None]) -> None:
+    """
+    start passing stage measurements to a hook, for example to forward them to a metrics system
+    :param hook: function called with the StageRecord of every stage that finishes, in the process running it
+    :return: None
+    """
+    _hooks.append(hook)
+
+def removeHook(hook: Callable[[StageRecord], None]) -> None:
+    """
+    stop passing stage measurements to a hook
+    :param hook: hook added with addHook
+    :return: None
+    """
+    _hooks.remove(hook)
+
+# ----------------------------------------------------------------------
+
+class _Stage:
+    """
+    Context manager measuring one run of a stage and passing the record to the hooks.
+    """
+
+    __slots__ = ("record", "start", "blocks", "traced")
+
+    def __init__(self, name: str, bytesIn: int):
+        self.record = StageRecord(name, bytesIn)
+        self.traced = None
+
+    def __enter__(self) -> StageRecord:
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.traced = tracemalloc.get_traced_memory()[0]
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exception) -> bool:
+        record = self.record
+        record.seconds = time.perf_counter() - self.start
+        record.allocatedBlocks = sys.getallocatedblocks() - self.blocks
+        if self.traced is not None and tracemalloc.is_tracing():
+            record.peakBytes = tracemalloc.get_traced_memory()[1] - self.traced
+        for hook in list(_hooks):
+            hook(record)
+        return False
+
+class _NoStage:
+    """
+    Stand-in for _Stage while no hooks are registered; the record it hands out is shared and discarded.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> StageRecord:
+        return _DISCARDED
+
+    def __exit__(self, *exception) -> bool:
+        return False
+
+_DISCARDED = StageRecord("")
+_NO_STAGE = _NoStage()
+
+def stage(name: str, bytesIn: int = 0):
+    """
+    measure a stage: with stage("encode", len(data)) as record: ... record.bytesOut = n
+    :param name: name of the stage
+    :param bytesIn: number of bytes the stage consumes
+    :return: context manager giving the StageRecord to fill in
+    """
+    if not _hooks:
+        return _NO_STAGE
+    return _Stage(name, bytesIn)
+
+# ----------------------------------------------------------------------
+
+class Collector:
+    """
+    Hook adding up the measurements of every stage by name, in the order the stages first ran.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict] = {}
+        self.wallSeconds = 0.0
+        # (function, calls, cumulative seconds) from a profile and (site, bytes) from a memory trace
+        self.profile: Optional[List] = None
+        self.allocations: Optional[List] = None
+
+    # ------------------------------------------------------------------
+
+    def __call__(self, record: StageRecord) -> None:
+        totals = self.stages.setdefault(record.name, {"calls": 0, "seconds": 0.0, "bytesIn": 0, "bytesOut": 0,
+                                                      "allocatedBlocks": 0, "peakBytes": None})
+        totals["calls"] += 1
+        totals["seconds"] += record.seconds
+        totals["bytesIn"] += record.bytesIn
+        totals["bytesOut"] += record.bytesOut
+        totals["allocatedBlocks"] += record.allocatedBlocks
+        if record.peakBytes is not None:
+            totals["peakBytes"] = max(totals["peakBytes"] or 0, record.peakBytes)
+
+    # ------------------------------------------------------------------
+
+    def toDict(self) -> Dict:
+        """
+        :return: the totals of every stage and the captures, ready to be written as JSON
+        """
+        result = {"wallSeconds": self.wallSeconds, "stages": self.stages}
+        if self.profile is not None:
+            result["profile"] = [{"function": function, "calls": calls, "cumulativeSeconds": seconds}
+                                 for function, calls, seconds in self.profile]
+        if self.allocations is not None:
+            result["allocations"] = [{"site": site, "bytes": size} for site, size in self.allocations]
+        return result
+
+    # ------------------------------------------------------------------
+
+    def summary(self) -> str:
+        """
+        :return: a table of the totals of every stage, followed by the captures
+        """
+        lines = ["%-10s %7s %10s %12s %12s %10s %12s %12s" % ("stage", "calls", "seconds", "bytes in", "bytes out",
+                                                               "MB/s", "alloc blocks", "peak bytes")]
+        for name, totals in self.stages.items():
+            size = totals["bytesIn"] or totals["bytesOut"]
+            rate = "%10.2f" % (size / (1 << 20) / totals["seconds"]) if size and totals["seconds"] > 0 else "%10s" % "-"
+            peak = "-" if totals["peakBytes"] is None else str(totals["peakBytes"])
+            lines.append("%-10s %7d %10.4f %12d %12d %s %12d %12s" % (
+                name, totals["calls"], totals["seconds"], totals["bytesIn"], totals["bytesOut"], rate,
+                totals["allocatedBlocks"], peak))
+        lines.append("%-10s %7s %10.4f" % ("total", "", self.wallSeconds))
+
+        if self.profile is not None:
+            lines.append("")
+            lines.append("%10s %10s  %s" % ("calls", "cumulative", "function"))
+            lines += ["%10d %10.4f  %s" % (calls, seconds, function) for function, calls, seconds in self.profile]
+        if self.allocations is not None:
+            lines.append("")
+            lines.append("%12s  %s" % ("bytes", "allocated at"))
+            lines += ["%12d  %s" % (size, site) for site, size in self.allocations]
+        return "\n".join(lines)
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
+
+@contextmanager
+def report(outputFormat: Optional[str] = None, profileFile: Optional[str] = None, traceMemory: bool = False,
+           reportFile: Optional[str] = None):
+    """
+    collect the stages run inside the with block and write them out when it ends, as for the --stats flag;
+    the report never goes to standard output, which may be carrying the compressed or decompressed data
+    :param outputFormat: "text" for a table, "json" for JSON, None to write nothing unless tracing memory
+    :param profileFile: file to write cProfile statistics of the block to, None to not profile
+    :param traceMemory: trace memory with tracemalloc to add each stage's peak and the top allocation sites
+    :param reportFile: file to write the report to, None for standard error
+    :return: context manager giving the Collector, or None when nothing is asked for
+    """
+    if outputFormat is None and profileFile is None and not traceMemory:
+        yield None
+        return
+
+    collector = Collector()
+    addHook(collector)
+    if traceMemory:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if profileFile is not None else None
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+
+    try:
+        yield collector
+    finally:
+        collector.wallSeconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profileFile)
+            entries = pstats.Stats(profiler).stats.items()
+            top = sorted(entries, key=lambda entry: entry[1][3], reverse=True)[:TOP_COUNT]
+            collector.profile = [("%s:%d(%s)" % function, calls, cumulative)
+                                 for function, (_, calls, _, cumulative, _) in top]
+        if traceMemory:
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:TOP_COUNT]
+            collector.allocations = [(str(statistic.traceback[0]), statistic.size) for statistic in statistics]
+            tracemalloc.stop()
+        removeHook(collector)
+
+        if outputFormat == "json":
+            _writeReport(json.dumps(collector.toDict(), indent=2), reportFile)
+        elif outputFormat == "text" or traceMemory:
+            _writeReport(collector.summary(), reportFile)
+
+# ----------------------------------------------------------------------
+
+def _writeReport(text: str, reportFile: Optional[str]) -> None:
+    """
+    write a report to a file, or to standard error
+    :param text: the report
+    :param reportFile: file to write it to, None for standard error
+    :return: None
+    """
+    if reportFile is None:
+        print(text, file=sys.stderr)
+        return
+    with open(reportFile, "w") as outfile:
+        outfile.write(text + "\n")
+
+# ----------------------------------------------------------------------
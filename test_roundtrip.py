@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# test_roundtrip.py
+#
+# Round trips of every .hc format version through compress.py and decompress.py,
+# with and without checkpoints, checksums and streams, writing and reading files
+# and standard input and output.
+# usage: python -m pytest -q
+# ----------------------------------------------------------------------
+
+import io
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+
+import pytest
+
+from BinaryFileIO import BinaryFileReader, BinaryFileWriter, MappedFileReader
+from canonical import FORMAT_MARKER, VERSION_LEGACY, VERSION_CANONICAL, VERSION_BLOCKS, VERSION_DICTIONARY, \
+    VERSION_ARCHIVE, VERSION_CONTEXT, VERSION_SAMPLED, VERSION_TOKENS, FLAG_CHECKPOINTS, FLAG_CHECKSUMS, \
+    FLAG_STREAMS, FLAG_DATA_CHECKSUM, FLAG_SHORT_TOTAL, ALPHABET_SIZE, HEADER_SIZE, EncodeTable, readLengths
+import compress
+import decompress
+
+# directory of compress.py and decompress.py, which are run as scripts
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# file in the original format, version 0, and the data it holds
+LEGACY_FILE = os.path.join(SCRIPT_DIR, "CompressedData.hc")
+LEGACY_DATA = b"Hey... what are you doing poking around in my project?"
+
+# stands for the path of a table trained on the data in the options of FORMATS
+TABLE = "TABLE"
+
+# every format written from a single file: (name, version, flags, compress.py options)
+FORMATS = [
+    ("canonical", VERSION_CANONICAL, FLAG_DATA_CHECKSUM | FLAG_SHORT_TOTAL, []),
+    ("blocks", VERSION_BLOCKS, FLAG_CHECKSUMS, ["--jobs", "1", "--block-size", "5000"]),
+    ("seekable", VERSION_BLOCKS, FLAG_CHECKSUMS | FLAG_CHECKPOINTS,
+     ["--seekable", "--block-size", "5000", "--checkpoint-interval", "1000"]),
+    ("streams", VERSION_BLOCKS, FLAG_CHECKSUMS | FLAG_STREAMS, ["--streams", "--block-size", "5000"]),
+    ("stream-count", VERSION_BLOCKS, FLAG_CHECKSUMS | FLAG_STREAMS, ["--stream-count", "3", "--block-size", "5000"]),
+    ("dictionary", VERSION_DICTIONARY, FLAG_CHECKSUMS, ["--table", TABLE]),
+    ("context", VERSION_CONTEXT, FLAG_CHECKSUMS, ["--context"]),
+    ("sampled", VERSION_SAMPLED, FLAG_CHECKSUMS, ["--single-pass", "--sample-size", "1000", "--block-size", "4000"]),
+    ("tokens", VERSION_TOKENS, FLAG_CHECKSUMS, ["--extended-alphabet"]),
+    ("alphabet-size", VERSION_TOKENS, FLAG_CHECKSUMS, ["--alphabet-size", "300"]),
+]
+
+# ----------------------------------------------------------------------
+
+def _data() -> bytes:
+
+    # Text with runs and repeated pairs, followed by random bytes, so every format has something to do
+    rand = random.Random(0)
+    words = [b"the", b"huffman", b"code", b"\r\n", b"    ", b"table"]
+    text = b" ".join(rand.choice(words) for _ in range(4000))
+    return text + bytes(rand.randrange(256) for _ in range(3000))
+
+def _script(script: str, *args: str, stdin: bytes = b"") -> subprocess.CompletedProcess:
+
+    # Running a script with the interpreter running the tests
+    return subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script)] + list(args), input=stdin,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def _run(script: str, *args: str, stdin: bytes = b"") -> bytes:
+
+    # Running a script, failing with its messages if it does not succeed
+    result = _script(script, *args, stdin=stdin)
+    assert result.returncode == 0, result.stderr.decode() + result.stdout.decode()
+    return result.stdout
+
+def _fail(script: str, *args: str, stdin: bytes = b"") -> bytes:
+
+    # Running a script that must report an error without a traceback, returning its messages
+    result = _script(script, *args, stdin=stdin)
+    assert result.returncode == 1 and b"Traceback" not in result.stderr, result.stderr.decode()
+    return result.stdout + result.stderr
+
+def _compress(source, tmp_path, options: list) -> str:
+
+    # Compressing next to the source, where the table is trained if the format needs one
+    tableFile = str(tmp_path / "table.hct")
+    if TABLE in options:
+        _run("compress.py", str(source), "--train", tableFile)
+    compressedFile = str(tmp_path / "source.hc")
+    _run("compress.py", str(source), compressedFile, *[tableFile if option == TABLE else option for option in options])
+    return compressedFile
+
+def _roundTrip(compressedFile: str, tmp_path, data: bytes) -> None:
+
+    # Decompressing to a file and to standard output on one and two processes, and from standard input,
+    # which has no directory to find a table in unless it is given
+    decompressedFile = tmp_path / "decompressed"
+    for jobs in ("1", "2"):
+        _run("decompress.py", compressedFile, str(decompressedFile), "--jobs", jobs)
+        assert decompressedFile.read_bytes() == data
+        assert _run("decompress.py", compressedFile, "-", "--jobs", jobs) == data
+    with open(compressedFile, "rb") as infile:
+        assert _run("decompress.py", "-", "--tables", str(tmp_path), stdin=infile.read()) == data
+    assert _run("decompress.py", compressedFile, "--verify").strip().endswith(b"OK")
+
+# ----------------------------------------------------------------------
+
+def _stripChecksums(compressedFile: str, version: int) -> bytes:
+
+    # Rewriting the file as the same data would be without checksums, as written before files had them
+    if version == VERSION_BLOCKS:
+        compressed = _blocksWithoutChecksums(compressedFile)
+    elif version == VERSION_ARCHIVE:
+        compressed = _archiveWithoutChecksums(compressedFile)
+    else:
+        with open(compressedFile, "rb") as infile:
+            compressed = _withoutChecksums(infile.read())
+    with open(compressedFile, "wb") as outfile:
+        outfile.write(compressed)
+
+    return compressed
+
+def _withoutChecksums(compressed: bytes) -> bytes:
+
+    # Single code, dictionary, context, sampled and token files end with the checksums,
+    # or with the checksum of the data alone
+    if compressed[5] & FLAG_DATA_CHECKSUM:
+        return compressed[:5] + bytes([compressed[5] & ~FLAG_DATA_CHECKSUM]) + compressed[6:-4]
+    assert compressed[5] & FLAG_CHECKSUMS
+    return compressed[:5] + bytes([compressed[5] & ~FLAG_CHECKSUMS]) + compressed[6:-decompress.CHECKSUMS_SIZE]
+
+def _blocksWithoutChecksums(compressedFile: str) -> bytes:
+
+    # Reading the block index; every block ends where the next one starts, the last one at the block of 0 bytes
+    binaryReader = MappedFileReader(compressedFile)
+    flags, totalBytes, index = decompress._readBlockIndex(binaryReader)
+    blockSize = struct.unpack("<I", bytes(binaryReader.view[6:10]))[0]
+    indexOffset = struct.unpack("<Q", bytes(binaryReader.view[-8:]))[0]
+    blocks = [bytes(binaryReader.view[compressedOffset:end - decompress.CHECKSUMS_SIZE]) for (_, compressedOffset, _), end
+              in zip(index, [compressedOffset for _, compressedOffset, _ in index[1:]] + [indexOffset - 4])]
+    binaryReader.close()
+
+    # Writing every block without the checksums at its end, moving the block offsets and checkpoints with them
+    flags &= ~FLAG_CHECKSUMS
+    packed = io.BytesIO()
+    bitWriter = BinaryFileWriter(packed)
+    offset = compress.writeBlockHeader(bitWriter, flags, blockSize)
+    moved = []
+    for (uncompressedOffset, compressedOffset, checkpoints), block in zip(index, blocks):
+        shift = (compressedOffset - offset) * 8
+        moved.append((uncompressedOffset, offset, [(start, bit - shift) for start, bit in checkpoints]))
+        bitWriter.writeBytes(block)
+        offset += len(block)
+    compress.writeBlockIndex(bitWriter, flags, moved, totalBytes, offset)
+    bitWriter.close()
+
+    return packed.getvalue()
+
+def _archiveWithoutChecksums(compressedFile: str) -> bytes:
+
+    # Reading the file index and every file of the archive without its checksums
+    binaryReader = MappedFileReader(compressedFile)
+    index = decompress._readArchiveIndex(binaryReader)
+    members = [bytes(binaryReader.view[memberOffset:memberOffset + memberLength])
+               for _, _, memberOffset, memberLength in index]
+    binaryReader.close()
+    members = [_withoutChecksums(member) if member else member for member in members]
+
+    # Writing the header, the files, and the file index without its checksum followed by the trailer
+    packed = io.BytesIO()
+    bitWriter = BinaryFileWriter(packed)
+    bitWriter.writeUInt(FORMAT_MARKER)
+    bitWriter.writeUByte(VERSION_ARCHIVE)
+    bitWriter.writeUByte(0)
+    offsets = [6]
+    for member in members:
+        bitWriter.writeBytes(member)
+        offsets.append(offsets[-1] + len(member))
+    for (name, size, _, _), member, memberOffset in zip(index, members, offsets):
+        bitWriter.writeUShort(len(name.encode("utf-8")))
+        bitWriter.writeBytes(name.encode("utf-8"))
+        bitWriter.writeULong(size)
+        bitWriter.writeULong(memberOffset)
+        bitWriter.writeULong(len(member))
+    bitWriter.writeUInt(len(index))
+    bitWriter.writeULong(offsets[-1])
+    bitWriter.close()
+
+    return packed.getvalue()
+
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def source(tmp_path):
+    sourceFile = tmp_path / "source"
+    sourceFile.write_bytes(_data())
+    return sourceFile
+
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize("name, version, flags, options", FORMATS)
+def testRoundTrip(source, tmp_path, name, version, flags, options):
+    compressedFile = _compress(source, tmp_path, options)
+    with open(compressedFile, "rb") as infile:
+        assert tuple(infile.read(6)) == (0, 0, 0, 0, version, flags)
+
+    _roundTrip(compressedFile, tmp_path, source.read_bytes())
+
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize("name, version, flags, options", FORMATS)
+def testWithoutChecksums(source, tmp_path, name, version, flags, options):
+    compressedFile = _compress(source, tmp_path, options)
+    assert tuple(_stripChecksums(compressedFile, version)[:6]) == (0, 0, 0, 0, version,
+                                                                   flags & ~(FLAG_CHECKSUMS | FLAG_DATA_CHECKSUM))
+
+    _roundTrip(compressedFile, tmp_path, source.read_bytes())
+
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize("checksums", [True, False])
+def testArchive(tmp_path, checksums):
+    directory = tmp_path / "files"
+    (directory / "nested").mkdir(parents=True)
+    files = {"data": _data(), "empty": b"", "nested/text": _data()[:5000]}
+    for name, data in files.items():
+        (directory / name).write_bytes(data)
+
+    archiveFile = str(tmp_path / "files.hc")
+    _run("compress.py", "--batch", str(directory), archiveFile, "--jobs", "2")
+    if not checksums:
+        _stripChecksums(archiveFile, VERSION_ARCHIVE)
+    with open(archiveFile, "rb") as infile:
+        compressed = infile.read()
+    assert tuple(compressed[:6]) == (0, 0, 0, 0, VERSION_ARCHIVE, FLAG_CHECKSUMS if checksums else 0)
+
+    # Archives are extracted to a directory on one or more processes, and never to standard output
+    for jobs in ("1", "2"):
+        extracted = tmp_path / ("extracted" + jobs)
+        _run("decompress.py", archiveFile, str(extracted), "--jobs", jobs)
+        for name, data in files.items():
+            assert (extracted / name).read_bytes() == data
+    assert _run("decompress.py", archiveFile, "--verify").strip().endswith(b"OK")
+    assert b"can only be extracted to a directory" in _fail("decompress.py", archiveFile, "-")
+    assert b"can only be extracted to a directory" in _fail("decompress.py", "-", stdin=compressed)
+
+# ----------------------------------------------------------------------
+
+def testDictionaryTables(source, tmp_path):
+    compressedFile = _compress(source, tmp_path, ["--table", TABLE])
+    assert _run("decompress.py", compressedFile, "-", "--tables", str(tmp_path / "table.hct")) == source.read_bytes()
+
+    # A table path that cannot be read is reported without a traceback
+    assert b"Cannot read table file" in _fail("decompress.py", compressedFile, "-",
+                                              "--tables", str(tmp_path / "missing.hct"))
+
+# ----------------------------------------------------------------------
+
+def testLegacy(tmp_path):
+    binaryReader = BinaryFileReader(LEGACY_FILE)
+    assert decompress._readVersion(binaryReader)[0] == VERSION_LEGACY
+    binaryReader.close()
+
+    decompressedFile = tmp_path / "decompressed"
+    _run("decompress.py", LEGACY_FILE, str(decompressedFile))
+    assert decompressedFile.read_bytes() == LEGACY_DATA
+    assert _run("decompress.py", LEGACY_FILE, "-") == LEGACY_DATA
+    with open(LEGACY_FILE, "rb") as infile:
+        assert _run("decompress.py", "-", stdin=infile.read()) == LEGACY_DATA
+
+# ----------------------------------------------------------------------
+
+def testSinglePassPipe(source):
+    compressed = _run("compress.py", "-", "-", "--single-pass", stdin=source.read_bytes())
+    assert _run("decompress.py", "-", "-", stdin=compressed) == source.read_bytes()
+
+# ----------------------------------------------------------------------
+
+def testStatsStayOffStandardOutput(source, tmp_path):
+    statsFile = tmp_path / "stats.json"
+    # --stats comes first, where it must not take the file names
+    compressed = _run("compress.py", "--stats", "-", "-", "--single-pass", stdin=source.read_bytes())
+    decompressed = _run("decompress.py", "--stats", "-", "-", "--stats-format", "json", "--stats-file",
+                        str(statsFile), stdin=compressed)
+
+    assert decompressed == source.read_bytes()
+    assert "decode" in json.loads(statsFile.read_text())["stages"]
+
+# ----------------------------------------------------------------------
+
+def testDeepCodes():
+    # Fibonacci frequencies give codes of up to 39 bits, which the decoding tables must hold in bounded memory
+    fib = [1, 1]
+    while len(fib) < 40:
+        fib.append(fib[-1] + fib[-2])
+    key = compress.createKey(compress.createTree(compress.createPriorityQueue(fib)))
+    lengths = {byte: length for byte, length, _ in key[1:]}
+    assert max(lengths.values()) == 39
+
+    keyTable = EncodeTable(lengths)
+    data = bytes(random.Random(0).randrange(40) for _ in range(20000))
+    encoded = io.BytesIO()
+    bitWriter = BinaryFileWriter(encoded)
+    for byte in data:
+        bitWriter.writeBits(keyTable.codes[byte], keyTable.lengths[byte])
+    bitWriter.close()
+
+    for decoder in (decompress.HuffmanDecoder(decompress.DecodeTable(key[1:])),
+                    decompress.ContextDecoder([decompress._contextTable(lengths)] * 256)):
+        decoder.feed(encoded.getvalue())
+        assert decoder.decode(len(data)) == data
+
+# ----------------------------------------------------------------------
+
+def testTruncatedData():
+    # Decoding more bytes than the input holds fails at once instead of decoding zero bits up to the count
+    data = _data()
+    key = compress.createKey(compress.createTree(compress.createPriorityQueue(compress.readFrequencies(data))))
+    lengths = {byte: length for byte, length, _ in key[1:]}
+    keyTable = EncodeTable(lengths)
+    encoded = io.BytesIO()
+    bitWriter = BinaryFileWriter(encoded)
+    for byte in data:
+        bitWriter.writeBits(keyTable.codes[byte], keyTable.lengths[byte])
+    bitWriter.close()
+
+    for count in (len(data) + 1000, 1 << 31):
+        for decoder in (decompress.HuffmanDecoder(decompress.DecodeTable(key[1:])),
+                        decompress.ContextDecoder([decompress._contextTable(lengths)] * 256)):
+            decoder.feed(encoded.getvalue())
+            with pytest.raises(ValueError, match="truncated"):
+                decoder.decode(count)
+
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize("options, sampled", [(["--jobs", "1", "--block-size", "5000"], False),
+                                              (["--single-pass", "--block-size", "4000"], True)])
+def testCorruptBlockLength(source, tmp_path, options, sampled):
+    compressedFile = _compress(source, tmp_path, options)
+    with open(compressedFile, "rb") as infile:
+        compressed = infile.read()
+
+    # Finding the first block's amount of bytes and payload length, after its code lengths
+    start = 6 if sampled else HEADER_SIZE
+    binaryReader = BinaryFileReader(io.BytesIO(compressed[start:]))
+    binaryReader.readUInt()
+    if sampled:
+        binaryReader.readUByte()
+    readLengths(binaryReader, ALPHABET_SIZE + 1 if sampled else ALPHABET_SIZE)
+    payloadOffset = start + binaryReader.infile.tell()
+
+    # Either is checked against the block size and the other before anything is decoded
+    for offset, value, message in ((start, 1 << 31, b"is larger than the block size"),
+                                   (payloadOffset, 1, b"cannot fit in a payload of 1 bytes")):
+        corrupt = bytearray(compressed)
+        struct.pack_into("<I", corrupt, offset, value)
+        with open(compressedFile, "wb") as outfile:
+            outfile.write(corrupt)
+        assert b"Block 0: Block of" in _fail("decompress.py", compressedFile, "-")
+        assert message in _fail("decompress.py", "-", "-", stdin=bytes(corrupt))
+        if not sampled:
+            assert message in _fail("decompress.py", compressedFile, "--verify")
+
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize("checksums", [True, False])
+@pytest.mark.parametrize("name, version, flags, options", [entry for entry in FORMATS if entry[1] == VERSION_BLOCKS])
+def testCorruptBlockIndex(source, tmp_path, name, version, flags, options, checksums):
+    compressedFile = _compress(source, tmp_path, options)
+    if checksums:
+        with open(compressedFile, "rb") as infile:
+            compressed = infile.read()
+    else:
+        compressed = _stripChecksums(compressedFile, version)
+    indexOffset = struct.unpack("<Q", compressed[-8:])[0]
+
+    # The trailer and every block's offsets are checked before any range is planned from them;
+    # reading the blocks in order with --jobs 1 does not need the index
+    for offset, fmt, value in ((len(compressed) - 16, "<Q", 1 << 40), (len(compressed) - 20, "<I", 1 << 31),
+                               (indexOffset, "<Q", 1 << 62), (indexOffset + 8, "<Q", 1 << 62),
+                               (len(compressed) - 8, "<Q", 1 << 62)):
+        corrupt = bytearray(compressed)
+        struct.pack_into(fmt, corrupt, offset, value)
+        with open(compressedFile, "wb") as outfile:
+            outfile.write(corrupt)
+        _fail("decompress.py", compressedFile, str(tmp_path / "decompressed"), "--jobs", "2")
+        assert b"Block index" in _fail("decompress.py", compressedFile, "--verify")
+        with pytest.raises(ValueError):
+            decompress.HuffmanReader(compressedFile)
+
+# ----------------------------------------------------------------------
+
+def testSingleCodeChecksum(source, tmp_path):
+    data = source.read_bytes()
+    key = compress.createKey(compress.createTree(compress.createPriorityQueue(compress.readFrequencies(data))))
+
+    # Files written before the checksum of the data alone, with a ULong total and both checksums, still decode
+    compressedFile = str(tmp_path / "source.hc")
+    bitWriter = BinaryFileWriter(compressedFile)
+    bitWriter.writeUInt(FORMAT_MARKER)
+    bitWriter.writeUByte(VERSION_CANONICAL)
+    bitWriter.writeUByte(FLAG_CHECKSUMS)
+    bitWriter.writeULong(len(data))
+    compress.writeLengths(bitWriter, compress._keyLengths(key))
+    compress._writeChecksums(bitWriter, compress._encode(bitWriter, [data], compress._keyCodes(key)))
+    bitWriter.close()
+    _roundTrip(compressedFile, tmp_path, data)
+
+    # Without the checksum of the file's bytes, a corrupt file is found by decoding it against the data's checksum
+    compressed = bytearray(compress.compress_bytes(data))
+    assert len(compressed) == os.path.getsize(compressedFile) - 8
+    compressed[len(compressed) // 2] ^= 0x40
+    with open(compressedFile, "wb") as outfile:
+        outfile.write(compressed)
+    assert b"corrupt" in _fail("decompress.py", compressedFile, "--verify")
+    _fail("decompress.py", compressedFile, "-")
+
+# ----------------------------------------------------------------------
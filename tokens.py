@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# tokens.py
+#
+# Extended alphabet of the token format. Besides the 256 byte values, the most frequent digrams and
+# runs of a byte value get symbols of their own, numbered from 256 up in the order of the token table
+# stored in the header, so a single code stands for several bytes.
+# ----------------------------------------------------------------------
+
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from BinaryFileIO import BinaryFileWriter, BinaryFileReader
+from canonical import ALPHABET_SIZE
+import stats
+import vectorized
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# lengths of the run tokens, longest first; a run is covered by as many of the longest tokens as fit
+RUN_LENGTHS = (32, 16, 8, 4)
+
+# fewest symbols a token has to save to be chosen, so rare tokens do not lengthen the header for nothing
+MIN_TOKEN_SCORE = 32
+
+# most symbols an extended alphabet can have, since symbols are held as 16 bit integers
+MAX_ALPHABET_SIZE = 1 << 16
+
+# longest token the token table can hold
+MAX_TOKEN_LENGTH = 0xFF
+
+# ----------------------------------------------------------------------
+
+def _runs(data, shortest: int, values: bytes = None):
+    """
+    find the runs of a byte value
+    :param data: bytes-like object
+    :param shortest: fewest repeats of a byte value that count as a run
+    :param values: byte values to find runs of, None for all of them
+    :return: iterator over the match of every maximal run, group 1 being its byte value
+    """
+    characters = b"." if values is None else b"[" + b"".join(re.escape(bytes((value,))) for value in values) + b"]"
+    return re.finditer(b"(" + characters + b")\\1{%d,}" % (shortest - 1), data, re.S)
+
+# ----------------------------------------------------------------------
+
+def countCandidates(data, backend: str = "auto") -> Dict[bytes, int]:
+    """
+    score every digram and run token of data by the number of symbols it would save
+    :param data: bytes-like object
+    :param backend: backend to count digrams with
+    :return: number of symbols saved by each token that would save any
+    """
+    scores: Dict[bytes, int] = Counter()
+    if len(data) < 2:
+        return scores
+
+    with stats.stage("histogram", len(data)):
+        # A digram saves one symbol wherever it occurs
+        if vectorized.resolveBackend(backend) == "numpy":
+            pairs = vectorized.pairFrequencies(data[1:], data[0])
+            for pair, count in enumerate(pairs):
+                if count:
+                    scores[bytes((pair >> 8, pair & 0xFF))] = count
+        else:
+            for pair, count in Counter(zip(data, data[1:])).items():
+                scores[bytes(pair)] = count
+
+        # A run token saves all but one of its bytes every time it is used to cover a run
+        for match in _runs(data, RUN_LENGTHS[-1]):
+            value = match.group(1)
+            remaining = match.end() - match.start()
+            for length in RUN_LENGTHS:
+                uses, remaining = divmod(remaining, length)
+                if uses:
+                    scores[value * length] += uses * (length - 1)
+
+    return scores
+
+# ----------------------------------------------------------------------
+
+def selectTokens(scores: Dict[bytes, int], alphabetSize: int) -> List[bytes]:
+    """
+    choose the tokens that save the most symbols
+    :param scores: number of symbols saved by each candidate token, as from countCandidates
+    :param alphabetSize: number of symbols of the extended alphabet, byte values included
+    :return: the tokens in the order of their symbols
+    """
+    ranked = sorted((token for token, score in scores.items() if score >= MIN_TOKEN_SCORE),
+                    key=lambda token: (-scores[token], token))
+    return ranked[:max(0, alphabetSize - ALPHABET_SIZE)]
+
+# ----------------------------------------------------------------------
+
+def writeTokens(writer: BinaryFileWriter, tokens: List[bytes]) -> None:
+    """
+    write the token table: a UShort number of tokens, then the UByte length and the bytes of each token
+    :param writer: file to write to
+    :param tokens: the tokens in the order of their symbols
+    :return: None
+    """
+    writer.writeUShort(len(tokens))
+    for token in tokens:
+        writer.writeUByte(len(token))
+        writer.writeBytes(token)
+
+# ----------------------------------------------------------------------
+
+def readTokens(reader: BinaryFileReader) -> List[bytes]:
+    """
+    read a token table written by writeTokens
+    :param reader: file to read from
+    :return: the tokens in the order of their symbols
+    """
+    tokens = []
+    for _ in range(reader.readUShort()):
+        length = reader.readUByte()
+        if length < 2:
+            raise ValueError("readTokens error: a token must have at least 2 bytes")
+        token = bytes(reader.readBytes(length))
+        if len(token) != length:
+            raise ValueError("Compressed file is truncated")
+        tokens.append(token)
+
+    return tokens
+
+# ----------------------------------------------------------------------
+
+class Tokenizer:
+    """
+    Splits data into symbols of an extended alphabet: byte values 0 to 255 and tokens from 256 up.
+    Runs are covered first, with the longest run tokens of their byte value that fit, then digrams are
+    taken greedily from left to right and the rest are single bytes. Both backends give the same symbols.
+    """
+
+    def __init__(self, tokens: List[bytes], backend: str = "auto"):
+        """
+        :param tokens: digrams and runs of a byte value, in the order of their symbols
+        :param backend: backend to split data with; NumPy returns the symbols as an array
+        """
+        if ALPHABET_SIZE + len(tokens) > MAX_ALPHABET_SIZE:
+            raise ValueError("Tokenizer error: at most %d tokens" % (MAX_ALPHABET_SIZE - ALPHABET_SIZE))
+        self.tokens = tokens
+        self.alphabetSize = ALPHABET_SIZE + len(tokens)
+        self.vector = vectorized.resolveBackend(backend) == "numpy"
+
+        # symbol of every digram token by its two bytes as a 16 bit integer,
+        # and (length, symbol) of the run tokens of every byte value, longest first
+        self.digrams: Dict[int, int] = {}
+        self.runTokens: Dict[int, List[Tuple[int, int]]] = {}
+        for symbol, token in enumerate(tokens, ALPHABET_SIZE):
+            if len(token) == 2:
+                self.digrams[token[0] << 8 | token[1]] = symbol
+            elif 2 < len(token) <= MAX_TOKEN_LENGTH and token == token[:1] * len(token):
+                self.runTokens.setdefault(token[0], []).append((len(token), symbol))
+            else:
+                raise ValueError("Tokenizer error: tokens must be digrams or runs of one byte value")
+        for lengths in self.runTokens.values():
+            lengths.sort(reverse=True)
+        self.shortestRun = min((length for lengths in self.runTokens.values() for length, _ in lengths), default=0)
+
+        # Digram symbols looked up by array index, -1 for pairs without a token
+        if self.vector:
+            self.digramTable = np.full(1 << 16, -1, dtype=np.int32)
+            for pair, symbol in self.digrams.items():
+                self.digramTable[pair] = symbol
+
+    # ------------------------------------------------------------------
+
+    def _coverRuns(self, data) -> List[Tuple[int, int, List[Tuple[int, int]]]]:
+        """
+        cover the runs of data with run tokens
+        :param data: bytes-like object
+        :return: (start, end, (position, symbol) of each token) of the bytes each run's tokens cover
+        """
+        covered = []
+        if not self.runTokens:
+            return covered
+
+        for match in _runs(data, self.shortestRun, bytes(self.runTokens)):
+            start = position = match.start()
+            remaining = match.end() - start
+            placed = []
+            for length, symbol in self.runTokens[data[start]]:
+                while remaining >= length:
+                    placed.append((position, symbol))
+                    position += length
+                    remaining -= length
+            if placed:
+                covered.append((start, position, placed))
+
+        return covered
+
+    # ------------------------------------------------------------------
+
+    def tokenize(self, data):
+        """
+        split data into symbols
+        :param data: bytes-like object
+        :return: list of symbols, or an array of them with the NumPy backend
+        """
+        with stats.stage("tokenize", len(data)):
+            covered = self._coverRuns(data)
+            if self.vector:
+                return self._tokenizeArray(data, covered)
+
+            # Digrams and single bytes between the runs, then the tokens of each run
+            symbols = []
+            start = 0
+            for runStart, runEnd, placed in covered:
+                self._splitDigrams(data, start, runStart, symbols)
+                symbols += [symbol for _, symbol in placed]
+                start = runEnd
+            self._splitDigrams(data, start, len(data), symbols)
+
+            return symbols
+
+    # ------------------------------------------------------------------
+
+    def _splitDigrams(self, data, start: int, end: int, symbols: List[int]) -> None:
+        """
+        split bytes into digram tokens and single bytes from left to right
+        :param data: bytes-like object
+        :param start: position of the first byte to split
+        :param end: position after the last byte to split
+        :param symbols: list to append the symbols to
+        :return: None
+        """
+        digrams = self.digrams
+        append = symbols.append
+        i = start
+        while i < end - 1:
+            symbol = digrams.get(data[i] << 8 | data[i + 1])
+            if symbol is None:
+                append(data[i])
+                i += 1
+            else:
+                append(symbol)
+                i += 2
+        if i < end:
+            append(data[i])
+
+    # ------------------------------------------------------------------
+
+    def _tokenizeArray(self, data, covered: List[Tuple[int, int, List[Tuple[int, int]]]]):
+        """
+        split data into symbols with array operations, giving the same symbols as the loop
+        :param data: bytes-like object
+        :param covered: runs covered with run tokens, from _coverRuns
+        :return: array of symbols
+        """
+        values = np.frombuffer(data, dtype=np.uint8)
+        symbols = values.astype(np.uint16)
+        inRun = np.zeros(len(values), dtype=bool)
+        for start, end, _ in covered:
+            inRun[start:end] = True
+        skipped = inRun.copy()
+
+        if len(values) > 1 and self.digrams:
+            # Pairs with a digram token outside the runs; within a stretch of consecutive such pairs the greedy
+            # split takes the first, third, fifth and so on, counting from the start of the stretch
+            pairSymbols = self.digramTable[(values[:-1].astype(np.intp) << 8) | values[1:]]
+            candidate = (pairSymbols >= 0) & ~inRun[:-1] & ~inRun[1:]
+            positions = np.arange(len(candidate))
+            first = candidate.copy()
+            first[1:] &= ~candidate[:-1]
+            stretchStart = np.maximum.accumulate(np.where(first, positions, 0))
+            taken = candidate & ((positions - stretchStart) % 2 == 0)
+
+            symbols[:-1][taken] = pairSymbols[taken]
+            skipped[1:] |= taken
+
+        # Each run is coded by its tokens alone, placed at the first byte each covers
+        placed = [token for _, _, tokens in covered for token in tokens]
+        if placed:
+            positions, runSymbols = zip(*placed)
+            symbols[list(positions)] = runSymbols
+            skipped[list(positions)] = False
+
+        return symbols[~skipped]
+
+    # ------------------------------------------------------------------
+
+    def frequencies(self, symbols) -> List[int]:
+        """
+        count how often every symbol occurs
+        :param symbols: symbols from tokenize
+        :return: frequency of each symbol of the extended alphabet
+        """
+        if self.vector:
+            return np.bincount(symbols, minlength=self.alphabetSize).tolist()
+
+        frequencies = [0] * self.alphabetSize
+        for symbol, count in Counter(symbols).items():
+            frequencies[symbol] = count
+        return frequencies
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
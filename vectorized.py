@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------------
+# vectorized.py
+#
+# Optional NumPy backend for counting byte frequencies and encoding data.
+# NumPy is not required; without it the pure Python code in compress.py is used.
+# ----------------------------------------------------------------------
+
+from typing import List, Optional, Tuple
+
+from BinaryFileIO import BinaryFileWriter
+from canonical import ALPHABET_SIZE, EncodeTable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# backends that can be asked for; auto picks numpy when it is installed
+BACKENDS = ("auto", "python", "numpy")
+
+# number of bytes encoded per vectorized step; each byte expands to one array element per code bit
+ENCODE_CHUNK_SIZE = 1 << 16
+
+# smallest chunk worth encoding in bulk; below it gathering the code arrays costs more than it saves
+MIN_VECTOR_SIZE = 1 << 12
+
+# longest code the vectorized encoder handles, since codes are gathered into 64 bit integers
+MAX_VECTOR_CODE_LENGTH = 64
+
+# ----------------------------------------------------------------------
+
+def resolveBackend(backend: str) -> str:
+    """
+    pick the backend to run with
+    :param backend: one of BACKENDS
+    :return: "numpy" or "python"
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend %s, expected one of %s" % (backend, ", ".join(BACKENDS)))
+    if backend == "numpy" and np is None:
+        raise ValueError("The numpy backend needs NumPy, which is not installed")
+    if backend == "auto":
+        return "python" if np is None else "numpy"
+
+    return backend
+
+# ----------------------------------------------------------------------
+
+def byteFrequencies(data) -> List[int]:
+    """
+    count how often every byte value occurs
+    :param data: bytes-like object
+    :return: frequency of each byte value 0 to 255
+    """
+    return np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=ALPHABET_SIZE).tolist()
+
+# ----------------------------------------------------------------------
+
+def pairFrequencies(data, previous: int) -> List[int]:
+    """
+    count how often every byte value follows every other byte value
+    :param data: bytes-like object
+    :param previous: byte value before the first byte of data
+    :return: frequency of each pair at index previous byte value * 256 + byte value
+    """
+    indices = _contextIndices(np.frombuffer(data, dtype=np.uint8), previous)
+    return np.bincount(indices, minlength=ALPHABET_SIZE * ALPHABET_SIZE).tolist()
+
+# ----------------------------------------------------------------------
+
+def _contextIndices(data, previous: int):
+    """
+    pair every byte with the byte before it
+    :param data: uint8 array of byte values
+    :param previous: byte value before the first byte of data
+    :return: array of previous byte value * 256 + byte value
+    """
+    before = np.concatenate((np.array([previous], dtype=np.uint8), data[:-1])).astype(np.intp)
+    return (before << 8) | data
+
+# ----------------------------------------------------------------------
+
+def codeArrays(keyTable: EncodeTable) -> Optional[Tuple]:
+    """
+    view the codes and code lengths of the byte values as NumPy arrays for encode
+    :param keyTable: code and code length of each byte value
+    :return: (codes, code lengths), or None if a code is too long to be encoded in bulk
+    """
+    if max(keyTable.lengths) > MAX_VECTOR_CODE_LENGTH:
+        return None
+    return (np.frombuffer(keyTable.codes, dtype=np.uint64),
+            np.frombuffer(keyTable.lengths, dtype=np.uint8).astype(np.int64))
+
+# ----------------------------------------------------------------------
+
+def contextArrays(keyTables: List[EncodeTable]) -> Optional[Tuple]:
+    """
+    gather the codes of every context into arrays indexed by previous byte value * 256 + byte value
+    :param keyTables: code and code length of each byte value for each previous byte value;
+                      contexts sharing a code share the same table
+    :return: (codes, code lengths), or None if a code is too long to be encoded in bulk
+    """
+    gathered = {}
+    for keyTable in keyTables:
+        if id(keyTable) not in gathered:
+            gathered[id(keyTable)] = codeArrays(keyTable)
+            if gathered[id(keyTable)] is None:
+                return None
+
+    return (np.concatenate([gathered[id(keyTable)][0] for keyTable in keyTables]),
+            np.concatenate([gathered[id(keyTable)][1] for keyTable in keyTables]))
+
+# ----------------------------------------------------------------------
+
+def encode(bitWriter: BinaryFileWriter, data, arrays: Tuple, previous: Optional[int] = None) -> None:
+    """
+    write the code of every byte of data, producing the same bits as writing them one code at a time
+    :param bitWriter: file to write to
+    :param data: bytes-like object to encode, or an array of symbols of an extended alphabet
+    :param arrays: (codes, code lengths) from codeArrays, or from contextArrays when previous is given
+    :param previous: byte value before data, when the code of each byte depends on the byte before it
+    :return: None
+    """
+    codes, lengths = arrays
+    data = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.uint8)
+    if previous is not None:
+        data = _contextIndices(data, previous)
+    for start in range(0, len(data), ENCODE_CHUNK_SIZE):
+        _encodeSymbols(bitWriter, data[start:start + ENCODE_CHUNK_SIZE], codes, lengths)
+
+# ----------------------------------------------------------------------
+
+def _encodeSymbols(bitWriter: BinaryFileWriter, data, codes, lengths) -> None:
+    """
+    encode one piece of data in bulk and write the whole bytes it produces
+    :param bitWriter: file to write to
+    :param data: array of byte values, or of context indices
+    :param codes: code of each byte value or context index
+    :param lengths: code length of each byte value or context index
+    :return: None
+    """
+    symbolLengths = lengths[data]
+    total = int(symbolLengths.sum())
+
+    # Every output bit is taken from the code it belongs to, counting its shift from the position
+    # of the code's last bit, which is found with a cumulative sum of the code lengths
+    ends = np.cumsum(symbolLengths)
+    shifts = np.repeat(ends, symbolLengths) - 1 - np.arange(total)
+    bits = (np.repeat(codes[data], symbolLengths) >> shifts.astype(np.uint64)) & np.uint64(1)
+
+    # Bits the writer has not written yet come first
+    pending, pendingCount = bitWriter.takeBits()
+    if pendingCount:
+        pendingBits = np.unpackbits(np.frombuffer(pending.to_bytes(8, "big"), dtype=np.uint8))[64 - pendingCount:]
+        bits = np.concatenate((pendingBits, bits.astype(np.uint8)))
+
+    # Whole bytes are packed and written at once, the last few bits are handed back to the writer
+    whole = len(bits) - len(bits) % 8
+    bitWriter.writeBytes(np.packbits(bits[:whole].astype(np.uint8)).tobytes())
+    for bit in bits[whole:].tolist():
+        bitWriter.writeBits(bit, 1)
+
+# ----------------------------------------------------------------------